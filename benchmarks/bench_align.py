@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark ROI alignment of a synthetic stack: gdal_translate subprocesses
+vs. in-process alignment to VRT files vs. in-memory alignment.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+from giant_time_series.synthetic import write_stack
+from giant_time_series.utils import gdal_translate, align_roi
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def get_vrts(prod):
+    """Return input/output VRTs of unwrapped phase and coherence."""
+
+    merged_dir = os.path.join(prod, "merged")
+    return [
+        (os.path.join(merged_dir, "filt_topophase.unw.geo.vrt"),
+         os.path.join(merged_dir, "aligned.unw.vrt"), 2),
+        (os.path.join(merged_dir, "phsig.cor.geo.vrt"),
+         os.path.join(merged_dir, "aligned.cor.vrt"), 1),
+    ]
+
+
+def subprocess_align(prods, roi):
+    for prod in prods:
+        for vrt_in, vrt_out, band in get_vrts(prod):
+            gdal_translate(vrt_in, vrt_out, *roi, 0., band)
+
+
+def inprocess_align(prods, roi):
+    for prod in prods:
+        for vrt_in, vrt_out, band in get_vrts(prod):
+            align_roi(vrt_in, vrt_out, *roi, 0., band)
+
+
+def inmemory_align(prods, roi):
+    for prod in prods:
+        for vrt_in, vrt_out, band in get_vrts(prod):
+            ds = align_roi(vrt_in, None, *roi, 0., band)
+            ds.GetRasterBand(1).ReadAsArray(0, 0, 11, 11)
+            ds = None
+
+
+def main(count, size, work_dir):
+    """Run benchmark."""
+
+    stack_dir = tempfile.mkdtemp(dir=work_dir)
+    cwd = os.getcwd()
+    try:
+        logger.info("Writing {} synthetic products to {}".format(count, stack_dir))
+        prods = write_stack(stack_dir, count, shape=(size, size))
+        os.chdir(stack_dir)
+        roi = (34.5 - .8*size*.001, 34.5 - .1*size*.001,
+               -118.5 + .1*size*.001, -118.5 + .8*size*.001)
+        results = []
+        for name, func in [("gdal_translate subprocess", subprocess_align),
+                           ("in-process VRT files", inprocess_align),
+                           ("in-process in-memory", inmemory_align)]:
+            t0 = time.time()
+            func(prods, roi)
+            elapsed = time.time() - t0
+            results.append((name, elapsed))
+            logger.info("{}: {:.2f}s".format(name, elapsed))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(stack_dir)
+
+    base = results[0][1]
+    print("{:<28} {:>10} {:>12} {:>9}".format("method", "total (s)", "per prod (ms)", "speedup"))
+    for name, elapsed in results:
+        print("{:<28} {:>10.2f} {:>12.2f} {:>8.1f}x".format(
+              name, elapsed, elapsed/count*1000., base/elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=500, help="number of products")
+    parser.add_argument("--size", type=int, default=256, help="raster width/length")
+    parser.add_argument("--work_dir", default=None, help="scratch directory")
+    args = parser.parse_args()
+    main(args.count, args.size, args.work_dir)
+    sys.exit(0)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite of the filter stage on synthetic stacks of increasing size.
+For each stack size, every stage (envelope computation, footprint index build
+plus 1000 ROI queries, and filter_ifgs) runs
+in a fresh process and its throughput (products/s), peak RSS (including
+worker processes) and bytes read (from /proc/self/io, including reaped
+worker processes) are reported.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+import tempfile
+import logging
+
+from giant_time_series.synthetic import write_stack
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+STAGES = ('envelope', 'footprint', 'filter')
+
+# geotransform of the synthetic products
+GT = (-118.5, .001, 0., 34.5, 0., -.001)
+
+
+def get_io():
+    """Return (rchar, read_bytes) of this process: bytes read through read
+       syscalls and bytes fetched from storage. None if unavailable."""
+
+    try:
+        with open("/proc/self/io") as f:
+            io = dict([i.split(': ') for i in f.read().splitlines()])
+    except (OSError, ValueError): return None, None
+    return int(io['rchar']), int(io['read_bytes'])
+
+
+def get_peak_rss():
+    """Return peak RSS in bytes of this process and its reaped children."""
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * 1024 if sys.platform != "darwin" else peak
+
+
+def get_roi(size):
+    """Return ROI bbox and reference point inside the synthetic footprint."""
+
+    min_lat, max_lat = GT[3] + .8*size*GT[5], GT[3] + .1*size*GT[5]
+    min_lon, max_lon = GT[0] + .1*size*GT[1], GT[0] + .8*size*GT[1]
+    return (min_lat, max_lat, min_lon, max_lon,
+            (min_lat + max_lat)/2., (min_lon + max_lon)/2.)
+
+
+def run_stage(stage, stack_dir, size, nproc):
+    """Run stage on the stack in the current process and print its metrics
+       as JSON."""
+
+    os.chdir(stack_dir)
+    with open("products.json") as f:
+        prods = json.load(f)
+    min_lat, max_lat, min_lon, max_lon, ref_lat, ref_lon = get_roi(size)
+    rchar0, read_bytes0 = get_io()
+    t0 = time.time()
+    if stage == 'envelope':
+        from giant_time_series.utils import get_envelope
+        get_envelope(prods)
+    elif stage == 'footprint':
+        from giant_time_series.footprint import FootprintIndex, get_footprints
+        index = FootprintIndex(get_footprints([os.path.join(p, "merged", "filt_topophase.unw.geo.vrt")
+                                               for p in prods]))
+        for i in range(1000):
+            index.overlap_fraction((min_lon, max_lon, min_lat, max_lat))
+    elif stage == 'filter':
+        from giant_time_series.filt import filter_ifgs
+        filter_ifgs(prods, min_lat, max_lat, min_lon, max_lon, ref_lat, ref_lon,
+                    5, 5, .3, .2, 100., 100., 39., .05, False, False, 64,
+                    nproc=nproc)
+    else: raise RuntimeError("Unknown stage: {}".format(stage))
+    elapsed = time.time() - t0
+    rchar1, read_bytes1 = get_io()
+    print(json.dumps({
+        'elapsed': elapsed,
+        'peak_rss': get_peak_rss(),
+        'rchar': None if rchar0 is None else rchar1 - rchar0,
+        'read_bytes': None if read_bytes0 is None else read_bytes1 - read_bytes0,
+    }))
+
+
+def fmt_bytes(n):
+    if n is None: return "n/a"
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024. or unit == 'GiB': break
+        n /= 1024.
+    return "{:.1f}{}".format(n, unit)
+
+
+def main(counts, stages, size, overlap, dup_rate, noise, nproc, work_dir):
+    """Run benchmark suite."""
+
+    print("{:>6} {:<9} {:>9} {:>11} {:>10} {:>10} {:>10}".format(
+          "count", "stage", "time (s)", "products/s", "peak RSS", "read", "disk read"))
+    for count in counts:
+        stack_dir = tempfile.mkdtemp(dir=work_dir)
+        try:
+            logger.info("Writing {} synthetic products to {}".format(count, stack_dir))
+            prods = write_stack(stack_dir, count, shape=(size, size), gt=GT,
+                                overlap=overlap, dup_rate=dup_rate, noise=noise)
+            with open(os.path.join(stack_dir, "products.json"), 'w') as f:
+                json.dump(prods, f)
+            for stage in stages:
+                cmd = [sys.executable, os.path.abspath(__file__), "--run_stage", stage,
+                       "--stack_dir", stack_dir, "--size", str(size)]
+                if nproc is not None: cmd.extend(["--nproc", str(nproc)])
+                proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      universal_newlines=True)
+                if proc.returncode != 0:
+                    raise RuntimeError("Stage {} failed:\n{}".format(stage, proc.stderr))
+                res = json.loads(proc.stdout.strip().splitlines()[-1])
+                print("{:>6} {:<9} {:>9.2f} {:>11.1f} {:>10} {:>10} {:>10}".format(
+                      count, stage, res['elapsed'], count/res['elapsed'],
+                      fmt_bytes(res['peak_rss']), fmt_bytes(res['rchar']),
+                      fmt_bytes(res['read_bytes'])))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(stack_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", default="50,500,5000",
+                        help="comma separated stack sizes")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated stages: {}".format(", ".join(STAGES)))
+    parser.add_argument("--size", type=int, default=64, help="raster width/length")
+    parser.add_argument("--overlap", type=float, default=.9,
+                        help="footprint overlap between products")
+    parser.add_argument("--dup_rate", type=float, default=.05,
+                        help="fraction of duplicate date pairs")
+    parser.add_argument("--noise", type=float, default=.5,
+                        help="phase noise standard deviation (radians)")
+    parser.add_argument("--nproc", type=int, default=None,
+                        help="filter workers (default: available CPUs)")
+    parser.add_argument("--work_dir", default=None, help="scratch directory")
+    parser.add_argument("--run_stage", help=argparse.SUPPRESS)
+    parser.add_argument("--stack_dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_stage:
+        run_stage(args.run_stage, args.stack_dir, args.size, args.nproc)
+    else:
+        main([int(i) for i in args.counts.split(',')], args.stages.split(','),
+             args.size, args.overlap, args.dup_rate, args.noise, args.nproc,
+             args.work_dir)
+    sys.exit(0)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark product metadata extraction of a synthetic stack: full unpickling
+of PICKLE/computeBaselines and ISCE ProductManager loading of
+fine_interferogram.xml vs. the lightweight extractor in giant_time_series.meta
+(cold and warm per-product cache). The ISCE case is skipped if ISCE cannot
+be imported.
+"""
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import logging
+
+from giant_time_series import meta
+from giant_time_series.utils import get_bperp
+from giant_time_series.synthetic import write_stack
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def get_files(prod):
+    """Return computeBaselines pickle and fine_interferogram.xml of product."""
+
+    return (os.path.join(prod, "PICKLE", "computeBaselines"),
+            os.path.join(prod, "fine_interferogram.xml"))
+
+
+def isce_extract(prods):
+    import isce
+    from iscesys.Component.ProductManager import ProductManager as PM
+    for prod in prods:
+        cb_pkl, ifg_xml = get_files(prod)
+        with open(cb_pkl, 'rb') as f:
+            catalog = pickle.load(f)
+        get_bperp(catalog)
+        pm = PM()
+        pm.configure()
+        ifg_obj = pm.loadProduct(ifg_xml)
+        ifg_obj.bursts[0].orbit.getENUHeading(ifg_obj.bursts[0].sensingMid)
+
+
+def fast_extract(prods):
+    for prod in prods:
+        cb_pkl, ifg_xml = get_files(prod)
+        meta.get_baseline_info(cb_pkl)
+        if meta.get_sensing_info(ifg_xml) is None:
+            raise RuntimeError("Failed to extract sensing info of {}".format(prod))
+
+
+def main(count, work_dir):
+    """Run benchmark."""
+
+    stack_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        logger.info("Writing {} synthetic products to {}".format(count, stack_dir))
+        prods = [os.path.join(stack_dir, i) for i in
+                 write_stack(stack_dir, count, shape=(16, 16), isce_meta=True)]
+        results = []
+        cases = [("ISCE", isce_extract),
+                 ("lightweight (cold cache)", fast_extract),
+                 ("lightweight (warm cache)", fast_extract)]
+        for name, func in cases:
+            t0 = time.time()
+            try: func(prods)
+            except ImportError as e:
+                logger.info("Skipping {}: {}".format(name, str(e)))
+                continue
+            elapsed = time.time() - t0
+            results.append((name, elapsed))
+            logger.info("{}: {:.2f}s".format(name, elapsed))
+    finally:
+        shutil.rmtree(stack_dir)
+
+    base = results[0][1]
+    print("{:<28} {:>10} {:>13} {:>9}".format("method", "total (s)", "per prod (ms)", "speedup"))
+    for name, elapsed in results:
+        print("{:<28} {:>10.3f} {:>13.3f} {:>8.1f}x".format(
+              name, elapsed, elapsed/count*1000., base/elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=500, help="number of products")
+    parser.add_argument("--work_dir", default=None, help="scratch directory")
+    args = parser.parse_args()
+    main(args.count, args.work_dir)
+    sys.exit(0)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark render time of the network plots (plot_stack() and
+plot_network()) on synthetic networks of increasing size. Fails if the
+render time of the largest network exceeds the one of the smallest by more
+than the allowed ratio, i.e. if render time does not stay roughly flat.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+import numpy as np
+from datetime import datetime, timedelta
+
+from giant_time_series.plot import plot_stack, plot_network
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def get_network(count, seed=0):
+    """Return count (master, slave) date pairs of 6-day acquisitions, each
+       pairing an epoch with one of the next 5, and their perpendicular
+       baselines."""
+
+    rng = np.random.RandomState(seed)
+    epochs = max(10, count // 20)
+    dates = [datetime(2017, 1, 1) + timedelta(days=6*i) for i in range(epochs)]
+    baselines = rng.normal(0., 50., epochs)
+    pairs, bperps = [], []
+    for i in rng.randint(0, epochs - 1, count):
+        j = min(epochs - 1, i + rng.randint(1, 6))
+        pairs.append((dates[j], dates[i]))
+        bperps.append(baselines[i] - baselines[j])
+    return pairs, bperps
+
+
+def main(counts, repeat, max_ratio, work_dir):
+    """Run benchmark."""
+
+    tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        # warm up imports
+        pairs, bperps = get_network(10)
+        plot_stack(pairs, os.path.join(tmp_dir, "warmup.png"))
+        times = {}
+        print("{:>7} {:>15} {:>17}".format("pairs", "plot_stack (s)", "plot_network (s)"))
+        for count in counts:
+            pairs, bperps = get_network(count)
+            stack, network = [], []
+            for i in range(repeat):
+                t0 = time.time()
+                plot_stack(pairs, os.path.join(tmp_dir, "browse.png"))
+                stack.append(time.time() - t0)
+                t0 = time.time()
+                plot_network(pairs, bperps, os.path.join(tmp_dir, "network.png"))
+                network.append(time.time() - t0)
+            times[count] = (min(stack), min(network))
+            print("{:>7} {:>15.3f} {:>17.3f}".format(count, *times[count]))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    ratios = [b / a for a, b in zip(times[counts[0]], times[counts[-1]])]
+    logger.info("Render time ratio {} vs. {} pairs: plot_stack {:.2f}, plot_network {:.2f}".format(
+                counts[-1], counts[0], *ratios))
+    if max(ratios) > max_ratio:
+        logger.error("Render time ratio exceeds {}".format(max_ratio))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", default="100,1000,10000",
+                        help="comma separated numbers of pairs")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per network (fastest is reported)")
+    parser.add_argument("--max_ratio", type=float, default=4.,
+                        help="allowed render time ratio of the largest vs. smallest network")
+    parser.add_argument("--work_dir", default=None, help="scratch directory")
+    args = parser.parse_args()
+    sys.exit(main([int(i) for i in args.counts.split(',')], args.repeat,
+                  args.max_ratio, args.work_dir))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark single-pixel (full time series) and single-epoch (full map) read
+latency of a synthetic GIAnT time series file as GIAnT writes it (contiguous)
+and after rechunk_ts() with each chunk layout. Every read opens the file
+anew so HDF5's chunk cache does not carry over between reads; pass
+--drop_caches (root) to also drop the OS page cache before every read.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+import subprocess
+import numpy as np
+
+from giant_time_series.synthetic import write_ts_file
+from giant_time_series.rechunk import LAYOUTS, TILE_SUFFIX, rechunk_ts
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def drop_caches():
+    """Drop the OS page cache (Linux, root only)."""
+
+    subprocess.check_call("sync", shell=True)
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def time_reads(h5_file, dset_name, selections, drop):
+    """Return median and max latency (ms) of reading each selection of
+       dset_name from a freshly opened h5_file."""
+
+    import h5py
+
+    latencies = []
+    for sel in selections:
+        if drop: drop_caches()
+        t0 = time.time()
+        with h5py.File(h5_file, 'r') as h5f:
+            h5f[dset_name][sel]
+        latencies.append((time.time() - t0) * 1000.)
+    return np.median(latencies), np.max(latencies)
+
+
+def main(epochs, size, reads, nproc, drop, work_dir):
+    """Run benchmark."""
+
+    rng = np.random.RandomState(0)
+    tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        src = os.path.join(tmp_dir, "LS-PARAMS.h5")
+        logger.info("Writing {}x{}x{} synthetic time series to {}".format(epochs, size, size, src))
+        write_ts_file(src, epochs, shape=(size, size))
+        pixels = [(slice(None), int(y), int(x)) for y, x in rng.randint(0, size, (reads, 2))]
+        maps = [(int(t), slice(None), slice(None)) for t in rng.randint(0, epochs, reads)]
+
+        files = [('contiguous', src, None)]
+        for layout in LAYOUTS:
+            dst = os.path.join(tmp_dir, "LS-PARAMS-{}.h5".format(layout))
+            t0 = time.time()
+            chunks = rechunk_ts(src, layout=layout, out_file=dst, nproc=nproc,
+                                lats=np.arange(size), lons=np.arange(size))
+            files.append((layout, dst, (time.time() - t0, chunks)))
+
+        print("{:<11} {:>9} {:>11} {:>17} {:>17} {:>17}".format(
+              "layout", "size", "rechunk (s)", "pixel med/max ms", "epoch med/max ms",
+              "chunks"))
+        for layout, h5_file, info in files:
+            pixel = time_reads(h5_file, "rawts", pixels, drop)
+            epoch_dset = "rawts" + TILE_SUFFIX if layout == 'both' else "rawts"
+            epoch = time_reads(h5_file, epoch_dset, maps, drop)
+            print("{:<11} {:>8.1f}M {:>11} {:>17} {:>17} {:>17}".format(
+                  layout, os.path.getsize(h5_file) / 1024. / 1024.,
+                  "-" if info is None else "{:.2f}".format(info[0]),
+                  "{:.2f}/{:.2f}".format(*pixel), "{:.2f}/{:.2f}".format(*epoch),
+                  "-" if info is None else "/".join([str(info[1][k]) for k in
+                                                     sorted(info[1]) if k.startswith("rawts")])))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--epochs", type=int, default=100, help="number of epochs")
+    parser.add_argument("--size", type=int, default=1000, help="raster width/length")
+    parser.add_argument("--reads", type=int, default=20, help="reads per query type")
+    parser.add_argument("--nproc", type=int, default=None,
+                        help="compression threads (default: available CPUs)")
+    parser.add_argument("--drop_caches", action="store_true",
+                        help="drop the OS page cache before every read (root only)")
+    parser.add_argument("--work_dir", default=None, help="scratch directory")
+    args = parser.parse_args()
+    main(args.epochs, args.size, args.reads, args.nproc, args.drop_caches, args.work_dir)
+    sys.exit(0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cold start import time of the giant_time_series package
+modules and PGE entry point scripts with `python -X importtime`. Each entry
+point is imported (scripts are run under a name other than __main__) in a
+fresh interpreter and checked against a time budget and a list of heavy
+modules which must only be imported on first use. Exits with status 1 if
+any budget is exceeded or an entry point fails to import. Site modules of a
+HySDS deployment (ALLOWED_MISSING) may be missing, in which case the imports
+before them are measured.
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+import logging
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_PATH = os.path.join(BASE_PATH, "scripts")
+
+IMPORT_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+MISSING_RE = re.compile(r"^ModuleNotFoundError: No module named '([^']+)'", re.M)
+
+# site modules provided by a HySDS deployment, not this package
+ALLOWED_MISSING = ('celeryconfig',)
+
+# modules that should not be imported at startup
+HEAVY_MODULES = ('osgeo', 'h5py', 'scipy', 'requests', 'isce', 'iscesys',
+                 'matplotlib', 'pandas')
+
+# entry point: (import statement, budget in seconds)
+ENTRY_POINTS = {
+    'giant_time_series.utils': ("import giant_time_series.utils", .5),
+    'giant_time_series.filt': ("import giant_time_series.filt", .5),
+    'giant_time_series.plot': ("import giant_time_series.plot", .5),
+}
+for script in ("create_displacement_time_series.py",
+               "create_filtered_ifg_stack.py",
+               "create_filtered_gunw_merged_stack.py",
+               "sweep_filter_thresholds.py"):
+    ENTRY_POINTS[script] = ("import runpy; runpy.run_path({!r}, run_name='startup')".format(
+                            os.path.join(SCRIPTS_PATH, script)), 1.)
+
+
+def get_import_times(stmt):
+    """Return total import time in seconds, per module self import times
+       of stmt in a fresh interpreter and the allowed missing module that
+       stopped the import, if any."""
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([BASE_PATH] + [i for i in [env.get('PYTHONPATH')] if i])
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", stmt],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, cwd=SCRIPTS_PATH, env=env)
+    missing = None
+    if proc.returncode != 0:
+        match = MISSING_RE.search(proc.stderr)
+        if not match or match.group(1).split('.')[0] not in ALLOWED_MISSING:
+            raise RuntimeError("Failed to import:\n{}".format(proc.stderr))
+        missing = match.group(1)
+    total = 0
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORT_RE.search(line)
+        if not match: continue
+        self_us, cum_us, indent, name = match.groups()
+        total += int(self_us)
+        modules[name] = int(self_us)/1e6
+    return total/1e6, modules, missing
+
+
+def main(repeat, scale, top):
+    """Run benchmark."""
+
+    over_budget = []
+    failed = []
+    print("{:<40} {:>9} {:>9}  {}".format("entry point", "time (s)", "budget", "heavy imports"))
+    for name in sorted(ENTRY_POINTS):
+        stmt, budget = ENTRY_POINTS[name]
+        budget *= scale
+        try: runs = [get_import_times(stmt) for i in range(repeat)]
+        except RuntimeError as e:
+            logger.error("Failed {}: {}".format(name, str(e).splitlines()[-1]))
+            failed.append(name)
+            continue
+        total, modules, missing = min(runs, key=lambda x: x[0])
+        heavy = sorted(set([i.split('.')[0] for i in modules
+                            if i.split('.')[0] in HEAVY_MODULES]))
+        note = " (without {})".format(missing) if missing else ""
+        print("{:<40} {:>9.3f} {:>9.3f}  {}{}".format(name, total, budget, ", ".join(heavy), note))
+        for mod, elapsed in sorted(modules.items(), key=lambda x: -x[1])[:top]:
+            print("    {:<36} {:>9.3f}".format(mod, elapsed))
+        if total > budget or heavy: over_budget.append(name)
+    if failed:
+        logger.error("Failed to import: {}".format(", ".join(failed)))
+    if over_budget:
+        logger.error("Over budget: {}".format(", ".join(over_budget)))
+    return 1 if failed or over_budget else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per entry point (fastest is reported)")
+    parser.add_argument("--scale", type=float, default=1.,
+                        help="scale factor applied to the time budgets")
+    parser.add_argument("--top", type=int, default=5,
+                        help="number of slowest module imports to show")
+    args = parser.parse_args()
+    sys.exit(main(args.repeat, args.scale, args.top))
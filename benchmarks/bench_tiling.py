@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark throughput (pixels/s), parallel efficiency and peak worker RSS of
+the tiled out-of-core inversion (invert_tiled()) of a synthetic processed
+stack with increasing numbers of worker processes.
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import logging
+import subprocess
+
+from giant_time_series.synthetic import write_stack_file
+from giant_time_series.utils import get_cpu_count
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+RUN_TMPL = """
+import json, resource
+from giant_time_series.tiling import invert_tiled
+stats = invert_tiled({stack_file!r}, {out_file!r}, {method!r}, nproc={nproc},
+                     tile_bytes={tile_bytes}, nvalid=1)
+stats['max_rss_children'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+stats['max_rss_self'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps(stats))
+"""
+
+
+def run(stack_file, out_file, method, nproc, tile_bytes):
+    """Run invert_tiled() in a fresh interpreter (so peak RSS is per run) and
+       return its stats."""
+
+    import json
+
+    out = subprocess.check_output([sys.executable, "-c", RUN_TMPL.format(
+        stack_file=stack_file, out_file=out_file, method=method, nproc=nproc,
+        tile_bytes=tile_bytes)], stderr=subprocess.DEVNULL)
+    return json.loads(out.decode().strip().split("\n")[-1])
+
+
+def main(epochs, size, span, method, nprocs, tile_mb, work_dir):
+    """Run benchmark."""
+
+    tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        stack_file = os.path.join(tmp_dir, "PROC-STACK.h5")
+        logger.info("Writing {} epoch {}x{} synthetic stack to {}".format(epochs, size, size,
+                                                                          stack_file))
+        write_stack_file(stack_file, epochs, shape=(size, size), span=span,
+                         chunks=(1, 128, 128), nan_frac=.0002, noise=1.)
+        print("{:>6} {:>10} {:>12} {:>8} {:>11} {:>15}".format(
+              "nproc", "time (s)", "pixels/s", "speedup", "efficiency", "worker RSS (MB)"))
+        base = None
+        for nproc in nprocs:
+            out_file = os.path.join(tmp_dir, "out-{}.h5".format(nproc))
+            stats = run(stack_file, out_file, method, nproc, int(tile_mb * 1024 * 1024))
+            if base is None: base = stats['elapsed'] * nprocs[0]
+            rss = stats['max_rss_children'] if nproc > 1 else stats['max_rss_self']
+            print("{:>6} {:>10.2f} {:>12.0f} {:>8.2f} {:>10.0f}% {:>15.0f}".format(
+                  nproc, stats['elapsed'], stats['pixels_per_s'], base / stats['elapsed'],
+                  100. * base / stats['elapsed'] / nproc, rss / 1024.))
+            sys.stdout.flush()
+            os.unlink(out_file)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    cpus = get_cpu_count()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--epochs", type=int, default=60, help="number of epochs")
+    parser.add_argument("--size", type=int, default=1000, help="raster width/length")
+    parser.add_argument("--span", type=int, default=4, help="pairs per epoch")
+    parser.add_argument("--method", default="sbas", choices=("sbas", "nsbas"))
+    parser.add_argument("--nprocs", default=",".join([str(i) for i in (1, 2, 4, 8, 16)
+                                                      if i <= cpus] or ["1"]),
+                        help="comma separated numbers of workers (default: up to available CPUs)")
+    parser.add_argument("--tile_mb", type=float, default=16., help="MB of ifgs per tile")
+    parser.add_argument("--work_dir", default=None, help="scratch directory")
+    args = parser.parse_args()
+    main(args.epochs, args.size, args.span, args.method,
+         [int(i) for i in args.nprocs.split(',')], args.tile_mb, args.work_dir)
+    sys.exit(0)
@@ -0,0 +1,183 @@
+import os
+import time
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import logging
+from collections import OrderedDict
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# default upper bound on the size of the screening cache
+MAX_BYTES = 1024 * 1024 * 1024
+
+# coherence thresholds for which per-column valid counts are cached
+COHERENCE_LEVELS = tuple([round(i * .05, 2) for i in range(20)])
+
+# entry kinds
+KINDS = ('meta', 'columns', 'ref')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+"""
+
+
+def get_file_key(*paths):
+    """Return (path, size, mtime) of files identifying their content. Missing
+       files are recorded as such."""
+
+    key = []
+    for path in paths:
+        try: st = os.stat(path)
+        except OSError: key.append((path, None, None))
+        else: key.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(key)
+
+
+class ScreenCache(object):
+    """Persistent, size-bounded LRU cache of per-product screening results.
+
+       Entries are pickled, zlib-compressed and stored in a SQLite database
+       so concurrent filter workers can share it. Kinds of entries:
+         meta    - parsed product metadata
+         columns - aligned raster geometry and per-column valid counts at
+                   COHERENCE_LEVELS (plus any other requested threshold)
+         ref     - coherence and phase values of the reference window
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {k: {'hits': 0, 'misses': 0} for k in KINDS}
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(cache_dir): os.makedirs(cache_dir, 0o755)
+        self.conn = sqlite3.connect(path, timeout=300.)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def _hash(self, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, kind, key):
+        """Return cached value or None if not cached."""
+
+        h = self._hash(key)
+        row = self.conn.execute("SELECT value FROM entries WHERE kind=? AND key=?",
+                                (kind, h)).fetchone()
+        if row is None:
+            self.stats[kind]['misses'] += 1
+            return None
+        self.stats[kind]['hits'] += 1
+        with self.conn:
+            self.conn.execute("UPDATE entries SET atime=? WHERE kind=? AND key=?",
+                              (time.time(), kind, h))
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, kind, key, value):
+        """Cache value and evict least recently used entries over the size bound."""
+
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                              (kind, self._hash(key), sqlite3.Binary(blob),
+                               len(blob), time.time()))
+        self.evict()
+
+    def evict(self):
+        """Evict least recently used entries until the cache fits max_bytes."""
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes: return
+        evicted = 0
+        with self.conn:
+            rows = self.conn.execute("SELECT kind, key, size FROM entries ORDER BY atime")
+            for kind, key, size in rows.fetchall():
+                if total <= self.max_bytes: break
+                self.conn.execute("DELETE FROM entries WHERE kind=? AND key=?", (kind, key))
+                total -= size
+                evicted += 1
+        logger.info("Evicted {} entries from {}".format(evicted, self.path))
+
+    def pop_stats(self):
+        """Return hit/miss statistics since the last call and reset them."""
+
+        stats = self.stats
+        self.stats = {k: {'hits': 0, 'misses': 0} for k in KINDS}
+        return stats
+
+    def close(self):
+        self.conn.close()
+
+
+class LRUCache(object):
+    """In-memory LRU cache bounded by its number of entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        """Return cached value or None if not cached."""
+
+        value = self.entries.get(key)
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Cache value and evict the least recently used entries over the bound."""
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def pop_stats(self):
+        """Return hit/miss statistics since the last call and reset them."""
+
+        stats = self.stats
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        return stats
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def merge_stats(stats, other):
+    """Add hit/miss counts of other into stats."""
+
+    for kind in other:
+        for i in other[kind]:
+            stats.setdefault(kind, {}).setdefault(i, 0)
+            stats[kind][i] += other[kind][i]
+    return stats
+
+
+def log_stats(stats, path):
+    """Log hit/miss statistics of the screening cache."""
+
+    for kind in KINDS:
+        if kind not in stats: continue
+        hits, misses = stats[kind]['hits'], stats[kind]['misses']
+        total = hits + misses
+        logger.info("Screen cache {} {}: {} hits, {} misses ({:.1f}% hit rate)".format(
+                    path, kind, hits, misses, 100.*hits/total if total else 0.))
@@ -1,21 +1,21 @@
 import os
 import re
 import json
+import numbers
 import logging
-import pickle
+import multiprocessing
 import numpy as np
-from osgeo import gdal
-from gdalconst import GA_ReadOnly
 from glob import glob
 from datetime import datetime, timedelta
 
-import isce
-from iscesys.Component.ProductManager import ProductManager as PM
-
-from .utils import get_bperp, gdal_translate, get_geocoded_coords
-
-
-gdal.UseExceptions() # make GDAL raise python exceptions
+from .utils import GeoGrid, align_roi, get_cpu_count, merge_intervals
+from .network import is_connected, get_gaps
+from .meta import get_baseline_info, get_sensing_info
+from .footprint import FootprintIndex
+from .screen import read_window, get_ref_mean, get_column_counts
+from .cache import (ScreenCache, MAX_BYTES, COHERENCE_LEVELS, get_file_key,
+                    merge_stats, log_stats)
+from .stack import get_pixel_files, open_pixel_files
 
 
 log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
@@ -38,281 +38,757 @@ SENSORS = {
 
 ID_DT_RE = re.compile(r'.*?_(\d{4}\d{2}\d{2})')
 
+# date ID soft links (and their temporary names) created by link_ifgs
+LINK_RE = re.compile(r'^\d{8}_\d{8}(\.\d+\.tmp)?$')
+
+# screening caches opened by this process
+_CACHES = {}
+
+def _get_data_dir(ifg_prod):
+    """Return directory of the unwrapped phase and correlation products."""
+
+    merged_dir = os.path.join(ifg_prod, "merged")
+    return merged_dir if os.path.exists(merged_dir) else ifg_prod
+
+
+def _plan_ifg(prod_num, prod_count, ifg_prod, track):
+    """Parse interferogram product metadata and apply the metadata-only
+       filters. Return the product's metadata or None if it was filtered out."""
+
+    logger.info('Planning: {} ({} of {})'.format(ifg_prod, prod_num+1, prod_count))
+
+    # get IFG metadata
+    ifg_met_file = glob("{}/*.met.json".format(ifg_prod))[0]
+    with open(ifg_met_file) as f:
+        ifg_met = json.load(f)
+
+    # extract master and slave dates
+    match = ID_DT_RE.search(ifg_met["reference_scenes"][0])
+    if not match: raise RuntimeError("Failed to extract master date.")
+    master_date = datetime.strptime(match.group(1), "%Y%m%d")
+    match = ID_DT_RE.search(ifg_met["secondary_scenes"][0])
+    if not match: raise RuntimeError("Failed to extract slave date.")
+    slave_date = datetime.strptime(match.group(1), "%Y%m%d")
+
+    # filter out product from different track
+    trackNumber = ifg_met["track_number"]
+    if int(trackNumber) != int(track):
+        logger.info('Filtered out {}: unmatched track {}'.format(ifg_prod, trackNumber))
+        return None
+
+    ## filter out product from different subswath
+    #swath = ifg_met['swath'] if isinstance(ifg_met['swath'], list) else [ ifg_met['swath'] ]
+    #if set(swath) != set(subswath):
+    #    logger.info('Filtered out {}: unmatched subswath {}'.format(ifg_prod, swath))
+    #    return None
+
+    # extract sensing start and stop dates
+    sensingStarts = ifg_met["sensing_start"] if isinstance(ifg_met["sensing_start"], list) else [ ifg_met["sensing_start"]]
+    sensingStarts.sort()
+    match = DT_RE.search(sensingStarts[0])
+    if not match: raise RuntimeError("Failed to extract start date.")
+    start_dt = ''.join(match.groups()[:3])
+    start_time = datetime.strptime(sensingStarts[0], "%Y-%m-%dT%H:%M:%S.%fZ")
+    sensingStops = ifg_met["sensing_stop"] if isinstance(ifg_met["sensing_stop"], list) else [ ifg_met["sensing_stop"] ]
+    sensingStops.sort()
+    match = DT_RE.search(sensingStops[-1])
+    if not match: raise RuntimeError("Failed to extract stop date.")
+    stop_dt = ''.join(match.groups()[:3])
+    stop_time = datetime.strptime(sensingStops[-1], "%Y-%m-%dT%H:%M:%S.%fZ")
+
+    # extract perpendicular baseline and sensor for ifg.list input file
+    cb_pkl = os.path.join(ifg_prod, "PICKLE", "computeBaselines")
+    if os.path.exists(cb_pkl):
+        baseline_info = get_baseline_info(cb_pkl)
+        bperp = baseline_info['bperp']
+        sensor = baseline_info['master_mission']
+        if sensor is None: sensor = baseline_info['slave_mission']
+        if sensor is None and baseline_info['imagingmode'] == "TOPS":
+            sensor = "S1X"
+        if sensor is None:
+            logger.warn("{} will be thrown out. Failed to extract sensor".format(ifg_prod))
+            return None
+    else:
+        bperp = 0.
+        if re.search(r'^S1', ifg_prod): sensor = 'S1X'
+        else:
+            raise RuntimeError("Cannot determine sensor: {}".format(ifg_prod))
 
-def filter_ifgs(ifg_prods, min_lat, max_lat, min_lon, max_lon, ref_lat,
-                ref_lon, ref_width, ref_height, covth, cohth, range_pixel_size,
-                azimuth_pixel_size, inc, filt, netramp, gpsramp,
-                track):
-    """Filter input interferogram products."""
+    # get orbit direction to estimate heading
+    direction = ifg_met["orbit_direction"]
 
-    # align images
-    center_lines_utc = []
-    ifg_info = {}
-    ifg_coverage = {}
-    print('ifg_prods: {}'.format(ifg_prods))
-    for prod_num, ifg_prod in enumerate(ifg_prods):
-        logger.info('#' * 80)
-        logger.info('Processing: {} ({} of {}) (current stack count: {})'.format(
-                    ifg_prod, prod_num+1, len(ifg_prods)+1, len(ifg_info)))
-        logger.info('-' * 80)
-
-        # get IFG metadata
-        ifg_met_file = glob("{}/*.met.json".format(ifg_prod))[0]
-        with open(ifg_met_file) as f:
-            ifg_met = json.load(f)
-
-        # extract master and slave dates
-        match = ID_DT_RE.search(ifg_met["reference_scenes"][0])
-        if not match: raise RuntimeError("Failed to extract master date.")
-        master_date = datetime.strptime(match.group(1), "%Y%m%d")
-        match = ID_DT_RE.search(ifg_met["secondary_scenes"][0])
-        if not match: raise RuntimeError("Failed to extract slave date.")
-        slave_date = datetime.strptime(match.group(1), "%Y%m%d")
-
-        # filter out product from different track
-        trackNumber = ifg_met["track_number"]
-        if int(trackNumber) != int(track):
-            logger.info('Filtered out {}: unmatched track {}'.format(ifg_prod, trackNumber))
-            continue
-
-        ## filter out product from different subswath
-        #swath = ifg_met['swath'] if isinstance(ifg_met['swath'], list) else [ ifg_met['swath'] ]
-        #if set(swath) != set(subswath):
-        #    logger.info('Filtered out {}: unmatched subswath {}'.format(ifg_prod, swath))
-        #    continue
-
-        # extract sensing start and stop dates
-        sensingStarts = ifg_met["sensing_start"] if isinstance(ifg_met["sensing_start"], list) else [ ifg_met["sensing_start"]]
-        sensingStarts.sort()
-        print("\nsensingStarts: {}\n".format(sensingStarts))
-        match = DT_RE.search(sensingStarts[0])
-        if not match: raise RuntimeError("Failed to extract start date.")
-        start_dt = ''.join(match.groups()[:3])
-        start_time = datetime.strptime(sensingStarts[0], "%Y-%m-%dT%H:%M:%S.%fZ")
-        sensingStops = ifg_met["sensing_stop"] if isinstance(ifg_met["sensing_stop"], list) else [ ifg_met["sensing_stop"] ]
-        sensingStops.sort()
-        match = DT_RE.search(sensingStops[-1])
-        if not match: raise RuntimeError("Failed to extract stop date.")
-        stop_dt = ''.join(match.groups()[:3])
-        stop_time = datetime.strptime(sensingStops[-1], "%Y-%m-%dT%H:%M:%S.%fZ")
-        logger.info('start_dt: {}'.format(start_dt))
-        logger.info('stop_dt: {}'.format(stop_dt))
-
-        # extract perpendicular baseline and sensor for ifg.list input file
-        cb_pkl = os.path.join(ifg_prod, "PICKLE", "computeBaselines")
-        if os.path.exists(cb_pkl):
-            with open(cb_pkl, 'rb') as f:
-                catalog = pickle.load(f)
-            bperp = get_bperp(catalog)
-            sensor = catalog['master']['sensor']['mission']
-            if sensor is None: sensor = catalog['slave']['sensor']['mission']
-            if sensor is None and catalog['master']['sensor']['imagingmode'] == "TOPS":
-                sensor = "S1X"
-            if sensor is None:
-                logger.warn("{} will be thrown out. Failed to extract sensor".format(ifg_prod))
-                continue
-        else:
-            bperp = 0.
-            if re.search(r'^S1', ifg_prod): sensor = 'S1X'
-            else:
-                raise RuntimeError("Cannot determine sensor: {}".format(ifg_prod))
-        logger.info('sensor: {}'.format(sensor))
+    # set platform
+    platform = PLATFORMS.get(sensor, ifg_met.get('platform', None))
+
+    # set no data value
+    if S1_RE.search(sensor):
+        sensor = "S1"
+        no_data = 0.
+    elif sensor == "SMAP": no_data = -9999.
+    else:
+        raise RuntimeError("Unknown sensor: {}".format(sensor))
 
-         # get orbit direction to estimate heading
-        direction = ifg_met["orbit_direction"]
-        logger.info('direction: {}'.format(direction))
+    # unwrapped phase and correlation products and their ROI aligned VRTs
+    data_dir = _get_data_dir(ifg_prod)
+    unw_vrt_in = os.path.join(data_dir, "filt_topophase.unw.geo.vrt")
 
-        # set platform
-        platform = PLATFORMS.get(sensor, ifg_met.get('platform', None))
+    return {
+        'prod_num': prod_num,
+        'product': ifg_prod,
+        'dt_id': "{}_{}".format(start_dt, stop_dt),
+        'start_dt': start_dt,
+        'stop_dt': stop_dt,
+        'start_time': start_time,
+        'stop_time': stop_time,
+        'master_date': master_date,
+        'slave_date': slave_date,
+        'bperp': bperp,
+        'sensor': sensor,
+        'platform': platform,
+        'direction': direction,
+        'no_data': no_data,
+        'unw_vrt_in': unw_vrt_in,
+        'unw_vrt_out': os.path.join(data_dir, "aligned.unw.vrt"),
+        'cor_vrt_in': os.path.join(data_dir, "phsig.cor.geo.vrt"),
+        'cor_vrt_out': os.path.join(data_dir, "aligned.cor.vrt"),
+        'grid': GeoGrid.from_vrt(unw_vrt_in).to_dict() if os.path.exists(unw_vrt_in) else None,
+    }
 
-        # set no data value
-        if S1_RE.search(sensor):
-            sensor = "S1"
-            no_data = 0.
-        elif sensor == "SMAP": no_data = -9999.
+
+def _get_sensing_info(meta):
+    """Return wavelength, heading degree, sensing mid and center line UTC
+       of an interferogram product."""
+
+    ifg_prod = meta['product']
+    sensor = meta['sensor']
+    ifg_xml = os.path.join(ifg_prod, "fine_interferogram.xml")
+    sensing_info = get_sensing_info(ifg_xml) if os.path.exists(ifg_xml) else None
+    if sensing_info is not None:
+        wavelength, sensing_mid, heading_deg = sensing_info
+    elif os.path.exists(ifg_xml):
+        # fields missing from the XML; let ISCE load the product
+        import isce
+        from iscesys.Component.ProductManager import ProductManager as PM
+        pm = PM()
+        pm.configure()
+        ifg_obj = pm.loadProduct(ifg_xml)
+        wavelength = ifg_obj.bursts[0].radarWavelength
+        sensing_mid = ifg_obj.bursts[0].sensingMid
+        heading_deg = ifg_obj.bursts[0].orbit.getENUHeading(sensing_mid)
+    else:
+        # set sensing mid
+        start_time, stop_time = meta['start_time'], meta['stop_time']
+        sensing_mid = start_time + timedelta(seconds=(stop_time-start_time).total_seconds()/3.)
+
+        # set wavelength and heading
+        if sensor == "S1":
+            wavelength = 0.05546576
+            if meta['direction'] == "ascending":
+                heading_deg = -13.0
+            else:
+                heading_deg = -167.0
+        elif sensor == "SMAP":
+            wavelength = 0.05546576 # change with actual
+            heading_deg = 0 # change with actual
         else:
             raise RuntimeError("Unknown sensor: {}".format(sensor))
-        logger.info('new sensor: {}'.format(sensor))
-
-        # get wavelength, heading degree and center line UTC
-        ifg_xml = os.path.join(ifg_prod, "fine_interferogram.xml")
-        if os.path.exists(ifg_xml):
-            pm = PM()
-            pm.configure()
-            ifg_obj = pm.loadProduct(ifg_xml)
-            wavelength = ifg_obj.bursts[0].radarWavelength
-            sensing_mid = ifg_obj.bursts[0].sensingMid
-            heading_deg = ifg_obj.bursts[0].orbit.getENUHeading(sensing_mid)
-            center_line_utc = int((sensing_mid - datetime(year=sensing_mid.year,
-                                                          month=sensing_mid.month,
-                                                          day=sensing_mid.day)).total_seconds())
+    center_line_utc = int((sensing_mid - datetime(year=sensing_mid.year,
+                                                  month=sensing_mid.month,
+                                                  day=sensing_mid.day)).total_seconds())
+    return wavelength, heading_deg, sensing_mid, center_line_utc
+
+
+def _get_raster_bytes(meta):
+    """Return size in bytes of the unwrapped phase and correlation rasters."""
+
+    total = 0
+    for vrt in (meta['unw_vrt_in'], meta['cor_vrt_in']):
+        raster = os.path.splitext(vrt)[0]
+        if os.path.exists(raster): total += os.path.getsize(raster)
+    return total
+
+
+def _get_cache(params):
+    """Return this process's screening cache or None if caching is disabled."""
+
+    path = params.get('cache')
+    if path is None: return None
+    key = (path, os.getpid())
+    if key not in _CACHES: _CACHES[key] = ScreenCache(path, params['cache_max_bytes'])
+    return _CACHES[key]
+
+
+def _align_datasets(meta, params):
+    """Align correlation and unwrapped phase products to the ROI in memory.
+       Return the (correlation, unwrapped phase) datasets."""
+
+    min_lat, max_lat, min_lon, max_lon = params['roi']
+    no_data = meta['no_data']
+    cor_ds = align_roi(meta['cor_vrt_in'], None, min_lat, max_lat, min_lon, max_lon, no_data, 1)
+    unw_ds = align_roi(meta['unw_vrt_in'], None, min_lat, max_lat, min_lon, max_lon, no_data, 2)
+    return cor_ds, unw_ds
+
+
+def _read_screen(meta, params, levels):
+    """Read what screening a product at the given coherence thresholds needs:
+       the aligned raster geometry, the reference window values and, for the
+       thresholds with valid reference window data, the per-column valid
+       counts. Rasters are aligned lazily since cached entries may suffice."""
+
+    ref_lat, ref_lon = params['ref_point']
+    ref_width, ref_height = params['ref_box']
+    no_data = meta['no_data']
+    cache = _get_cache(params)
+    raster_key = (meta['product'], get_file_key(meta['unw_vrt_in'], meta['cor_vrt_in'],
+                                                os.path.splitext(meta['unw_vrt_in'])[0],
+                                                os.path.splitext(meta['cor_vrt_in'])[0]),
+                  params['roi'], no_data)
+    grid = cache.get('columns', raster_key) if cache else None
+    datasets = ()
+    if grid is None:
+        datasets = _align_datasets(meta, params)
+        grid = GeoGrid.from_dataset(datasets[0]).to_dict()
+        grid.update({'levels': (), 'counts': None})
+
+    # determine reference point limits
+    ref_line, ref_pixel = GeoGrid.from_dict(grid).to_pixel(ref_lat, ref_lon)
+    rxlim = [ref_pixel - ref_width, ref_pixel + ref_width]
+    rylim = [ref_line - ref_height, ref_line + ref_height]
+    #logger.info("rxlim: {}".format(rxlim))
+    #logger.info("rylim: {}".format(rylim))
+
+    # read the reference window on its own
+    ref_key = raster_key + (tuple(rxlim), tuple(rylim))
+    ref = cache.get('ref', ref_key) if cache else None
+    if ref is None:
+        if not datasets: datasets = _align_datasets(meta, params)
+        ref = {
+            'cor': read_window(datasets[0].GetRasterBand(1), rxlim, rylim),
+            'phs': read_window(datasets[1].GetRasterBand(1), rxlim, rylim),
+        }
+        if cache: cache.put('ref', ref_key, ref)
+
+    # stream the ROI for per-column valid counts; when caching, counts for the
+    # standard coherence levels are computed in the same pass for reruns.
+    # The pixels streamed are kept in the pixel cache for the stack builder,
+    # streaming them even if the counts are cached unless the product fails
+    # screening at every level
+    valid = [i for i in levels if not np.isnan(get_ref_mean(ref['cor'], ref['phs'], i, no_data))]
+    needed = [i for i in valid if i not in grid['levels']]
+    keep = bool(params.get('pixel_dir')) and any([
+        i in needed or grid['counts'][grid['levels'].index(i)].max()/(grid['length']*1.) >=
+        params.get('covth', 0.) for i in valid])
+    pixels = None
+    if needed or keep:
+        if not datasets: datasets = _align_datasets(meta, params)
+        if needed:
+            levels = set(grid['levels']).union(needed)
+            if cache: levels = levels.union(COHERENCE_LEVELS)
+            levels = tuple(sorted(levels))
         else:
-            # set sensing mid and centerline
-            sensing_mid = start_time + timedelta(seconds=(stop_time-start_time).total_seconds()/3.)
-            center_line_utc = int((sensing_mid - datetime(year=sensing_mid.year,
-                                                          month=sensing_mid.month,
-                                                          day=sensing_mid.day)).total_seconds())
-
-            # set wavelength and no data value
-            if sensor == "S1":
-                wavelength = 0.05546576
-                if direction == "ascending":
-                    heading_deg = -13.0
-                else:
-                    heading_deg = -167.0
-            elif sensor == "SMAP":
-                wavelength = 0.05546576 # change with actual
-                heading_deg = 0 # change with actual
-            else:
-                raise RuntimeError("Unknown sensor: {}".format(sensor))
+            logger.info('Streaming {} into the pixel cache (column counts cached)'.format(meta['product']))
+            levels = grid['levels']
+        out = None
+        if keep:
+            pixels = get_pixel_files(params['pixel_dir'], meta['product'])
+            out = open_pixel_files(pixels, (grid['length'], grid['width']))
+        grid['counts'] = get_column_counts(datasets[0].GetRasterBand(1),
+                                           datasets[1].GetRasterBand(1),
+                                           levels, no_data, out=out)
+        grid['levels'] = levels
+        if cache and needed: cache.put('columns', raster_key, grid)
+        out = None
+    datasets = None
+
+    return {
+        'grid': grid,
+        'ref': ref,
+        'rxlim': rxlim,
+        'rylim': rylim,
+        'pixels': pixels,
+    }
 
 
-        # project unwrapped phase and correlation products to common region_of_interest bbox (ROI)
-        merged_dir = os.path.join(ifg_prod, "merged")
-        if os.path.exists(merged_dir):
-            unw_vrt_in = os.path.join(merged_dir, "filt_topophase.unw.geo.vrt")
-            unw_vrt_out = os.path.join(merged_dir, "aligned.unw.vrt")
-            cor_vrt_in = os.path.join(merged_dir, "phsig.cor.geo.vrt")
-            cor_vrt_out = os.path.join(merged_dir, "aligned.cor.vrt")
-        else:
-            unw_vrt_in = os.path.join(ifg_prod, "filt_topophase.unw.geo.vrt")
-            unw_vrt_out = os.path.join(ifg_prod, "aligned.unw.vrt")
-            cor_vrt_in = os.path.join(ifg_prod, "phsig.cor.geo.vrt")
-            cor_vrt_out = os.path.join(ifg_prod, "aligned.cor.vrt")
-        gdal_translate(unw_vrt_in, unw_vrt_out, min_lat, max_lat, min_lon, max_lon, no_data, 2)
-        gdal_translate(cor_vrt_in, cor_vrt_out, min_lat, max_lat, min_lon, max_lon, no_data, 1)
-
-        # get width and length of aligned/projected images and
-        # determine reference point limits
-        ds = gdal.Open(cor_vrt_out, GA_ReadOnly)
-        gt = ds.GetGeoTransform()
-        width = ds.RasterXSize
-        length = ds.RasterYSize
-        ref_line  = int((ref_lat - gt[3]) / gt[5])
-        ref_pixel = int((ref_lon - gt[0]) / gt[1])
-        xlim = [0, width]
-        ylim = [0, length]
-        rxlim = [ref_pixel - ref_width, ref_pixel + ref_width]
-        rylim = [ref_line - ref_height, ref_line + ref_height]
-        #logger.info("rxlim: {}".format(rxlim))
-        #logger.info("rylim: {}".format(rylim))
-
-        # read the coherence data and build mask from coherence threshold
-        band = ds.GetRasterBand(1)
-        cor = band.ReadAsArray()
-        cor_ref = cor[rylim[0]:rylim[1], rxlim[0]:rxlim[1]]
-        logger.info("cor_ref: {} {}".format(cor_ref.shape, cor_ref))
-        ds = None
-        #logger.info("cor: {} {}".format(cor.shape, cor))
-        mask = np.nan*np.ones(cor.shape)
-        mask[cor >= cohth] = 1.0
-        #logger.info("mask_ref: {} {}".format(mask_ref.shape, mask_ref))
-
-        # read the phase data and mask out reference bbox pixels with no data
-        ds = gdal.Open(unw_vrt_out, GA_ReadOnly)
-        band = ds.GetRasterBand(1)
-        phs = band.ReadAsArray()
-        ds = None
-        #logger.info("phs: {} {}".format(phs.shape, phs))
-        mask[phs == no_data] = np.nan
-        phs_ref = phs[rylim[0]:rylim[1], rxlim[0]:rxlim[1]]
-        mask_ref = mask[rylim[0]:rylim[1], rxlim[0]:rxlim[1]]
-        phs_ref = phs_ref*mask_ref
-        #logger.info("phs_ref: {} {}".format(phs_ref.shape, phs_ref))
-        phs_ref_mean = np.nanmean(phs_ref)
-        logger.info("phs_ref mean: {}".format(phs_ref_mean))
-
-        # filter out product with no valid phase data in reference bbox
-        # or did not pass coherence threshold
-        if np.isnan(phs_ref_mean):
-            logger.info('Filtered out {}: no valid data in ref bbox'.format(ifg_prod))
-            continue
-
-        # filter out product with ROI coverage of valid data less than threshold
-        #cov = np.sum(~np.isnan(mask))/(mask.size*1.)
-        #logger.info('coverage: {}'.format(cov))
-        #if cov < covth:
-        #    logger.info('Filtered out {}: ROI coverage of valid data was below threshold ({} vs. {})'.format(
-        #                ifg_prod, cov, covth))
-        #    continue
-
-        # filter out product with ROI latitude coverage of valid data less than threshold
-        cov = np.sum(~np.isnan(mask), axis=0).max()/(mask.shape[0]*1.)
-        logger.info('coverage: {}'.format(cov))
-        if cov < covth:
-            logger.info('Filtered out {}: ROI latitude coverage of valid data was below threshold ({} vs. {})'.format(
-                        ifg_prod, cov, covth))
-            continue
-
-        # track sensing mid
-        center_lines_utc.append(sensing_mid)
-
-        # create date ID
-        dt_id = "{}_{}".format(start_dt, stop_dt)
-
-        # use IFG product with larger coverage
-        if os.path.exists(dt_id):
-            if cov <= ifg_coverage[dt_id]:
-                logger.info('Filtered out {}: already exists with larger coverage ({} vs. {})'.format(
-                            ifg_prod, ifg_coverage[dt_id], cov))
+def _screen_ifg(meta, prod_count, params):
+    """Align and screen the rasters of a single interferogram product. Return
+       the product's candidate stack entry or None if it was filtered out."""
+
+    min_lat, max_lat, min_lon, max_lon = params['roi']
+    covth = params['covth']
+    cohth = params['cohth']
+    ifg_prod = meta['product']
+    no_data = meta['no_data']
+
+    logger.info('#' * 80)
+    logger.info('Processing: {} ({} of {})'.format(ifg_prod, meta['prod_num']+1, prod_count))
+    logger.info('-' * 80)
+    logger.info('start_dt: {}'.format(meta['start_dt']))
+    logger.info('stop_dt: {}'.format(meta['stop_dt']))
+    logger.info('sensor: {}'.format(meta['sensor']))
+    logger.info('direction: {}'.format(meta['direction']))
+
+    # get width and length of aligned/projected images, reference
+    # point limits, reference window and per-column valid counts
+    screen = _read_screen(meta, params, (cohth,))
+    grid, ref = screen['grid'], screen['ref']
+    width = grid['width']
+    length = grid['length']
+    xlim = [0, width]
+    ylim = [0, length]
+    rxlim = screen['rxlim']
+    rylim = screen['rylim']
+    logger.info("cor_ref: {} {}".format(ref['cor'].shape, ref['cor']))
+    phs_ref_mean = get_ref_mean(ref['cor'], ref['phs'], cohth, no_data)
+    logger.info("phs_ref mean: {}".format(phs_ref_mean))
+
+    # filter out product with no valid phase data in reference bbox
+    # or did not pass coherence threshold
+    if np.isnan(phs_ref_mean):
+        logger.info('Filtered out {}: no valid data in ref bbox'.format(ifg_prod))
+        return None
+
+    # filter out product with ROI latitude coverage of valid data less than threshold
+    counts = grid['counts'][grid['levels'].index(cohth)]
+    cov = counts.max()/(length*1.)
+    logger.info('coverage: {}'.format(cov))
+    if cov < covth:
+        logger.info('Filtered out {}: ROI latitude coverage of valid data was below threshold ({} vs. {})'.format(
+                    ifg_prod, cov, covth))
+        return None
+
+    # write aligned VRTs for downstream GIAnT processing
+    align_roi(meta['unw_vrt_in'], meta['unw_vrt_out'], min_lat, max_lat, min_lon, max_lon, no_data, 2)
+    align_roi(meta['cor_vrt_in'], meta['cor_vrt_out'], min_lat, max_lat, min_lon, max_lon, no_data, 1)
+
+    # get wavelength, heading degree and center line UTC
+    wavelength, heading_deg, sensing_mid, center_line_utc = _get_sensing_info(meta)
+
+    # set ifg list info
+    info = {
+        'product': ifg_prod,
+        'start_dt': meta['start_dt'],
+        'stop_dt': meta['stop_dt'],
+        'bperp': meta['bperp'],
+        'sensor': meta['sensor'],
+        'sensor_name': SENSORS[meta['sensor']],
+        'platform': meta['platform'],
+        'width': width,
+        'length': length,
+        'xlim': xlim,
+        'ylim': ylim,
+        'rxlim': rxlim,
+        'rylim': rylim,
+        'cohth': cohth,
+        'wavelength': wavelength,
+        'heading_deg': heading_deg,
+        'center_line_utc': center_line_utc,
+        'range_pixel_size': params['range_pixel_size'],
+        'azimuth_pixel_size': params['azimuth_pixel_size'],
+        'inc': params['inc'],
+        'netramp': params['netramp'],
+        'gpsramp': params['gpsramp'],
+        'filt': params['filt'],
+        'unw_vrt_in': meta['unw_vrt_in'],
+        'unw_vrt_out': meta['unw_vrt_out'],
+        'cor_vrt_in': meta['cor_vrt_in'],
+        'cor_vrt_out': meta['cor_vrt_out'],
+        'master_date': meta['master_date'],
+        'slave_date': meta['slave_date'],
+        'grid': GeoGrid.from_dict(grid).to_dict(),
+        'no_data': no_data,
+        'phs_ref_mean': phs_ref_mean,
+        'pixels': screen['pixels'],
+    }
+
+    return {
+        'product': ifg_prod,
+        'dt_id': meta['dt_id'],
+        'cov': cov,
+        'sensing_mid': sensing_mid,
+        'info': info,
+    }
+
+
+def _prefilter_ifgs(metas, params, covth):
+    """Split products into those that may pass screening and those whose
+       raster footprint alone rules them out: no overlap with the ROI, ROI
+       latitude coverage below covth even if all overlapping pixels were
+       valid, or a reference window outside the raster. Bounds are padded
+       by a pixel so no product that could pass is rejected."""
+
+    min_lat, max_lat, min_lon, max_lon = params['roi']
+    ref_lat, ref_lon = params['ref_point']
+    ref_width, ref_height = params['ref_box']
+    indexed = [m for m in metas if m.get('grid') is not None]
+    if len(indexed) == 0: return metas, []
+    grids = [GeoGrid.from_dict(m['grid']) for m in indexed]
+    index = FootprintIndex([g.footprint() for g in grids])
+    lat_res = np.array([abs(g.gt[5]) for g in grids])
+    lon_res = np.array([abs(g.gt[1]) for g in grids])
+
+    # upper bound of ROI latitude coverage
+    roi = (min_lon, max_lon, min_lat, max_lat)
+    rows = (max_lat - min_lat) / lat_res
+    cov_ub = (index.lat_overlap(roi) / lat_res + 1.) / np.maximum(rows - 1., 1.)
+    ok = index.intersects(roi) & (cov_ub >= covth)
+
+    # reference window
+    ref_dlon = (ref_width + 1) * lon_res.max()
+    ref_dlat = (ref_height + 1) * lat_res.max()
+    ok &= index.intersects((ref_lon - ref_dlon, ref_lon + ref_dlon,
+                            ref_lat - ref_dlat, ref_lat + ref_dlat))
+
+    rejected = set([id(m) for m, i in zip(indexed, ok) if not i])
+    for meta in metas:
+        if id(meta) in rejected:
+            logger.info('Filtered out {}: footprint cannot meet ROI coverage or reference window'.format(
+                        meta['product']))
+    return ([m for m in metas if id(m) not in rejected],
+            [m for m in metas if id(m) in rejected])
+
+
+def _plan_ifgs(ifg_prods, params, covth):
+    """Parse metadata of all products, apply the metadata-only filters and
+       the footprint prefilter. Return the remaining products' metadata
+       grouped by date ID and the prefiltered products' metadata."""
+
+    track = params['track']
+    screen_cache = _get_cache(params)
+    metas = []
+    for prod_num, ifg_prod in enumerate(ifg_prods):
+        # key on the files parsed; not on directories, which aligned VRTs
+        # written by screening touch
+        data_dir = _get_data_dir(ifg_prod)
+        plan_key = (ifg_prod, track, get_file_key(*glob("{}/*.met.json".format(ifg_prod)) +
+                    [os.path.join(ifg_prod, "PICKLE", "computeBaselines"),
+                     os.path.join(data_dir, "filt_topophase.unw.geo.vrt"),
+                     os.path.join(data_dir, "phsig.cor.geo.vrt")]))
+        plan = screen_cache.get('meta', plan_key) if screen_cache else None
+        if plan is None:
+            plan = {'meta': _plan_ifg(prod_num, len(ifg_prods), ifg_prod, track)}
+            if screen_cache: screen_cache.put('meta', plan_key, plan)
+        meta = plan['meta']
+        if meta is None: continue
+        meta['prod_num'] = prod_num
+        metas.append(meta)
+    metas, prefiltered = _prefilter_ifgs(metas, params, covth)
+    groups = {}
+    for meta in metas:
+        groups.setdefault(meta['dt_id'], []).append(meta)
+    planned = len(metas)
+    logger.info('Planned {} of {} products in {} date groups ({} duplicates, {} prefiltered by footprint)'.format(
+                planned, len(ifg_prods), len(groups), planned - len(groups), len(prefiltered)))
+    return groups, prefiltered
+
+
+def _screen_group(args):
+    """Screen the products sharing a date ID in input order. Products after
+       one with full ROI coverage can never be selected since the coverage
+       dedup keeps the first of equal coverages. They are skipped if their
+       sensing mid is already tracked by a product that passed screening,
+       so skipping cannot change the sensing mids (and the stack product
+       ID) of a serial evaluation. Skipped products are returned with
+       their raster size."""
+
+    group, prod_count, params = args
+    cache = _get_cache(params)
+    results = []
+    skipped = []
+    for meta in group:
+        passed = [r for r in results if r is not None]
+        if any([r['cov'] >= 1. for r in passed]):
+            sensing_mid = _get_sensing_info(meta)[2]
+            if sensing_mid in [r['sensing_mid'] for r in passed]:
+                logger.info('Skipped {}: {} already has full coverage'.format(
+                            meta['product'], meta['dt_id']))
+                skipped.append((meta['product'], _get_raster_bytes(meta)))
                 continue
-            else:
-                logger.info('Larger coverage found for {} ({} vs. {})'.format(
-                            dt_id, cov, ifg_coverage[dt_id]))
-                os.unlink(dt_id)
-
-        # create soft link for aligned products
-        os.symlink(ifg_prod, dt_id)
-
-        # set ifg list info
-        ifg_info[dt_id] = {
-            'product': ifg_prod,
-            'start_dt': start_dt,
-            'stop_dt': stop_dt,
-            'bperp': bperp,
-            'sensor': sensor,
-            'sensor_name': SENSORS[sensor],
-            'platform': platform,
-            'width': width,
-            'length': length,
-            'xlim': xlim,
-            'ylim': ylim,
-            'rxlim': rxlim,
-            'rylim': rylim,
-            'cohth': cohth,
-            'wavelength': wavelength,
-            'heading_deg': heading_deg,
-            'center_line_utc': center_line_utc,
-            'range_pixel_size': range_pixel_size,
-            'azimuth_pixel_size': azimuth_pixel_size,
-            'inc': inc,
-            'netramp': netramp,
-            'gpsramp': gpsramp,
-            'filt': filt,
-            'unw_vrt_in': unw_vrt_in,
-            'unw_vrt_out': unw_vrt_out,
-            'cor_vrt_in': cor_vrt_in,
-            'cor_vrt_out': cor_vrt_out,
-            'master_date': master_date,
-            'slave_date': slave_date,
-        }
+        results.append(_screen_ifg(meta, prod_count, params))
+    return results, skipped, cache.pop_stats() if cache else {}
+
+
+def filter_ifgs(ifg_prods, min_lat, max_lat, min_lon, max_lon, ref_lat,
+                ref_lon, ref_width, ref_height, covth, cohth, range_pixel_size,
+                azimuth_pixel_size, inc, filt, netramp, gpsramp,
+                track, *, nproc=None, cache=None, cache_max_bytes=MAX_BYTES,
+                link_dir='.', pixel_dir=None):
+    """Filter input interferogram products.
+
+       Filtering runs in two phases. The planning phase parses the metadata
+       of every product, applies the metadata-only filters, rejects products
+       whose raster footprint rules them out (see _prefilter_ifgs) and groups
+       the remaining products by date ID. The screening phase then aligns and
+       screens the rasters of each group, skipping duplicates that can no
+       longer win the coverage dedup and whose sensing mid is already in
+       center_lines_utc (see _screen_group).
+
+       Groups are screened by a pool of nproc worker processes (defaults to
+       the CPU quota of the cgroup). Results are reduced in input order
+       within each group so the dedup matches a serial evaluation.
+
+       If cache is the path of a screening cache (see ScreenCache), parsed
+       metadata, reference windows and per-column valid counts are reused
+       across runs so reruns with new thresholds need not reread rasters.
+
+       If pixel_dir is set, the aligned rasters streamed while screening are
+       kept there (see get_pixel_files()) and recorded in the ifg info of
+       the selected products so build_raw_stack() need not read them again;
+       those of products not selected are removed.
+
+       The coverage dedup is kept in memory; the date ID soft links to the
+       selected products are created in link_dir (unless None) at the end."""
+
+    # parameters shared by all product evaluations
+    params = {
+        'roi': (min_lat, max_lat, min_lon, max_lon),
+        'ref_point': (ref_lat, ref_lon),
+        'ref_box': (ref_width, ref_height),
+        'covth': covth,
+        'cohth': cohth,
+        'range_pixel_size': range_pixel_size,
+        'azimuth_pixel_size': azimuth_pixel_size,
+        'inc': inc,
+        'filt': filt,
+        'netramp': netramp,
+        'gpsramp': gpsramp,
+        'track': track,
+        'cache': cache,
+        'cache_max_bytes': cache_max_bytes,
+        'pixel_dir': pixel_dir,
+    }
+    print('ifg_prods: {}'.format(ifg_prods))
+    if pixel_dir is not None and not os.path.isdir(pixel_dir): os.makedirs(pixel_dir)
 
-        # track coverage
-        ifg_coverage[dt_id] = cov
+    # plan: parse metadata and group products by date ID
+    groups, prefiltered = _plan_ifgs(ifg_prods, params, covth)
+    planned = sum([len(i) for i in groups.values()])
+    tasks = [(group, len(ifg_prods), params) for group in groups.values()]
 
-        # log success status
-        logger.info('Added {} to final input stack'.format(ifg_prod))
+    # determine number of workers
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, min(nproc, len(tasks)))
+    logger.info('Screening {} date groups using {} worker(s)'.format(len(tasks), nproc))
 
-    # extract geocoded coords
+    # screen rasters and reduce results
+    center_lines_utc = []
+    ifg_info = {}
+    ifg_coverage = {}
+    skipped = []
+    cache_stats = {}
+    pool = multiprocessing.Pool(nproc) if nproc > 1 else None
+    try:
+        results = pool.imap(_screen_group, tasks) if pool else map(_screen_group, tasks)
+        for group_results, group_skipped, group_stats in results:
+            skipped.extend(group_skipped)
+            merge_stats(cache_stats, group_stats)
+            for result in group_results:
+                if result is None: continue
+                ifg_prod = result['product']
+                dt_id = result['dt_id']
+                cov = result['cov']
+
+                # track sensing mid
+                center_lines_utc.append(result['sensing_mid'])
+
+                # use IFG product with larger coverage
+                if dt_id in ifg_coverage:
+                    if cov <= ifg_coverage[dt_id]:
+                        logger.info('Filtered out {}: already exists with larger coverage ({} vs. {})'.format(
+                                    ifg_prod, ifg_coverage[dt_id], cov))
+                        continue
+                    else:
+                        logger.info('Larger coverage found for {} ({} vs. {})'.format(
+                                    dt_id, cov, ifg_coverage[dt_id]))
+
+                # set ifg list info
+                ifg_info[dt_id] = result['info']
+
+                # track coverage
+                ifg_coverage[dt_id] = cov
+
+                # log success status
+                logger.info('Added {} to final input stack (current stack count: {})'.format(
+                            ifg_prod, len(ifg_info)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # report raster I/O avoided by planning
+    io_stats = {
+        'products': len(ifg_prods),
+        'prefiltered': len(prefiltered),
+        'planned': planned,
+        'screened': planned - len(skipped),
+        'skipped': len(skipped),
+        'bytes_avoided': sum([i[1] for i in skipped]) +
+                         sum([_get_raster_bytes(m) for m in prefiltered]),
+    }
+    logger.info('Raster I/O avoided: {} prefiltered and {} of {} planned products skipped ({:.1f} MiB)'.format(
+                io_stats['prefiltered'], io_stats['skipped'], planned,
+                io_stats['bytes_avoided']/1024.**2))
+
+    # drop the cached pixels of products not selected
+    if pixel_dir is not None:
+        keep = set([p for i in ifg_info.values() if i['pixels'] for p in i['pixels'].values()])
+        for path in glob(os.path.join(pixel_dir, "*.npy")):
+            if path not in keep: os.unlink(path)
+
+    # create soft links for aligned products
+    if link_dir is not None: link_ifgs(ifg_info, link_dir)
+
+    # report cache statistics
+    screen_cache = _get_cache(params)
+    if screen_cache:
+        merge_stats(cache_stats, screen_cache.pop_stats())
+        log_stats(cache_stats, cache)
+
+    # grid of the aligned products (see GeoGrid.from_dict())
     ifg_list = sorted(ifg_info)
-    if len(ifg_list) > 0:
-        lats, lons = get_geocoded_coords(ifg_info[ifg_list[0]]['cor_vrt_out'])
-    else: lats = lons = None
-    
+    grid = ifg_info[ifg_list[0]]['grid'] if len(ifg_list) > 0 else None
+
     return {
         'center_lines_utc': center_lines_utc,
         'ifg_info': ifg_info,
         'ifg_coverage': ifg_coverage,
-        'lats': lats,
-        'lons': lons,
+        'io_stats': io_stats,
+        'grid': grid,
     }
+
+
+def _sweep_ifg(args):
+    """Return ROI latitude coverage of a product at each coherence threshold
+       (None where the reference window has no valid data)."""
+
+    meta, cohths, params = args
+    logger.info('Sweeping: {}'.format(meta['product']))
+    screen = _read_screen(meta, params, cohths)
+    grid, ref = screen['grid'], screen['ref']
+    covs = {}
+    for cohth in cohths:
+        if np.isnan(get_ref_mean(ref['cor'], ref['phs'], cohth, meta['no_data'])):
+            covs[cohth] = None
+        else:
+            counts = grid['counts'][grid['levels'].index(cohth)]
+            covs[cohth] = counts.max()/(grid['length']*1.)
+    cache = _get_cache(params)
+    return covs, cache.pop_stats() if cache else {}
+
+
+def link_ifgs(ifg_info, link_dir='.'):
+    """Create the date ID soft links to the selected products expected by
+       userfn.makefnames. Each link is created under a temporary name and
+       renamed into place, replacing any link left by an earlier run. Date
+       ID links of products no longer selected and temporary links left by
+       interrupted runs are removed so a rerun in the same directory only
+       links the current selection."""
+
+    for name in os.listdir(link_dir):
+        link = os.path.join(link_dir, name)
+        if LINK_RE.search(name) and os.path.islink(link) and name not in ifg_info:
+            logger.info('Removing stale link {}'.format(link))
+            os.unlink(link)
+    for dt_id in sorted(ifg_info):
+        link = os.path.join(link_dir, dt_id)
+        tmp_link = "{}.{}.tmp".format(link, os.getpid())
+        if os.path.lexists(tmp_link): os.unlink(tmp_link)
+        os.symlink(os.path.relpath(os.path.abspath(ifg_info[dt_id]['product']), link_dir),
+                   tmp_link)
+        os.replace(tmp_link, link)
+    logger.info('Linked {} products in {}'.format(len(ifg_info), link_dir))
+
+
+def sweep_ifgs(ifg_prods, min_lat, max_lat, min_lon, max_lon, ref_lat,
+               ref_lon, ref_width, ref_height, covths, cohths, track, *,
+               nproc=None, cache=None, cache_max_bytes=MAX_BYTES):
+    """Evaluate the filter for every combination of coverage and coherence
+       thresholds, reading each product's rasters once.
+
+       Returns a list of dicts, one per (cohth, covth) combination, with the
+       number of ifgs that would survive filtering (after the date ID dedup),
+       whether their network is temporally connected, the number of temporal
+       gaps and the date span of the stack. Both threshold grids must be
+       non-empty sequences of numbers."""
+
+    # validate threshold grids
+    grids = []
+    for name, values in (('coherence', cohths), ('coverage', covths)):
+        try: valid = len(values) > 0 and all([isinstance(i, numbers.Real) and np.isfinite(i)
+                                              for i in values])
+        except TypeError: valid = False
+        if not valid: raise RuntimeError("Invalid {} thresholds: {}".format(name, values))
+        grids.append(tuple(sorted(set(values))))
+    cohths, covths = grids
+
+    # parameters shared by all product evaluations
+    params = {
+        'roi': (min_lat, max_lat, min_lon, max_lon),
+        'ref_point': (ref_lat, ref_lon),
+        'ref_box': (ref_width, ref_height),
+        'track': track,
+        'cache': cache,
+        'cache_max_bytes': cache_max_bytes,
+    }
+
+    # plan: parse metadata and apply the metadata-only filters; products
+    # prefiltered at the lowest coverage threshold fail every combination
+    groups, prefiltered = _plan_ifgs(ifg_prods, params, covths[0])
+    metas = [m for g in groups.values() for m in g]
+    tasks = [(meta, cohths, params) for meta in metas]
+
+    # determine number of workers
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, min(nproc, len(tasks)))
+    logger.info('Sweeping {} products over {} coherence and {} coverage thresholds using {} worker(s)'.format(
+                len(tasks), len(cohths), len(covths), nproc))
+
+    # read each product once for all coherence thresholds
+    cache_stats = {}
+    covs = []
+    pool = multiprocessing.Pool(nproc) if nproc > 1 else None
+    try:
+        results = pool.imap(_sweep_ifg, tasks) if pool else map(_sweep_ifg, tasks)
+        for prod_covs, prod_stats in results:
+            covs.append(prod_covs)
+            merge_stats(cache_stats, prod_stats)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    screen_cache = _get_cache(params)
+    if screen_cache:
+        merge_stats(cache_stats, screen_cache.pop_stats())
+        log_stats(cache_stats, cache)
+
+    # evaluate every threshold combination
+    sweep = []
+    for cohth in cohths:
+        for covth in covths:
+            intervals, pairs = {}, {}
+            for meta, prod_covs in zip(metas, covs):
+                cov = prod_covs[cohth]
+                if cov is None or cov < covth: continue
+                intervals[meta['dt_id']] = [meta['start_dt'], meta['stop_dt']]
+                pairs[meta['dt_id']] = (meta['master_date'], meta['slave_date'])
+            merged = merge_intervals(list(intervals.values()))
+            pairs = list(pairs.values())
+            sweep.append({
+                'cohth': cohth,
+                'covth': covth,
+                'ifg_count': len(intervals),
+                'connected': is_connected(pairs),
+                'gaps': len(get_gaps(pairs)),
+                'start_dt': merged[0][0] if merged else None,
+                'stop_dt': max([i[1] for i in merged]) if merged else None,
+            })
+    return sweep
+
+
+def write_sweep(sweep, sweep_file):
+    """Write threshold sweep results as a CSV table."""
+
+    fields = ['cohth', 'covth', 'ifg_count', 'connected', 'gaps', 'start_dt', 'stop_dt']
+    with open(sweep_file, 'w') as f:
+        f.write(",".join(fields) + "\n")
+        for row in sweep:
+            f.write(",".join(["" if row[i] is None else str(row[i]) for i in fields]) + "\n")
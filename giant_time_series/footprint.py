@@ -0,0 +1,298 @@
+import os
+import json
+import heapq
+import logging
+import multiprocessing
+import numpy as np
+from glob import glob
+
+from .utils import GeoGrid
+from .screen import get_block_rows
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def get_vrt_footprint(vrt_file, corners=False):
+    """Return (min_lon, max_lon, min_lat, max_lat) of a GDAL VRT (see
+       GeoGrid.footprint())."""
+
+    return GeoGrid.from_vrt(vrt_file).footprint(corners)
+
+
+def get_met_footprint(prod_dir):
+    """Return (min_lon, max_lon, min_lat, max_lat) of the location polygon
+       in a product's met.json."""
+
+    met_files = glob("{}/*.met.json".format(prod_dir))
+    if len(met_files) == 0:
+        raise RuntimeError("Failed to find met.json in {}".format(prod_dir))
+    with open(met_files[0]) as f:
+        location = json.load(f)['location']
+    coords = location['coordinates']
+    if location['type'] == 'Polygon': coords = [coords]
+    pts = np.array([pt[:2] for poly in coords for ring in poly for pt in ring], dtype=np.float64)
+    return pts[:, 0].min(), pts[:, 0].max(), pts[:, 1].min(), pts[:, 1].max()
+
+
+def _get_vrt_footprint(args):
+    return get_vrt_footprint(*args)
+
+
+def get_footprints(vrt_files, corners=False, nproc=1):
+    """Return footprints of VRTs using nproc worker processes, which helps
+       when VRTs need to be opened with GDAL or live on network storage."""
+
+    tasks = [(vrt_file, corners) for vrt_file in vrt_files]
+    nproc = max(1, min(nproc or 1, len(tasks)))
+    if nproc == 1: return [_get_vrt_footprint(i) for i in tasks]
+    pool = multiprocessing.Pool(nproc)
+    try: return pool.map(_get_vrt_footprint, tasks, chunksize=max(1, len(tasks)//(nproc*4)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+class FootprintIndex(object):
+    """Index of product footprints (min_lon, max_lon, min_lat, max_lat) for
+       envelope, intersection and overlap queries over a whole stack.
+
+       Footprints are kept sorted by min_lon so a query only tests the ones
+       starting west of its east edge; the rest of the test is vectorized."""
+
+    def __init__(self, footprints):
+        bboxes = np.array(footprints, dtype=np.float64).reshape(-1, 4)
+        self.order = np.argsort(bboxes[:, 0], kind='mergesort')
+        self.bboxes = bboxes[self.order]
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def _unsort(self, values, fill):
+        result = np.full(len(self.bboxes), fill, dtype=np.asarray(values).dtype)
+        result[self.order[:len(values)]] = values
+        return result
+
+    def envelope(self):
+        """Return (min_lon, max_lon, min_lat, max_lat) of all footprints."""
+
+        if len(self.bboxes) == 0: return (0., 0., 0., 0.)
+        return (self.bboxes[:, 0].min(), self.bboxes[:, 1].max(),
+                self.bboxes[:, 2].min(), self.bboxes[:, 3].max())
+
+    def _overlaps(self, bbox):
+        """Return lon/lat overlap extents of the candidate footprints, in
+           sorted order."""
+
+        min_lon, max_lon, min_lat, max_lat = bbox
+        cand = self.bboxes[:np.searchsorted(self.bboxes[:, 0], max_lon, side='right')]
+        lon = np.minimum(cand[:, 1], max_lon) - np.maximum(cand[:, 0], min_lon)
+        lat = np.minimum(cand[:, 3], max_lat) - np.maximum(cand[:, 2], min_lat)
+        return lon, lat
+
+    def intersects(self, bbox):
+        """Return mask of footprints intersecting bbox (touching counts)."""
+
+        lon, lat = self._overlaps(bbox)
+        return self._unsort((lon >= 0.) & (lat >= 0.), False)
+
+    def lat_overlap(self, bbox):
+        """Return latitude extent of each footprint's overlap with bbox (0.
+           if they do not intersect)."""
+
+        lon, lat = self._overlaps(bbox)
+        return self._unsort(np.where((lon >= 0.) & (lat >= 0.), lat, 0.), 0.)
+
+    def overlap_fraction(self, bbox):
+        """Return fraction of the area of bbox covered by each footprint."""
+
+        min_lon, max_lon, min_lat, max_lat = bbox
+        area = (max_lon - min_lon) * (max_lat - min_lat)
+        lon, lat = self._overlaps(bbox)
+        overlap = np.clip(lon, 0., None) * np.clip(lat, 0., None)
+        return self._unsort(overlap / area if area > 0. else overlap, 0.)
+
+
+def get_row_extents(dset, index=0, chunk_rows=None):
+    """Return the rows with valid (not NaN) data of dset[index] and their
+       leftmost and rightmost valid columns, reading chunk_rows rows at a
+       time so memory stays O(chunk_rows * width + rows)."""
+
+    length, width = dset.shape[-2:]
+    if chunk_rows is None: chunk_rows = get_block_rows(width, dset.dtype.itemsize)
+    rows, left, right = [], [], []
+    for r0 in range(0, length, chunk_rows):
+        r1 = min(length, r0 + chunk_rows)
+        valid = ~np.isnan(dset[index, r0:r1, :] if len(dset.shape) == 3 else dset[r0:r1, :])
+        has_data = valid.any(axis=1)
+        rows.append(np.nonzero(has_data)[0] + r0)
+        left.append(valid[has_data].argmax(axis=1))
+        right.append(width - 1 - valid[has_data][:, ::-1].argmax(axis=1))
+    return np.concatenate(rows), np.concatenate(left), np.concatenate(right)
+
+
+def convex_hull(points):
+    """Return the convex hull of 2D points as a counter-clockwise ring
+       (monotone chain), not closed. Degenerate inputs yield fewer than 3
+       vertices."""
+
+    pts = sorted(set(map(tuple, np.asarray(points, dtype=np.float64).tolist())))
+    if len(pts) <= 2: return pts
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0: lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0: upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def simplify_ring(ring, max_vertices):
+    """Simplify an open ring to at most max_vertices (>= 3) vertices by
+       repeatedly dropping the vertex spanning the smallest triangle area
+       with its neighbors (Visvalingam-Whyatt)."""
+
+    ring = list(ring)
+    if max_vertices is None or len(ring) <= max_vertices: return ring
+    max_vertices = max(3, max_vertices)
+    pts = np.array(ring, dtype=np.float64)
+    n = len(pts)
+    prev = np.roll(np.arange(n), 1)
+    nxt = np.roll(np.arange(n), -1)
+    keep = np.ones(n, dtype=bool)
+
+    def area(i):
+        a, b, c = pts[prev[i]], pts[i], pts[nxt[i]]
+        return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) / 2.
+
+    # min heap of (area, vertex, version); stale entries are skipped
+    version = np.zeros(n, dtype=np.int64)
+    heap = [(area(i), i, 0) for i in range(n)]
+    heapq.heapify(heap)
+    count = n
+    while count > max_vertices:
+        _, i, v = heapq.heappop(heap)
+        if not keep[i] or v != version[i]: continue
+        keep[i] = False
+        count -= 1
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            version[j] += 1
+            heapq.heappush(heap, (area(j), j, version[j]))
+    return [ring[i] for i in np.nonzero(keep)[0]]
+
+
+def simplify_hull(ring, max_vertices):
+    """Simplify an open convex counter-clockwise ring to at most
+       max_vertices (>= 3) vertices without shrinking it: the edge whose
+       removal adds the least area is repeatedly replaced by the
+       intersection of its neighboring edges. Stops early if no edge can be
+       removed this way (e.g. a rectangle cannot become a triangle), so the
+       result always contains the input."""
+
+    ring = [tuple(p) for p in ring]
+    if max_vertices is None or len(ring) <= max_vertices: return ring
+    max_vertices = max(3, max_vertices)
+    while len(ring) > max_vertices:
+        n = len(ring)
+        best = None
+        for i in range(n):
+            a, b, c, d = ring[i-1], ring[i], ring[(i+1) % n], ring[(i+2) % n]
+
+            # intersection a + t*(b - a) = d + u*(c - d) past b and c
+            r = (b[0] - a[0], b[1] - a[1])
+            q = (c[0] - d[0], c[1] - d[1])
+            den = r[0] * q[1] - r[1] * q[0]
+            if den == 0.: continue
+            e = (d[0] - a[0], d[1] - a[1])
+            t = (e[0] * q[1] - e[1] * q[0]) / den
+            u = (e[0] * r[1] - e[1] * r[0]) / den
+            if t < 1. or u < 1.: continue
+            x = (a[0] + t * r[0], a[1] + t * r[1])
+            added = abs((x[0] - b[0]) * (c[1] - b[1]) - (c[0] - b[0]) * (x[1] - b[1])) / 2.
+            if best is None or added < best[0]: best = (added, i, x)
+        if best is None: break
+        _, i, x = best
+        ring = ring[1:n-1] + [x] if i == n - 1 else ring[:i] + [x] + ring[i+2:]
+    return ring
+
+
+def get_coord(values, index):
+    """Return coordinate of a possibly fractional pixel index of evenly
+       spaced coordinate values, extrapolating outside of them."""
+
+    if float(index).is_integer() and 0 <= index < len(values): return float(values[int(index)])
+    step = (values[-1] - values[0]) / (len(values) - 1.) if len(values) > 1 else 0.
+    return float(values[0] + index * step)
+
+
+def split_row_runs(rows, left, right):
+    """Split row extents into runs of consecutive rows whose column ranges
+       overlap, i.e. the pieces of a gappy footprint."""
+
+    if len(rows) == 0: return []
+    brk = ((np.diff(rows) != 1) | (left[1:] > right[:-1]) | (right[1:] < left[:-1]))
+    bounds = np.concatenate([[0], np.nonzero(brk)[0] + 1, [len(rows)]])
+    return [(rows[i:j], left[i:j], right[i:j]) for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def get_outline(rows, left, right):
+    """Return the (possibly concave) outline ring of row extents: down the
+       left edges and back up the right edges, in pixel coordinates."""
+
+    return ([(c, r) for r, c in zip(rows, left)] +
+            [(c, r) for r, c in zip(rows[::-1], right[::-1])])
+
+
+def get_signed_area(ring):
+    """Return signed area (shoelace) of an open ring; positive if it is
+       counter-clockwise."""
+
+    if len(ring) < 3: return 0.
+    x, y = np.array(ring, dtype=np.float64).T
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2.
+
+
+def get_valid_polygons(lats, lons, rows, left, right, mode='hull', max_vertices=None):
+    """Return footprint polygons of valid data from row extents as closed
+       rings of [lon, lat]. Modes:
+         hull    - one convex hull of all valid pixels
+         outline - one concave outline (left/right row extents)
+         multi   - one outline per run of overlapping rows (gappy coverage)
+       Rings are simplified to max_vertices if given; the hull never shrinks
+       (see simplify_hull()), outlines may. Degenerate pieces
+       (fewer than 3 distinct vertices or zero area, e.g. a single row or
+       pixel) are not valid GeoJSON polygons and are dropped; raises if
+       none are left."""
+
+    if mode == 'hull':
+        pieces = [convex_hull(np.column_stack([np.concatenate([left, right]),
+                                               np.concatenate([rows, rows])]))]
+    elif mode == 'outline':
+        pieces = [get_outline(rows, left, right)]
+    elif mode == 'multi':
+        pieces = [get_outline(*run) for run in split_row_runs(rows, left, right)]
+    else: raise RuntimeError("Unknown footprint mode: {}".format(mode))
+
+    polygons = []
+    for piece in pieces:
+        if mode == 'hull': ring = simplify_hull(piece, max_vertices)
+        else: ring = simplify_ring(piece, max_vertices)
+        ring = [[get_coord(lons, c), get_coord(lats, r)] for c, r in ring]
+        area = get_signed_area(ring)
+        if len(set(map(tuple, ring))) < 3 or area == 0.: continue
+        # GeoJSON exterior rings are counter-clockwise in lon/lat
+        if area < 0.: ring.reverse()
+        ring.append(ring[0])
+        polygons.append(ring)
+    if len(polygons) == 0:
+        raise RuntimeError("No footprint polygon with nonzero area in {} mode".format(mode))
+    return polygons
@@ -0,0 +1,150 @@
+import os
+import gzip
+import time
+import shutil
+import logging
+import threading
+import subprocess
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# stack files each inversion method reads: GIAnT's SBASInvert.py and
+# NSBASInvert.py only read PROC-STACK.h5 (figram, dates, tims, Jmat, bperp,
+# cmask); RAW-STACK.h5 is only the input of ProcessStack.py, which the stack
+# PGEs already ran
+STACK_FILES = {
+    'sbas': ('PROC-STACK.h5',),
+    'nsbas': ('PROC-STACK.h5',),
+}
+
+# all stack files of a filtered ifg stack product
+ALL_STACK_FILES = ('RAW-STACK.h5', 'PROC-STACK.h5')
+
+# bytes copied per read when decompressing without pigz
+COPY_BYTES = 4 * 1024 * 1024
+
+
+def get_stack_files(method):
+    """Return the stack files an inversion method needs."""
+
+    if method not in STACK_FILES:
+        raise RuntimeError("Unknown inversion method: {}".format(method))
+    return STACK_FILES[method]
+
+
+class StackLocalizer(object):
+    """Localize the stack files an inversion method needs into dest_dir in
+       background threads while the PGE does other work: chunk-compressed
+       stacks (.h5) are moved and whole-file gzip-compressed stacks (.h5.gz)
+       are stream-decompressed (with pigz if available). Stacks the method
+       does not need are left alone.
+
+       wait() returns stats: per file format, compressed and decompressed
+       bytes and elapsed time, the bytes of skipped stacks, and the wall time
+       saved by overlapping (time between start() and wait()) and by
+       skipping (skipped compressed bytes at the observed decompression
+       rate)."""
+
+    def __init__(self, stack_dir, dest_dir, method):
+        self.stack_dir = stack_dir
+        self.dest_dir = dest_dir
+        self.files = get_stack_files(method)
+        self.procs = {}
+        self.cancelled = False
+        self.threads = []
+        self.stats = {'files': {}, 'skipped': {}}
+        self.errors = []
+        self.lock = threading.Lock()
+        self.t0 = None
+
+    def _decompress(self, gz_file, out_file):
+        if shutil.which("pigz"):
+            with open(out_file, 'wb') as f:
+                with self.lock:
+                    if self.cancelled: return
+                    proc = subprocess.Popen(["pigz", "-dc", gz_file], stdout=f)
+                    self.procs[gz_file] = proc
+                if proc.wait() != 0 and not self.cancelled:
+                    raise RuntimeError("Failed to decompress {}".format(gz_file))
+            return
+        with gzip.open(gz_file, 'rb') as fin, open(out_file, 'wb') as fout:
+            while not self.cancelled:
+                buf = fin.read(COPY_BYTES)
+                if not buf: break
+                fout.write(buf)
+
+    def _localize(self, name):
+        try:
+            t0 = time.time()
+            h5_file = os.path.join(self.stack_dir, name)
+            out_file = os.path.join(self.dest_dir, name)
+            if os.path.exists(h5_file):
+                shutil.move(h5_file, out_file)
+                stats = {'format': 'chunked', 'compressed_bytes': 0}
+            elif os.path.exists(h5_file + ".gz"):
+                stats = {'format': 'gzip', 'compressed_bytes': os.path.getsize(h5_file + ".gz")}
+                self._decompress(h5_file + ".gz", out_file)
+                if self.cancelled: return
+                os.unlink(h5_file + ".gz")
+            else: raise RuntimeError("Failed to find {} or {}.gz".format(h5_file, h5_file))
+            stats['bytes'] = os.path.getsize(out_file)
+            stats['elapsed'] = time.time() - t0
+            self.stats['files'][name] = stats
+            logger.info("Localized {}: {}".format(name, stats))
+        except Exception as e:
+            self.errors.append(e)
+
+    def start(self):
+        """Start localizing in background threads."""
+
+        if not os.path.isdir(self.dest_dir): os.makedirs(self.dest_dir, 0o755)
+        for name in ALL_STACK_FILES:
+            if name in self.files: continue
+            for skipped in (name, name + ".gz"):
+                path = os.path.join(self.stack_dir, skipped)
+                if os.path.exists(path): self.stats['skipped'][skipped] = os.path.getsize(path)
+        self.t0 = time.time()
+        for name in self.files:
+            thread = threading.Thread(target=self._localize, args=(name,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def cancel(self):
+        """Stop localizing, e.g. if the PGE exits early."""
+
+        with self.lock:
+            self.cancelled = True
+            for proc in self.procs.values():
+                if proc.poll() is None: proc.kill()
+        for thread in self.threads: thread.join()
+
+    def wait(self):
+        """Wait for the stacks to be localized and return stats."""
+
+        overlapped = time.time() - self.t0
+        for thread in self.threads: thread.join()
+        if self.errors: raise self.errors[0]
+        stats = self.stats
+        files = stats['files'].values()
+        stats['elapsed'] = time.time() - self.t0
+        stats['waited'] = stats['elapsed'] - overlapped
+        stats['bytes_decompressed'] = sum([i['bytes'] for i in files if i['format'] == 'gzip'])
+        stats['bytes_skipped'] = sum(stats['skipped'].values())
+
+        # wall time saved by overlapping and by skipping compressed stacks,
+        # estimated at the observed decompression rate
+        gz = [i for i in files if i['format'] == 'gzip']
+        gz_elapsed = sum([i['elapsed'] for i in gz])
+        skipped_gz = sum([v for k, v in stats['skipped'].items() if k.endswith(".gz")])
+        stats['time_saved_overlap'] = min(overlapped, max([0.] + [i['elapsed'] for i in files]))
+        stats['time_saved_skipped'] = None
+        if gz_elapsed > 0.:
+            rate = sum([i['compressed_bytes'] for i in gz]) / gz_elapsed
+            stats['time_saved_skipped'] = skipped_gz / rate
+        return stats
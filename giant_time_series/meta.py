@@ -0,0 +1,225 @@
+import os
+import re
+import pickle
+import logging
+import numpy as np
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from .utils import get_bperp
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 0.0066943799901
+
+# modules whose classes may be imported while unpickling a catalog
+SAFE_MODULES = ('builtins', '__builtin__', 'copyreg', 'copy_reg', 'collections',
+                'datetime', 'numpy', '_codecs')
+
+BURST_RE = re.compile(r'^burst(\d+)$')
+
+# parsed metadata keyed by (path, size, mtime)
+_CACHE = {}
+
+
+class CatalogStub(object):
+    """Placeholder for pickled objects of classes that were not imported
+       (e.g. ISCE components). Pickled state and items are kept and can
+       be indexed."""
+
+    def __init__(self, *args, **kwargs):
+        self.__dict__['_items'] = {}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple): state = state[-1]
+        if isinstance(state, dict): self.__dict__.update(state)
+
+    def __setitem__(self, key, value):
+        self.__dict__.setdefault('_items', {})[key] = value
+
+    def __getitem__(self, key):
+        items = self.__dict__.get('_items', {})
+        if key in items: return items[key]
+        return self.__dict__[key]
+
+
+class CatalogUnpickler(pickle.Unpickler):
+    """Unpickler that resolves classes outside of SAFE_MODULES to stubs so
+       that loading a catalog never imports ISCE."""
+
+    stubs = {}
+
+    def find_class(self, module, name):
+        if module.split('.')[0] in SAFE_MODULES:
+            return super(CatalogUnpickler, self).find_class(module, name)
+        key = (module, name)
+        if key not in self.stubs:
+            self.stubs[key] = type(str(name), (CatalogStub,), {'__module__': module})
+        return self.stubs[key]
+
+
+def _cached(func):
+    """Cache results of func(path) per path, size and mtime."""
+
+    def wrapper(path):
+        st = os.stat(path)
+        key = (func.__name__, os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if key not in _CACHE: _CACHE[key] = func(path)
+        return _CACHE[key]
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def load_catalog(cb_pkl):
+    """Load a PICKLE/computeBaselines catalog without importing ISCE."""
+
+    with open(cb_pkl, 'rb') as f:
+        return CatalogUnpickler(f).load()
+
+
+def _get_baseline_info(catalog):
+    return {
+        'bperp': get_bperp(catalog),
+        'master_mission': catalog['master']['sensor']['mission'],
+        'slave_mission': catalog['slave']['sensor']['mission'],
+        'imagingmode': catalog['master']['sensor']['imagingmode'],
+    }
+
+
+@_cached
+def get_baseline_info(cb_pkl):
+    """Return perpendicular baseline, mission and imaging mode from a
+       PICKLE/computeBaselines catalog. Falls back to a full unpickle
+       (importing ISCE) if the catalog cannot be read with stubs."""
+
+    try: return _get_baseline_info(load_catalog(cb_pkl))
+    except Exception as e:
+        logger.warn("Falling back to full unpickle of {}: {}".format(cb_pkl, str(e)))
+    with open(cb_pkl, 'rb') as f:
+        return _get_baseline_info(pickle.load(f))
+
+
+def _name(elem):
+    return elem.get('name', '').lower().replace('_', '')
+
+
+def _value(elem, name):
+    """Return text value of property name of an ISCE XML component."""
+
+    for prop in elem.findall('property'):
+        if _name(prop) == name:
+            value = prop.find('value')
+            return None if value is None else value.text.strip()
+    return None
+
+
+def parse_datetime(value):
+    """Parse ISCE datetime string."""
+
+    value = value.strip().replace('T', ' ')
+    fmt = "%Y-%m-%d %H:%M:%S.%f" if '.' in value else "%Y-%m-%d %H:%M:%S"
+    return datetime.strptime(value, fmt)
+
+
+def parse_vector(value):
+    """Parse ISCE vector string, e.g. '[1.0, 2.0, 3.0]'."""
+
+    return np.array([float(i) for i in value.strip('[]() ').replace(',', ' ').split()])
+
+
+@_cached
+def get_ifg_xml_info(ifg_xml):
+    """Return radar wavelength, sensing mid and orbit state vectors of the
+       first burst of an ISCE fine_interferogram.xml. Fields that are not
+       found are None."""
+
+    root = ET.parse(ifg_xml).getroot()
+    bursts = []
+    for comp in root.iter('component'):
+        match = BURST_RE.search(_name(comp))
+        if match: bursts.append((int(match.group(1)), comp))
+    info = {'wavelength': None, 'sensing_mid': None, 'state_vectors': None}
+    if len(bursts) == 0: return info
+    burst = min(bursts, key=lambda x: x[0])[1]
+    wavelength = _value(burst, 'radarwavelength')
+    if wavelength is not None: info['wavelength'] = float(wavelength)
+    sensing_mid = _value(burst, 'sensingmid')
+    if sensing_mid is not None: info['sensing_mid'] = parse_datetime(sensing_mid)
+
+    # orbit state vectors
+    svs = []
+    for comp in burst.iter('component'):
+        if _name(comp) != 'orbit': continue
+        for sv in comp.iter('component'):
+            t, pos, vel = [_value(sv, i) for i in ('time', 'position', 'velocity')]
+            if None in (t, pos, vel): continue
+            svs.append((parse_datetime(t), parse_vector(pos), parse_vector(vel)))
+        break
+    if len(svs) >= 2: info['state_vectors'] = sorted(svs, key=lambda x: x[0])
+    return info
+
+
+def interpolate_orbit(state_vectors, time):
+    """Return position and velocity at time by cubic Hermite interpolation
+       between the bracketing state vectors."""
+
+    times = [i[0] for i in state_vectors]
+    idx = int(np.searchsorted(times, time))
+    idx = min(max(idx, 1), len(times) - 1)
+    t0, p0, v0 = state_vectors[idx-1]
+    t1, p1, v1 = state_vectors[idx]
+    p0, v0, p1, v1 = [np.asarray(i, dtype=np.float64) for i in (p0, v0, p1, v1)]
+    h = (t1 - t0).total_seconds()
+    s = (time - t0).total_seconds() / h
+    pos = ((2*s**3 - 3*s**2 + 1) * p0 + (s**3 - 2*s**2 + s) * h * v0 +
+           (-2*s**3 + 3*s**2) * p1 + (s**3 - s**2) * h * v1)
+    vel = ((6*s**2 - 6*s) * p0 + (3*s**2 - 4*s + 1) * h * v0 +
+           (-6*s**2 + 6*s) * p1 + (3*s**2 - 2*s) * h * v1) / h
+    return pos, vel
+
+
+def xyz_to_llh(xyz):
+    """Return geodetic latitude, longitude (radians) and height of ECEF
+       coordinates on the WGS84 ellipsoid."""
+
+    x, y, z = xyz
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p * (1. - WGS84_E2))
+    for i in range(5):
+        n = WGS84_A / np.sqrt(1. - WGS84_E2 * np.sin(lat)**2)
+        h = p / np.cos(lat) - n
+        lat = np.arctan2(z, p * (1. - WGS84_E2 * n / (n + h)))
+    return lat, lon, h
+
+
+def get_enu_heading(state_vectors, time):
+    """Return heading in degrees (clockwise from north) of the platform
+       velocity at time, as ISCE's Orbit.getENUHeading()."""
+
+    pos, vel = interpolate_orbit(state_vectors, time)
+    lat, lon, _ = xyz_to_llh(pos)
+    east = np.array([-np.sin(lon), np.cos(lon), 0.])
+    north = np.array([-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)])
+    return np.degrees(np.arctan2(np.dot(east, vel), np.dot(north, vel)))
+
+
+def get_sensing_info(ifg_xml):
+    """Return radar wavelength, sensing mid and ENU heading degree parsed
+       from an ISCE fine_interferogram.xml or None if any field is missing."""
+
+    try: info = get_ifg_xml_info(ifg_xml)
+    except Exception as e:
+        logger.warn("Failed to parse {}: {}".format(ifg_xml, str(e)))
+        return None
+    if None in (info['wavelength'], info['sensing_mid'], info['state_vectors']):
+        return None
+    heading_deg = get_enu_heading(info['state_vectors'], info['sensing_mid'])
+    return info['wavelength'], info['sensing_mid'], float(heading_deg)
@@ -0,0 +1,206 @@
+import os
+import logging
+import numpy as np
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def get_epochs(pairs):
+    """Return sorted acquisition epochs of (master, slave) date pairs and
+       the (master, slave) epoch indices of each pair."""
+
+    epochs = sorted(set([d for pair in pairs for d in pair]))
+    index = dict([(d, i) for i, d in enumerate(epochs)])
+    edges = np.array([(index[m], index[s]) for m, s in pairs], dtype=np.int64).reshape(-1, 2)
+    return epochs, edges
+
+
+def find(parent, i):
+    """Return root of i in a union-find forest (with path halving)."""
+
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def union(parent, rank, i, j):
+    """Merge the sets of i and j; return False if already merged."""
+
+    i, j = find(parent, i), find(parent, j)
+    if i == j: return False
+    if rank[i] < rank[j]: i, j = j, i
+    parent[j] = i
+    if rank[i] == rank[j]: rank[i] += 1
+    return True
+
+
+def get_components(pairs):
+    """Return the acquisition epochs of an ifg network of (master, slave)
+       date pairs, the connected component label of each epoch and of each
+       pair. Components are labeled 0, 1, ... by their first epoch."""
+
+    epochs, edges = get_epochs(pairs)
+    parent = list(range(len(epochs)))
+    rank = [0] * len(epochs)
+    for i, j in edges.tolist(): union(parent, rank, i, j)
+    roots = [find(parent, i) for i in range(len(epochs))]
+    labels = {}
+    epoch_labels = np.array([labels.setdefault(r, len(labels)) for r in roots], dtype=np.int64)
+    pair_labels = epoch_labels[edges[:, 0]] if len(edges) else np.zeros(0, dtype=np.int64)
+    return epochs, epoch_labels, pair_labels
+
+
+def is_connected(pairs):
+    """Return True if an ifg network of (master, slave) date pairs is a
+       single connected component."""
+
+    epoch_labels = get_components(pairs)[1]
+    return len(epoch_labels) > 0 and epoch_labels.max() == 0
+
+
+def get_epoch_baselines(pairs, bperps):
+    """Return perpendicular baseline of each epoch relative to the first
+       epoch of its component: the least squares solution of
+       B[slave] - B[master] = bperp over the pairs."""
+
+    epochs, edges = get_epochs(pairs)
+    _, epoch_labels, pair_labels = get_components(pairs)
+    bperps = np.asarray(bperps, dtype=np.float64)
+    baselines = np.zeros(len(epochs))
+    for label in range(epoch_labels.max() + 1 if len(epochs) else 0):
+        members = np.nonzero(epoch_labels == label)[0]
+        if len(members) < 2: continue
+        # columns are the epochs but the first (reference) of the component
+        col = np.full(len(epochs), -1, dtype=np.int64)
+        col[members[1:]] = np.arange(len(members) - 1)
+        rows = np.nonzero(pair_labels == label)[0]
+        m, sl, b = col[edges[rows, 0]], col[edges[rows, 1]], bperps[rows]
+
+        # normal equations (the reduced graph Laplacian) built in O(pairs)
+        n = len(members) - 1
+        lap, rhs = np.zeros((n, n)), np.zeros(n)
+        vm, vs = m >= 0, sl >= 0
+        np.add.at(lap, (m[vm], m[vm]), 1.)
+        np.add.at(lap, (sl[vs], sl[vs]), 1.)
+        both = vm & vs
+        np.add.at(lap, (m[both], sl[both]), -1.)
+        np.add.at(lap, (sl[both], m[both]), -1.)
+        np.add.at(rhs, sl[vs], b[vs])
+        np.add.at(rhs, m[vm], -b[vm])
+        baselines[members[1:]] = np.linalg.lstsq(lap, rhs, rcond=None)[0]
+    return baselines
+
+
+def get_bridges(pairs):
+    """Return indices of the bridge pairs of an ifg network: pairs whose
+       loss would split their component. Repeated pairs are never bridges.
+       Iterative Tarjan lowlink search, linear in epochs and pairs."""
+
+    epochs, edges = get_epochs(pairs)
+    adj = [[] for i in range(len(epochs))]
+    for k, (i, j) in enumerate(edges.tolist()):
+        adj[i].append((j, k))
+        adj[j].append((i, k))
+    order = [-1] * len(epochs)
+    low = [0] * len(epochs)
+    bridges = []
+    count = 0
+    for root in range(len(epochs)):
+        if order[root] >= 0: continue
+        order[root] = low[root] = count
+        count += 1
+        stack = [(root, -1, iter(adj[root]))]
+        while stack:
+            node, via, neighbors = stack[-1]
+            for nxt, k in neighbors:
+                if k == via: continue
+                if order[nxt] < 0:
+                    order[nxt] = low[nxt] = count
+                    count += 1
+                    stack.append((nxt, k, iter(adj[nxt])))
+                    break
+                low[node] = min(low[node], order[nxt])
+            else:
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] > order[parent]: bridges.append(via)
+    return sorted(bridges)
+
+
+def get_redundancy(pairs):
+    """Return the acquisition epochs of an ifg network and the number of
+       pairs including each epoch."""
+
+    epochs, edges = get_epochs(pairs)
+    return epochs, np.bincount(edges.ravel(), minlength=len(epochs))
+
+
+def get_gaps(pairs):
+    """Return temporal gaps of an ifg network: (end, start) epochs of
+       consecutive epochs that no pair spans."""
+
+    epochs, edges = get_epochs(pairs)
+    if len(epochs) < 2: return []
+
+    # number of pairs spanning each interval between consecutive epochs
+    spans = np.zeros(len(epochs), dtype=np.int64)
+    np.add.at(spans, edges.min(axis=1), 1)
+    np.add.at(spans, edges.max(axis=1), -1)
+    spans = np.cumsum(spans)[:-1]
+    return [(epochs[i], epochs[i+1]) for i in np.nonzero(spans == 0)[0]]
+
+
+def analyze_network(pairs):
+    """Return connectivity analysis of an ifg network of (master, slave)
+       date pairs: its epochs, whether it is connected (a single component,
+       as an SBAS inversion needs), the epochs of each component, the
+       indices of bridge pairs, the number of pairs per epoch and the
+       temporal gaps."""
+
+    epochs, epoch_labels, _ = get_components(pairs)
+    components = [[] for i in range(epoch_labels.max() + 1 if len(epochs) else 0)]
+    for epoch, label in zip(epochs, epoch_labels.tolist()): components[label].append(epoch)
+    redundancy = get_redundancy(pairs)[1]
+    return {
+        'epochs': epochs,
+        'connected': len(components) == 1,
+        'components': components,
+        'bridges': get_bridges(pairs),
+        'redundancy': redundancy.tolist(),
+        'gaps': get_gaps(pairs),
+    }
+
+
+def write_gaps(network, gap_file):
+    """Write temporal gaps and disconnected components of an analyzed ifg
+       network (as returned by analyze_network())."""
+
+    with open(gap_file, "w") as f:
+        if network['connected']:
+            f.write("No temporal gaps")
+            return
+        if network['gaps']:
+            f.write("Temporal gaps:\n")
+            for end, start in network['gaps']: f.write("{} - {}\n".format(end, start))
+        f.write("Disconnected components:\n")
+        for component in network['components']:
+            f.write("{} - {} ({} epochs)\n".format(component[0], component[-1], len(component)))
+
+
+def log_network(network, pairs):
+    """Log connectivity analysis of an ifg network."""
+
+    logger.info("Network of {} epochs and {} pairs: {} component(s), {} gap(s), {} bridge pair(s)".format(
+                len(network['epochs']), len(pairs), len(network['components']),
+                len(network['gaps']), len(network['bridges'])))
+    for i in network['bridges']: logger.info("Bridge pair: {} - {}".format(*pairs[i]))
+    if network['redundancy']:
+        low = min(network['redundancy'])
+        logger.info("Minimum pairs per epoch: {} ({})".format(low, ", ".join(
+                    [str(e) for e, r in zip(network['epochs'], network['redundancy']) if r == low])))
@@ -0,0 +1,262 @@
+import os
+import time
+import logging
+import multiprocessing
+import numpy as np
+
+from .cache import LRUCache
+from .sbas import (BLOCK_BYTES, get_params, get_design_matrix, group_pixels, get_filter_weights,
+                   create_ts_datasets, iter_stack_blocks, create_params_file, write_block)
+from .utils import get_cpu_count
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# weight of the temporal regularization (NSBASInvert.py's default)
+GAMMA = 1e-4
+
+# names of the parameters of the temporal model the time series is
+# regularized towards: offset + velocity * (t - t_ref)
+MODEL_NAMES = ('offset', 'velocity')
+
+# upper bound on the number of factorizations cached per worker
+CACHE_ENTRIES = 256
+
+# tasks per worker per block of rows
+TASKS_PER_WORKER = 4
+
+# state of the worker processes, set by init_worker()
+_state = {}
+
+
+def get_model_matrix(tims, ref=0):
+    """Return the (epoch, parameter) matrix of the temporal model."""
+
+    tims = np.asarray(tims, dtype=np.float64)
+    return np.stack([np.ones(len(tims)), tims - tims[ref]], axis=1)
+
+
+def get_normal_matrix(design, model, ref, gamma):
+    """Return the regularized normal matrix of the unknowns (time series
+       without the reference epoch, model parameters) of a design matrix:
+       A^T A of A = [[G, 0], [gamma E, -gamma M]], where E maps the unknown
+       epochs to all epochs (ts[ref] = 0) and M is the model matrix."""
+
+    nepoch, nparm = model.shape
+    expand = np.insert(np.eye(nepoch - 1), ref, 0., axis=0)
+    reg = gamma * np.hstack([expand, -model])
+    normal = np.dot(reg.T, reg)
+    normal[:nepoch-1, :nepoch-1] += np.dot(design.T, design)
+    return normal
+
+
+def factorize(design, model, ref, gamma):
+    """Return the Cholesky factorization of the regularized normal matrix
+       and the diagonal of its inverse (unit variance of each unknown)."""
+
+    from scipy.linalg import cho_factor, cho_solve
+
+    factor = cho_factor(get_normal_matrix(design, model, ref, gamma))
+    variance = np.diag(cho_solve(factor, np.eye(len(factor[0]))))
+    return factor, variance
+
+
+def solve_pattern(design, model, ref, gamma, factor, variance, data):
+    """Solve the regularized normal equations of one valid-ifg pattern for
+       every pixel of (ifg, pixel) data as one multi-column right-hand side.
+       Returns the (epoch, pixel) time series, its formal errors (unit
+       variance scaled by the residual) and the (parameter, pixel) model
+       parameters."""
+
+    from scipy.linalg import cho_solve
+
+    nepoch, nparm = model.shape
+    rhs = np.zeros((nepoch - 1 + nparm, data.shape[1]))
+    rhs[:nepoch-1] = np.dot(design.T, data)
+    x = cho_solve(factor, rhs)
+    ts = np.insert(x[:nepoch-1], ref, 0., axis=0)
+    parms = x[nepoch-1:]
+
+    # residual of the data and regularization equations
+    rss = ((data - np.dot(design, x[:nepoch-1])) ** 2).sum(axis=0)
+    rss += gamma ** 2 * ((ts - np.dot(model, parms)) ** 2).sum(axis=0)
+    dof = max(1, data.shape[0] + 1 - nparm)
+    sigma = np.sqrt(rss / dof)
+    error = np.insert(np.sqrt(np.maximum(variance[:nepoch-1], 0.)), ref, 0.)[:, None] * sigma
+    return ts, error, parms
+
+
+def init_worker(design, model, ref, gamma, cache_entries=CACHE_ENTRIES):
+    """Set the inversion state of a worker process."""
+
+    _state.update({'design': design, 'model': model, 'ref': ref, 'gamma': gamma,
+                   'cache': LRUCache(cache_entries)})
+
+
+def solve_groups(groups):
+    """Solve groups of pixels sharing a valid-ifg pattern with the worker
+       state. groups is a list of (pattern key, pattern, pixel indices,
+       (valid ifg, pixel) data). Returns (pixel indices, time series, errors,
+       parameters) per group and the cache stats."""
+
+    design, model, ref, gamma = [_state[i] for i in ('design', 'model', 'ref', 'gamma')]
+    cache = _state['cache']
+    results = []
+    for key, pattern, pixels, data in groups:
+        design_p = design[pattern]
+        cached = cache.get(key)
+        if cached is None:
+            cached = factorize(design_p, model, ref, gamma)
+            cache.put(key, cached)
+        results.append((pixels,) + solve_pattern(design_p, model, ref, gamma, cached[0],
+                                                 cached[1], data))
+    return results, cache.pop_stats()
+
+
+def get_tasks(data, nvalid, ntasks):
+    """Split the pixels of (ifg, pixel) data with at least nvalid valid ifgs
+       into about ntasks tasks of groups sharing a valid-ifg pattern for
+       solve_groups(). Groups larger than a task are split."""
+
+    patterns, order, counts = group_pixels(np.isfinite(data))
+    size = max(1, int(np.ceil(float(counts[patterns.sum(axis=1) >= nvalid].sum()) / ntasks)))
+    tasks, task, task_size = [], [], 0
+    start = 0
+    for pattern, count in zip(patterns, counts.tolist()):
+        pixels = order[start:start+count]
+        start += count
+        if pattern.sum() < nvalid: continue
+        key = np.packbits(pattern).tobytes()
+        for i in range(0, count, size):
+            piece = pixels[i:i+size]
+            task.append((key, pattern, piece, data[np.ix_(pattern, piece)]))
+            task_size += len(piece)
+            if task_size >= size:
+                tasks.append(task)
+                task, task_size = [], 0
+    if task: tasks.append(task)
+    return tasks
+
+
+class NSBASInverter(object):
+    """NSBAS inversion of blocks of pixels of a processed stack. The groups
+       of pixels sharing a valid-ifg pattern are solved by solve_groups()
+       with the state set by init_worker(*initargs) in the solving
+       process."""
+
+    def __init__(self, jmat, tims, ref=0, nvalid=1, filt=0., gamma=GAMMA,
+                 cache_entries=CACHE_ENTRIES):
+        self.nsar = jmat.shape[1]
+        self.nvalid = max(1, nvalid)
+        self.gamma = gamma
+        self.weights = get_filter_weights(tims, filt)
+        self.initargs = (get_design_matrix(jmat, ref), get_model_matrix(tims, ref), ref, gamma,
+                         cache_entries)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'pixels': 0}
+
+    @classmethod
+    def from_stack(cls, src, nvalid=1, filt=0., gamma=GAMMA, cache_entries=CACHE_ENTRIES):
+        """Return inverter of an open processed stack."""
+
+        ref = int(src['masterind'][()]) if 'masterind' in src else 0
+        return cls(src['Jmat'][:], src['tims'][:], ref, nvalid, filt, gamma, cache_entries)
+
+    def create(self, src, dst):
+        """Create the NSBAS-PARAMS.h5 datasets in an open file and return the
+           ones written per block."""
+
+        length, width = src['figram'].shape[1:]
+        dsets = {'ifgcnt': create_params_file(src, dst)}
+        dsets['rawts'], dsets['recons'], dsets['error'] = create_ts_datasets(
+            dst, (("rawts", "Raw time-series"), ("recons", "Filtered time-series"),
+                  ("error", "Formal error of time-series")), (self.nsar, length, width))
+        dsets['parms'] = dst.create_dataset('parms', (len(MODEL_NAMES), length, width), 'f4')
+        dsets['parms'].attrs.create("help", np.bytes_("Temporal model parameters"))
+        dst.create_dataset('mName', data=np.array([np.bytes_(i) for i in MODEL_NAMES]))
+        dst.create_dataset('gamma', data=self.gamma)
+        return dsets
+
+    def invert(self, data, ntasks=1, map_func=map):
+        """Return rawts, recons, error, parms and ifgcnt of (ifg, pixel) data,
+           solving ntasks tasks of pixel groups with map_func."""
+
+        npix = data.shape[1]
+        ts = np.full((self.nsar, npix), np.nan)
+        err = np.full((self.nsar, npix), np.nan)
+        prm = np.full((len(MODEL_NAMES), npix), np.nan)
+        for groups, cache_stats in map_func(solve_groups, get_tasks(data, self.nvalid, ntasks)):
+            for pixels, g_ts, g_err, g_prm in groups:
+                ts[:, pixels], err[:, pixels], prm[:, pixels] = g_ts, g_err, g_prm
+                self.stats['pixels'] += len(pixels)
+            for i in cache_stats: self.stats[i] += cache_stats[i]
+        return {'rawts': ts, 'recons': np.dot(self.weights, ts), 'error': err,
+                'parms': prm, 'ifgcnt': np.isfinite(data).sum(axis=0)}
+
+    def pop_stats(self):
+        """Return stats since the last call and reset them."""
+
+        stats = self.stats
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'pixels': 0}
+        return stats
+
+
+def log_stats(stats, stack_file, out_file):
+    """Add the cache hit rate and pixels/s to the stats of an inversion and
+       log them."""
+
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = float(stats['hits']) / total if total else 0.
+    stats['pixels_per_s'] = stats['pixels'] / stats['elapsed'] if stats['elapsed'] > 0. else None
+    logger.info("Inverted {} into {}: {}".format(stack_file, out_file, stats))
+    logger.info("Factorization cache: {} hits, {} misses ({:.1f}% hit rate), {:.0f} pixels/s".format(
+                stats['hits'], stats['misses'], 100. * stats['hit_rate'],
+                stats['pixels_per_s'] or 0.))
+    return stats
+
+
+def invert_nsbas(stack_file, out_file, nvalid=None, filt=None, gamma=GAMMA, xml_file=None,
+                 nproc=None, cache_entries=CACHE_ENTRIES, block_bytes=BLOCK_BYTES):
+    """Invert a GIAnT processed stack (PROC-STACK.h5) for the NSBAS time
+       series (least squares regularized by gamma towards a linear temporal
+       model, so pixels with disconnected networks are bridged) and write it
+       in the NSBAS-PARAMS.h5 layout: dates, tims, cmask, ifgcnt, float32
+       (epoch, line, pixel) rawts, recons (rawts smoothed in time with a
+       Gaussian of width filt years) and error (formal errors), and the
+       (parameter, line, pixel) model parameters parms.
+
+       Pixels of each block of rows are grouped by their valid-ifg pattern
+       and the groups are solved by nproc worker processes, each caching
+       the factorization of the normal equations of up to cache_entries
+       patterns (LRU). nvalid and filt default to the ones of xml_file
+       (sbas.xml). Returns stats, including the cache hit rate and pixels/s."""
+
+    import h5py
+
+    params = get_params(xml_file, nvalid=nvalid, filt=filt)
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, nproc)
+    t0 = time.time()
+    pool = None
+    with h5py.File(stack_file, 'r') as src, h5py.File(out_file, 'w') as dst:
+        width = src['figram'].shape[2]
+        inverter = NSBASInverter.from_stack(src, params['nvalid'], params['filt'], gamma,
+                                            cache_entries)
+        dsets = inverter.create(src, dst)
+        if nproc > 1: pool = multiprocessing.Pool(nproc, init_worker, inverter.initargs)
+        else: init_worker(*inverter.initargs)
+        try:
+            for r0, r1, data in iter_stack_blocks(src, block_bytes):
+                outputs = inverter.invert(data, nproc * TASKS_PER_WORKER,
+                                          pool.imap_unordered if pool else map)
+                write_block(dsets, outputs, r0, r1, 0, width)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    stats = inverter.pop_stats()
+    stats.update({'nvalid': params['nvalid'], 'filt': params['filt'], 'gamma': gamma,
+                  'nproc': nproc, 'elapsed': time.time() - t0})
+    return log_stats(stats, stack_file, out_file)
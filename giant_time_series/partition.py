@@ -0,0 +1,249 @@
+import os
+import copy
+import json
+import time
+import logging
+import multiprocessing
+import numpy as np
+
+from .rechunk import COORDS, TILE_SUFFIX
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# default overlap (pixels) of neighboring partitions on each side
+OVERLAP = 16
+
+# bytes of ifgs copied per block when cropping a stack
+CROP_BYTES = 64 * 1024 * 1024
+
+# attributes recording the partition of a partition's time series file
+PARTITION_ATTRS = ('partition_index', 'partition_count', 'partition_shape',
+                   'partition_window', 'partition_core')
+
+
+def get_partition_grid(shape, count):
+    """Return (rows, cols) of a grid of count partitions of a (line, pixel)
+       raster whose partitions are closest to square."""
+
+    length, width = shape
+    grids = [(i, count // i) for i in range(1, count + 1) if count % i == 0]
+    return min(grids, key=lambda g: abs(np.log((float(length) / g[0]) / (float(width) / g[1]))))
+
+
+def get_partitions(shape, count, overlap=OVERLAP):
+    """Return count spatial partitions of a (line, pixel) raster: index,
+       count, shape, the core [r0, r1, c0, c1] each partition owns (the cores
+       tile the raster) and the window it inverts (the core grown by overlap
+       pixels on each side, within the raster)."""
+
+    length, width = shape
+    rows, cols = get_partition_grid(shape, count)
+    if rows > length or cols > width:
+        raise RuntimeError("Cannot split {} raster into {} partitions".format(shape, count))
+    row_edges = np.linspace(0, length, rows + 1).round().astype(int).tolist()
+    col_edges = np.linspace(0, width, cols + 1).round().astype(int).tolist()
+    partitions = []
+    for i in range(rows):
+        for j in range(cols):
+            core = [row_edges[i], row_edges[i+1], col_edges[j], col_edges[j+1]]
+            window = [max(0, core[0] - overlap), min(length, core[1] + overlap),
+                      max(0, core[2] - overlap), min(width, core[3] + overlap)]
+            partitions.append({'index': len(partitions), 'count': count,
+                               'shape': [length, width], 'core': core, 'window': window})
+    return partitions
+
+
+def plan_partitions(input_json, shape, count, overlap=OVERLAP):
+    """Return the input JSONs of the partition jobs of a displacement time
+       series job: copies of input_json with its partition."""
+
+    jobs = []
+    for partition in get_partitions(shape, count, overlap):
+        job = copy.deepcopy(input_json)
+        job['partition'] = partition
+        jobs.append(job)
+    return jobs
+
+
+def write_plan(input_json_file, shape, count, overlap=OVERLAP, out_dir="."):
+    """Write the input JSONs of the partition jobs of a displacement time
+       series job as <input>.part<index>.json in out_dir and return their
+       paths."""
+
+    with open(input_json_file) as f:
+        input_json = json.load(f)
+    root = os.path.splitext(os.path.basename(input_json_file))[0]
+    paths = []
+    for job in plan_partitions(input_json, shape, count, overlap):
+        path = os.path.join(out_dir, "{}.part{:03d}.json".format(root, job['partition']['index']))
+        with open(path, 'w') as f:
+            json.dump(job, f, indent=2)
+        paths.append(path)
+    logger.info("Wrote {} partition job inputs of {}".format(len(paths), input_json_file))
+    return paths
+
+
+def crop_stack(stack_file, out_file, window, block_bytes=CROP_BYTES):
+    """Write the window [r0, r1, c0, c1] of a GIAnT processed stack
+       (PROC-STACK.h5) to out_file: 3D (ifg, line, pixel) and 2D (line,
+       pixel) datasets are cropped (keeping their chunking and compression),
+       other objects are copied as is."""
+
+    import h5py
+
+    r0, r1, c0, c1 = window
+    with h5py.File(stack_file, 'r') as src, h5py.File(out_file, 'w') as dst:
+        for k, v in src.attrs.items(): dst.attrs[k] = v
+        shape = src['figram'].shape[1:]
+        for name in src:
+            obj = src[name]
+            if not isinstance(obj, h5py.Dataset) or obj.shape[-2:] != shape:
+                src.copy(obj, dst, name=name)
+                continue
+            out_shape = obj.shape[:-2] + (r1 - r0, c1 - c0)
+            chunks = None
+            if obj.chunks:
+                chunks = tuple([min(c, s) for c, s in zip(obj.chunks, out_shape)])
+            dset = dst.create_dataset(name, out_shape, obj.dtype, chunks=chunks,
+                                      compression=obj.compression,
+                                      compression_opts=obj.compression_opts,
+                                      shuffle=obj.shuffle)
+            for k, v in obj.attrs.items(): dset.attrs[k] = v
+            if obj.ndim == 2:
+                dset[:] = obj[r0:r1, c0:c1]
+                continue
+            rows = max(1, int(block_bytes // max(1, obj.shape[0] * (c1 - c0) * obj.dtype.itemsize)))
+            for r in range(r0, r1, rows):
+                dset[:, r - r0:min(r1, r + rows) - r0, :] = obj[:, r:min(r1, r + rows), c0:c1]
+
+
+def set_partition_attrs(h5_file, partition):
+    """Record the partition of a partition's time series file."""
+
+    import h5py
+
+    with h5py.File(h5_file, 'r+') as h5f:
+        for name in PARTITION_ATTRS:
+            h5f.attrs[name] = np.array(partition[name.replace('partition_', '')], dtype=np.int64)
+
+
+def get_partition_attrs(h5f):
+    """Return the partition recorded in an open partition's time series
+       file."""
+
+    missing = [i for i in PARTITION_ATTRS if i not in h5f.attrs]
+    if missing:
+        raise RuntimeError("{} is not a partition (missing {})".format(h5f.filename, missing))
+    partition = dict([(i.replace('partition_', ''), h5f.attrs[i].tolist()) for i in PARTITION_ATTRS])
+    return partition
+
+
+def merge_partitions(ts_files, out_file):
+    """Stitch the time series files of the partitions of a raster into
+       out_file: the core of each partition of every (..., line, pixel)
+       dataset is copied into a dataset of the full raster; other datasets
+       (dates, tims, ...) are copied from the first partition. Coordinates
+       (time, lat, lon) and tiled copies are left out; the lat and lon of
+       the full raster stitched from the partitions' (None if they have
+       none) are returned for rechunk_ts() to add with their scales.
+       Raises RuntimeError unless the cores tile the raster exactly."""
+
+    import h5py
+
+    t0 = time.time()
+    with h5py.File(ts_files[0], 'r') as h5f:
+        first = get_partition_attrs(h5f)
+    length, width = first['shape']
+    coverage = np.zeros((length, width), dtype=np.int32)
+    stitched_lats, stitched_lons = np.full(length, np.nan), np.full(width, np.nan)
+    with h5py.File(out_file, 'w') as dst:
+        for i, ts_file in enumerate(ts_files):
+            with h5py.File(ts_file, 'r') as src:
+                part = get_partition_attrs(src)
+                if part['shape'] != first['shape'] or part['count'] != first['count']:
+                    raise RuntimeError("{} is a partition of another raster".format(ts_file))
+                w0, w1, v0, v1 = part['window']
+                r0, r1, c0, c1 = part['core']
+                rows = slice(r0 - w0, r1 - w0)
+                cols = slice(c0 - v0, c1 - v0)
+                coverage[r0:r1, c0:c1] += 1
+                if 'lat' in src: stitched_lats[r0:r1] = src['lat'][rows]
+                if 'lon' in src: stitched_lons[c0:c1] = src['lon'][cols]
+                for name in src:
+                    obj = src[name]
+                    if name in COORDS or name.endswith(TILE_SUFFIX): continue
+                    spatial = isinstance(obj, h5py.Dataset) and obj.shape[-2:] == (w1 - w0, v1 - v0)
+                    if i == 0:
+                        if not spatial:
+                            src.copy(obj, dst, name=name)
+                            continue
+                        dset = dst.create_dataset(name, obj.shape[:-2] + (length, width), obj.dtype)
+                        for k, v in obj.attrs.items():
+                            if k not in ('DIMENSION_LIST', 'REFERENCE_LIST'): dset.attrs[k] = v
+                    if spatial: dst[name][..., r0:r1, c0:c1] = obj[..., rows, cols]
+                if i == 0:
+                    for k, v in src.attrs.items():
+                        if k not in PARTITION_ATTRS: dst.attrs[k] = v
+    if coverage.min() != 1 or coverage.max() != 1:
+        os.unlink(out_file)
+        raise RuntimeError("Partitions do not tile the {}x{} raster exactly ({} of {} given)".format(
+                           length, width, len(ts_files), first['count']))
+    logger.info("Merged {} partitions into {} in {:.2f}s".format(len(ts_files), out_file,
+                                                                time.time() - t0))
+    if np.isnan(stitched_lats).any() or np.isnan(stitched_lons).any(): return None, None
+    return stitched_lats, stitched_lons
+
+
+def invert_partition(stack_file, out_file, partition, method='sbas', xml_file=None, nproc=1,
+                     work_dir=None, **kwargs):
+    """Invert the window of a partition of a processed stack with the native
+       tiled inversion (see invert_tiled()) into out_file and record the
+       partition in it."""
+
+    from .tiling import invert_tiled
+
+    if work_dir is None: work_dir = os.path.dirname(os.path.abspath(out_file))
+    crop_file = os.path.join(work_dir, "PROC-STACK.part{:03d}.h5".format(partition['index']))
+    try:
+        crop_stack(stack_file, crop_file, partition['window'])
+        stats = invert_tiled(crop_file, out_file, method, nproc=nproc, xml_file=xml_file,
+                             **kwargs)
+    finally:
+        if os.path.exists(crop_file): os.unlink(crop_file)
+    set_partition_attrs(out_file, partition)
+    return stats
+
+
+def _invert_partition(args):
+    stack_file, out_file, partition, method, xml_file, kwargs = args
+    invert_partition(stack_file, out_file, partition, method, xml_file, **kwargs)
+
+
+def run_partitions(stack_file, out_file, count, overlap=OVERLAP, method='sbas', xml_file=None,
+                   nproc=None, work_dir=None, **kwargs):
+    """Invert a processed stack locally in count partitions, each in its own
+       process (at most nproc at a time), and merge them into out_file as
+       the partition jobs and the merge job of a partitioned displacement
+       time series would. Returns the partition time series files."""
+
+    import h5py
+
+    if nproc is None: nproc = count
+    if work_dir is None: work_dir = os.path.dirname(os.path.abspath(out_file))
+    with h5py.File(stack_file, 'r') as h5f:
+        shape = h5f['figram'].shape[1:]
+    partitions = get_partitions(shape, count, overlap)
+    ts_files = [os.path.join(work_dir, "part{:03d}.h5".format(i['index'])) for i in partitions]
+    tasks = [(stack_file, f, p, method, xml_file, kwargs) for f, p in zip(ts_files, partitions)]
+    ctx = multiprocessing.get_context('spawn')
+    pool = ctx.Pool(max(1, min(nproc, count)), maxtasksperchild=1)
+    try: pool.map(_invert_partition, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    merge_partitions(ts_files, out_file)
+    return ts_files
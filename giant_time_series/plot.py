@@ -1,10 +1,9 @@
 import os
+import math
 import logging
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+import numpy as np
 
-
-mpl.use('Agg')
+from .rechunk import TILE_SUFFIX
 
 
 log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
@@ -12,21 +11,238 @@ logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 
+def get_pyplot():
+    """Return matplotlib.pyplot with the Agg backend, importing it on first
+       use."""
+
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# colormap and percentile clip of the displacement browse images
+BROWSE_CMAP = "RdBu_r"
+BROWSE_PERCENTILE = 98.
+
+# upper bound on the width/length of browse images
+BROWSE_MAX_SIZE = 2048
+
+# bytes of time series read at a time when computing the velocity browse
+VELOCITY_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def get_stride(shape, scale=.5, max_size=BROWSE_MAX_SIZE):
+    """Return pixel stride to decimate a raster of shape by scale with the
+       output not exceeding max_size in either dimension."""
+
+    stride = max(1, int(round(1. / scale)))
+    return max(stride, int(math.ceil(float(max(shape)) / max_size)))
+
+
+def decimate(data, max_size):
+    """Return strided view of a 2D array fitting max_size x max_size."""
+
+    stride = max(1, int(math.ceil(float(max(data.shape)) / max_size)))
+    return data[::stride, ::stride]
+
+
+def get_browse_dataset(h5f, dset_name):
+    """Return the tile layout sibling of a time series dataset if there is
+       one (see rechunk_ts()) as single epochs are read from it."""
+
+    return h5f.get(dset_name + TILE_SUFFIX, h5f[dset_name])
+
+
+def get_velocity(dset, dates, stride, block_bytes=VELOCITY_BLOCK_BYTES):
+    """Return least squares velocity (per year) of every stride-th pixel of
+       a (epoch, line, pixel) time series dataset, reading blocks of whole
+       chunk rows of about block_bytes. NaNs are ignored per pixel."""
+
+    count, length, width = dset.shape
+    years = (np.asarray(dates, dtype=np.float64) - dates[0]) / 365.25
+    out_length, out_width = len(range(0, length, stride)), len(range(0, width, stride))
+    chunk_rows = dset.chunks[1] if dset.chunks else 1
+    rows = max(int(math.ceil(float(chunk_rows) / stride)),
+               int(block_bytes // max(1, count * out_width * 4)), 1)
+    velocity = np.full((out_length, out_width), np.nan, dtype=np.float32)
+    for j0 in range(0, out_length, rows):
+        j1 = min(out_length, j0 + rows)
+        block = dset[:, j0*stride:j1*stride:stride, ::stride].astype(np.float64)
+        valid = ~np.isnan(block)
+        t = np.where(valid, years[:, None, None], 0.)
+        d = np.where(valid, block, 0.)
+        n = valid.sum(axis=0)
+        st, sd = t.sum(axis=0), d.sum(axis=0)
+        den = n * (t * t).sum(axis=0) - st * st
+        num = n * (t * d).sum(axis=0) - st * sd
+        with np.errstate(divide='ignore', invalid='ignore'):
+            velocity[j0:j1] = np.where((n >= 2) & (den > 0.), num / den, np.nan)
+    return velocity
+
+
+def save_browse(data, png_file, small_png_file=None, small_size=250,
+                cmap=BROWSE_CMAP, percentile=BROWSE_PERCENTILE):
+    """Write data as a colormapped PNG (no data transparent) and optionally
+       a thumbnail fitting small_size x small_size. The color scale is
+       symmetric about 0 and clipped at the percentile of |data|."""
+
+    plt = get_pyplot()
+    valid = np.abs(data[~np.isnan(data)])
+    vmax = float(np.percentile(valid, percentile)) if valid.size else 1.
+    if vmax == 0.: vmax = 1.
+    plt.imsave(png_file, data, cmap=cmap, vmin=-vmax, vmax=vmax)
+    if small_png_file is not None:
+        plt.imsave(small_png_file, decimate(data, small_size), cmap=cmap,
+                   vmin=-vmax, vmax=vmax)
+
+
+def render_ts_browse(h5_file, out_dir=".", dset_name="rawts", index=1, scale=.5,
+                     max_size=BROWSE_MAX_SIZE, small_size=250, last=False,
+                     velocity=False):
+    """Render browse.png and browse_small.png of epoch index of a time series
+       file from strided reads, scaled by scale (at most max_size pixels
+       wide/long). If last, also render browse_last(_small).png of the last
+       epoch and if velocity, browse_velocity(_small).png of the velocity
+       (per year). Memory is bounded by the output size. Returns the files
+       written."""
+
+    import h5py
+
+    files = []
+    with h5py.File(h5_file, 'r') as h5f:
+        dset = get_browse_dataset(h5f, dset_name)
+        count = dset.shape[0]
+        stride = get_stride(dset.shape[1:], scale, max_size)
+        epochs = [("browse", index)]
+        if last: epochs.append(("browse_last", count - 1))
+        for prefix, i in epochs:
+            if i >= count: i = count - 1
+            data = dset[i, ::stride, ::stride].astype(np.float32)
+            files.extend([os.path.join(out_dir, "{}.png".format(prefix)),
+                          os.path.join(out_dir, "{}_small.png".format(prefix))])
+            save_browse(data, files[-2], files[-1], small_size)
+        if velocity:
+            data = get_velocity(h5f[dset_name], h5f["dates"][:], stride)
+            files.extend([os.path.join(out_dir, "browse_velocity.png"),
+                          os.path.join(out_dir, "browse_velocity_small.png")])
+            save_browse(data, files[-2], files[-1], small_size)
+    return files
+
+
+def get_segment_path(x0, y0, x1, y1):
+    """Return x, y of segments (x0, y0)-(x1, y1) joined into one path with
+       NaN breaks, so any number of segments is drawn by a single artist."""
+
+    x = np.column_stack([x0, x1, np.full(len(x0), np.nan)]).ravel()
+    y = np.column_stack([y0, y1, np.full(len(y0), np.nan)]).ravel()
+    return x, y
+
+
+def plot_components(axis, x0, y0, x1, y1, pair_labels, **kwargs):
+    """Draw segments with one artist per connected component (in one color
+       if the network is connected, else a color per component) and return
+       the number of components."""
+
+    count = int(pair_labels.max()) + 1 if len(pair_labels) else 0
+    for label in range(count):
+        sel = pair_labels == label
+        color = "C0" if count == 1 else "C{}".format(label % 10)
+        axis.plot(*get_segment_path(x0[sel], y0[sel], x1[sel], y1[sel]),
+                  color=color, **kwargs)
+    return count
+
+
 def plot_stack(ifg_dates, plt_file):
-    "Plot stack."""
+    """Plot stack: a horizontal segment per (master, slave) date pair. All
+       segments are drawn as one path per connected component of the network
+       (colored if it is not connected), so render time stays flat with the
+       number of pairs."""
 
+    from matplotlib.dates import date2num
+
+    from .network import get_components
+
+    plt = get_pyplot()
     fig1, axis = plt.subplots()
-    masters = []
-    slaves = []
-    for index, ifg in enumerate(ifg_dates):
-        master_dt, slave_dt = ifg
-        axis.plot([master_dt, slave_dt], [index, index])
-        masters.append(master_dt)
-        slaves.append(slave_dt)
-    axis.scatter(masters, range(0, len(masters)), marker="o", label="Master")
-    axis.scatter(slaves, range(0, len(slaves)), marker="+", label="Slave")
-    plt.title("Network Pair Coverage By Time")
+    masters = date2num([i[0] for i in ifg_dates])
+    slaves = date2num([i[1] for i in ifg_dates])
+    index = np.arange(len(ifg_dates), dtype=np.float64)
+    _, _, pair_labels = get_components(ifg_dates)
+    count = plot_components(axis, masters, index, slaves, index, pair_labels, lw=1.)
+    axis.plot(masters, index, "o", linestyle="none", color="C1", label="Master")
+    axis.plot(slaves, index, "+", linestyle="none", color="C2", label="Slave")
+    axis.xaxis_date()
+    plt.title("Network Pair Coverage By Time" +
+              (" ({} disconnected components)".format(count) if count > 1 else ""))
     axis.set_xlabel('Time')
     axis.set_ylabel('Pairings Sorted By Start Time')
     plt.legend()
     fig1.savefig(plt_file)
+    plt.close(fig1)
+
+
+def plot_network(ifg_dates, bperps, plt_file):
+    """Plot the ifg network as perpendicular baseline vs. time: epochs at
+       their baseline (least squares from the pair baselines, relative to
+       the first epoch of their component) joined by a segment per pair,
+       drawn as one path per connected component (colored if the network is
+       not connected)."""
+
+    from matplotlib.dates import date2num
+
+    from .network import get_epochs, get_components, get_epoch_baselines
+
+    plt = get_pyplot()
+    fig1, axis = plt.subplots()
+    epochs, edges = get_epochs(ifg_dates)
+    _, epoch_labels, pair_labels = get_components(ifg_dates)
+    baselines = get_epoch_baselines(ifg_dates, bperps)
+    x = date2num(epochs)
+    count = plot_components(axis, x[edges[:, 0]], baselines[edges[:, 0]],
+                            x[edges[:, 1]], baselines[edges[:, 1]], pair_labels,
+                            lw=.5, alpha=.6)
+    for label in range(count):
+        sel = epoch_labels == label
+        axis.plot(x[sel], baselines[sel], "o", linestyle="none", ms=3,
+                  color="C0" if count == 1 else "C{}".format(label % 10))
+    axis.xaxis_date()
+    plt.title("Network Baseline By Time ({} epochs, {} pairs{})".format(
+              len(epochs), len(ifg_dates),
+              ", {} disconnected components".format(count) if count > 1 else ""))
+    axis.set_xlabel('Time')
+    axis.set_ylabel('Perpendicular Baseline (m)')
+    fig1.savefig(plt_file)
+    plt.close(fig1)
+
+
+def plot_sweep(sweep, plt_file):
+    """Plot heatmap of filtered stack size per coherence/coverage threshold.
+       Combinations whose network is not temporally connected are hatched."""
+
+    cohths = sorted(set([i['cohth'] for i in sweep]))
+    covths = sorted(set([i['covth'] for i in sweep]))
+    counts = np.zeros((len(cohths), len(covths)))
+    plt = get_pyplot()
+    from matplotlib.patches import Rectangle
+    fig1, axis = plt.subplots()
+    for row in sweep:
+        counts[cohths.index(row['cohth']), covths.index(row['covth'])] = row['ifg_count']
+    img = axis.imshow(counts, origin="lower", aspect="auto", cmap="viridis")
+    for row in sweep:
+        i, j = cohths.index(row['cohth']), covths.index(row['covth'])
+        axis.text(j, i, "{}".format(row['ifg_count']), ha="center", va="center",
+                  color="w", fontsize=8)
+        if not row['connected']:
+            axis.add_patch(Rectangle((j-.5, i-.5), 1, 1, fill=False, hatch="//",
+                                   edgecolor="r", lw=0))
+    axis.set_xticks(range(len(covths)))
+    axis.set_xticklabels(["{:g}".format(i) for i in covths])
+    axis.set_yticks(range(len(cohths)))
+    axis.set_yticklabels(["{:g}".format(i) for i in cohths])
+    fig1.colorbar(img, ax=axis, label="IFG count")
+    plt.title("Filtered IFG Count By Threshold (hatched: temporal gaps)")
+    axis.set_xlabel('Coverage Threshold')
+    axis.set_ylabel('Coherence Threshold')
+    fig1.savefig(plt_file)
+    plt.close(fig1)
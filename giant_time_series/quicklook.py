@@ -0,0 +1,129 @@
+import os
+import logging
+import multiprocessing
+import numpy as np
+
+from .utils import get_gdal, get_cpu_count
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# upper bound on the number of frames of a browse animation; larger stacks
+# are sampled evenly in time
+MAX_FRAMES = 100
+
+# upper bound on the width/length of a quicklook
+FRAME_SIZE = 400
+
+# display time of each frame (ms)
+FRAME_DURATION = 1000
+
+# cyclic colormap of the rewrapped unwrapped phase
+PHASE_CMAP = "hsv"
+
+
+def select_frames(count, max_frames=MAX_FRAMES):
+    """Return indices of at most max_frames items of count, evenly spaced and
+       including the first and last."""
+
+    if count <= max_frames: return list(range(count))
+    return sorted(set(np.linspace(0, count - 1, max_frames).round().astype(int).tolist()))
+
+
+def read_decimated(vrt_file, band=1, max_size=FRAME_SIZE):
+    """Return a band of a raster read at most max_size pixels wide/long
+       (GDAL reads from overviews when present), with no data as NaN."""
+
+    ds = get_gdal().Open(vrt_file)
+    rb = ds.GetRasterBand(band)
+    scale = min(1., float(max_size) / max(ds.RasterXSize, ds.RasterYSize))
+    buf_xsize = max(1, int(round(ds.RasterXSize * scale)))
+    buf_ysize = max(1, int(round(ds.RasterYSize * scale)))
+    data = rb.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize,
+                          buf_xsize=buf_xsize, buf_ysize=buf_ysize).astype(np.float32)
+    no_data = rb.GetNoDataValue()
+    if no_data is not None: data[data == no_data] = np.nan
+    return data
+
+
+def render_phase(phase, cmap=PHASE_CMAP):
+    """Return RGB uint8 image of phase rewrapped to [0, 2pi) with a cyclic
+       colormap; no data is black."""
+
+    import matplotlib
+    if hasattr(matplotlib, "colormaps"): colormap = matplotlib.colormaps[cmap]
+    else: colormap = matplotlib.cm.get_cmap(cmap)
+    valid = ~np.isnan(phase)
+    wrapped = np.mod(np.where(valid, phase, 0.), 2. * np.pi) / (2. * np.pi)
+    rgb = (colormap(wrapped)[..., :3] * 255.).astype(np.uint8)
+    rgb[~valid] = 0
+    return rgb
+
+
+def render_quicklook(vrt_file, label=None, band=1, max_size=FRAME_SIZE):
+    """Return RGB uint8 quicklook of the unwrapped phase of an aligned raster,
+       optionally labeled (e.g. with the date pair)."""
+
+    rgb = render_phase(read_decimated(vrt_file, band, max_size))
+    if label:
+        from PIL import Image, ImageDraw
+        img = Image.fromarray(rgb)
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([0, 0, 7 * len(label) + 4, 14], fill=(0, 0, 0))
+        draw.text((2, 2), label, fill=(255, 255, 255))
+        rgb = np.asarray(img)
+    return rgb
+
+
+def _render_quicklook(args):
+    return render_quicklook(*args)
+
+
+def get_quicklooks(ifg_info, max_frames=MAX_FRAMES, max_size=FRAME_SIZE, nproc=None):
+    """Return (date ID, RGB quicklook) of at most max_frames ifgs of ifg_info
+       (as returned by filter_ifgs()) rendered from their aligned rasters
+       by nproc worker processes."""
+
+    dt_ids = sorted(ifg_info)
+    dt_ids = [dt_ids[i] for i in select_frames(len(dt_ids), max_frames)]
+    tasks = [(ifg_info[i]['unw_vrt_out'], i, 1, max_size) for i in dt_ids]
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, min(nproc, len(tasks)))
+    if nproc == 1: return list(zip(dt_ids, [_render_quicklook(i) for i in tasks]))
+    pool = multiprocessing.Pool(nproc)
+    try: return list(zip(dt_ids, pool.map(_render_quicklook, tasks)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_animation(frames, out_file, duration=FRAME_DURATION, loop=0):
+    """Write RGB uint8 frames as an animated GIF or, if out_file ends with
+       .png, APNG. Frames are resized to the size of the first."""
+
+    from PIL import Image
+
+    if len(frames) == 0:
+        raise RuntimeError("No frames to write to {}".format(out_file))
+    imgs = [Image.fromarray(i) for i in frames]
+    imgs = [imgs[0]] + [i if i.size == imgs[0].size else i.resize(imgs[0].size)
+                        for i in imgs[1:]]
+    imgs[0].save(out_file, save_all=True, append_images=imgs[1:], duration=duration,
+                 loop=loop)
+
+
+def write_browse_animation(ifg_info, out_file, max_frames=MAX_FRAMES, max_size=FRAME_SIZE,
+                           duration=FRAME_DURATION, nproc=None):
+    """Write the browse animation (GIF or APNG) of a filtered stack from
+       quicklooks of its aligned unwrapped phase rasters. Its cost scales with
+       max_frames and max_size, not with the stack size and resolution.
+       Returns the number of frames."""
+
+    quicklooks = get_quicklooks(ifg_info, max_frames, max_size, nproc)
+    write_animation([i[1] for i in quicklooks], out_file, duration)
+    logger.info("Wrote {} frames of {} ifgs to {}".format(len(quicklooks), len(ifg_info),
+                                                          out_file))
+    return len(quicklooks)
@@ -0,0 +1,271 @@
+import os
+import zlib
+import shutil
+import logging
+import numpy as np
+from subprocess import check_call
+from multiprocessing.pool import ThreadPool
+
+from .utils import TDS_DATASETS, get_cpu_count, create_tds_coords, attach_tds_scales
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# chunk layouts:
+#   pixel - all epochs of a small block of pixels per chunk (point histories)
+#   tile  - a large block of pixels of a single epoch per chunk (maps)
+#   both  - pixel layout plus a tile layout sibling dataset <name>_tiles
+LAYOUTS = ('pixel', 'tile', 'both')
+
+# chunk layouts of the 3D stack datasets written by compress_h5():
+#   row   - whole rows of a single interferogram per chunk, matching GIAnT's
+#           line by line reads of RAW-STACK.h5 and PROC-STACK.h5
+STACK_LAYOUTS = ('row', 'pixel', 'tile')
+
+# target uncompressed chunk size; HDF5's default chunk cache is 1 MiB so
+# larger chunks would be re-read and re-decompressed on every access
+CHUNK_BYTES = 1024 * 1024
+
+# suffix of the tile layout sibling datasets
+TILE_SUFFIX = "_tiles"
+
+# HDF5 product formats:
+#   chunked - compressed per chunk inside the file (.h5), readable in place (opt-in)
+#   gzip    - whole file compressed with pigz (.h5.gz), the legacy format and default
+H5_FORMATS = ('chunked', 'gzip')
+
+# per chunk compression filters (None disables compression)
+COMPRESSIONS = ('gzip', 'lzf', None)
+
+# coordinate datasets recreated in the rechunked file
+COORDS = ("time", "lat", "lon")
+
+
+def get_chunk_shape(shape, itemsize, layout, chunk_bytes=CHUNK_BYTES):
+    """Return chunk shape of a (epoch, line, pixel) dataset for the row,
+       pixel or tile layout."""
+
+    count, length, width = shape
+    if layout == 'row':
+        return (1, min(length, max(1, chunk_bytes // (width * itemsize))), width)
+    elif layout == 'pixel':
+        epochs = min(count, max(1, chunk_bytes // itemsize))
+        pixels = max(1, chunk_bytes // (epochs * itemsize))
+    elif layout == 'tile':
+        epochs = 1
+        pixels = max(1, chunk_bytes // itemsize)
+    else: raise RuntimeError("Unknown chunk layout: {}".format(layout))
+    side = max(1, int(np.sqrt(pixels)))
+    return (epochs, min(length, side), min(width, side))
+
+
+def shuffle_bytes(data):
+    """Return bytes of an array reordered as the HDF5 shuffle filter does:
+       all first bytes of the elements, then all second bytes, etc."""
+
+    itemsize = data.dtype.itemsize
+    raw = np.ascontiguousarray(data).view(np.uint8)
+    if itemsize == 1: return raw.tobytes()
+    return raw.reshape(-1, itemsize).T.tobytes()
+
+
+def encode_chunk(data, shuffle=True, level=4):
+    """Return the stored bytes of a chunk after the shuffle and deflate
+       filters (level None disables compression)."""
+
+    raw = shuffle_bytes(data) if shuffle else np.ascontiguousarray(data).tobytes()
+    if level is None: return raw
+    return zlib.compress(raw, level)
+
+
+def _encode_chunk(args):
+    offset, data, shuffle, level = args
+    return offset, encode_chunk(data, shuffle, level)
+
+
+def iter_chunks(src, chunks, block_bytes):
+    """Yield (offset, data) of the chunks of src on a chunks grid, reading
+       blocks of whole chunks of about block_bytes. Edge chunks are padded to
+       the full chunk shape as HDF5 stores them."""
+
+    shape = src.shape
+    chunk_bytes = int(np.prod(chunks)) * src.dtype.itemsize
+    # number of chunks per block along the last axis
+    per_block = max(1, int(block_bytes // chunk_bytes))
+    for t0 in range(0, shape[0], chunks[0]):
+        for r0 in range(0, shape[1], chunks[1]):
+            for c0 in range(0, shape[2], chunks[2] * per_block):
+                block = src[t0:t0+chunks[0], r0:r0+chunks[1], c0:c0+chunks[2]*per_block]
+                for i in range(0, block.shape[2], chunks[2]):
+                    data = block[:, :, i:i+chunks[2]]
+                    if data.shape != tuple(chunks):
+                        pad = [(0, c - s) for c, s in zip(chunks, data.shape)]
+                        data = np.pad(data, pad, mode='constant')
+                    yield (t0, r0, c0 + i), data
+
+
+def get_filters(compression='gzip', level=4, shuffle=True):
+    """Return h5py create_dataset() filter arguments. gzip (deflate) is the
+       filter THREDDS and GDAL read; lzf is faster but h5py only."""
+
+    if compression not in COMPRESSIONS:
+        raise RuntimeError("Unknown compression: {}".format(compression))
+    filters = {'shuffle': shuffle}
+    if compression is not None: filters['compression'] = compression
+    if compression == 'gzip': filters['compression_opts'] = level
+    return filters
+
+
+def rechunk_dataset(src, dst, pool, block_bytes=4*CHUNK_BYTES):
+    """Copy src into the chunked dataset dst. Unless dst uses a filter other
+       than shuffle and deflate, its chunks are compressed in the pool and
+       written directly (bypassing HDF5's serial filter pipeline). About
+       block_bytes of chunks are read and compressed at a time."""
+
+    chunks = dst.chunks
+    if dst.compression not in (None, 'gzip') or dst.fletcher32 or dst.scaleoffset is not None:
+        for offset, data in iter_chunks(src, chunks, block_bytes):
+            sel = tuple([slice(o, min(o + c, n)) for o, c, n in zip(offset, chunks, dst.shape)])
+            dst[sel] = data[tuple([slice(0, i.stop - i.start) for i in sel])]
+        return
+
+    shuffle = dst.shuffle
+    level = dst.compression_opts if dst.compression == 'gzip' else None
+    tasks = []
+
+    def flush():
+        for offset, chunk in pool.imap(_encode_chunk, tasks):
+            dst.id.write_direct_chunk(offset, chunk)
+        del tasks[:]
+
+    for offset, data in iter_chunks(src, chunks, block_bytes):
+        tasks.append((offset, data, shuffle, level))
+        if len(tasks) * data.nbytes >= block_bytes: flush()
+    flush()
+
+
+def copy_attrs(src, dst):
+    """Copy attributes except dimension scale bookkeeping, whose object
+       references would point into the source file."""
+
+    for key, value in src.attrs.items():
+        if key not in ('DIMENSION_LIST', 'REFERENCE_LIST', 'CLASS', 'NAME'):
+            # keep the stored type (e.g. fixed length strings)
+            dst.attrs.create(key, value, dtype=src.attrs.get_id(key).dtype)
+
+
+def rechunk_ts(h5_file, lats=None, lons=None, layout='pixel', out_file=None,
+               names=TDS_DATASETS, chunk_bytes=CHUNK_BYTES, compression='gzip', level=4,
+               shuffle=True, nproc=None):
+    """Rewrite the time series datasets of a GIAnT LS-PARAMS.h5/NSBAS-PARAMS.h5
+       with a time series optimized chunk layout (see LAYOUTS), shuffle and
+       compression (see get_filters()), and the lat/lon/time coordinates and CF
+       attributes prep_tds() adds, in one pass. lats and lons default to
+       the ones in h5_file. Other objects are copied as is. Chunks are
+       deflated by nproc threads (zlib releases the GIL). Writes out_file
+       or replaces h5_file. Returns the chunk shapes."""
+
+    import h5py
+
+    if layout not in LAYOUTS:
+        raise RuntimeError("Unknown chunk layout: {}".format(layout))
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, nproc)
+    filters = get_filters(compression, level, shuffle)
+    tmp_file = "{}.rechunk".format(out_file or h5_file)
+    chunk_shapes = {}
+    pool = ThreadPool(nproc)
+    try:
+        with h5py.File(h5_file, 'r') as src, h5py.File(tmp_file, 'w') as dst:
+            copy_attrs(src, dst)
+            dst.attrs["Conventions"] = np.bytes_("CF-1.6")
+            for name in src:
+                if name in names or name in COORDS: continue
+                src.copy(src[name], dst, name=name)
+            if lats is None: lats = src["lat"][:]
+            if lons is None: lons = src["lon"][:]
+            time, lat, lon = create_tds_coords(dst, np.asarray(lats), np.asarray(lons))
+            for name in names:
+                if name not in src: continue
+                sdset = src[name]
+                layouts = ('pixel', 'tile') if layout == 'both' else (layout,)
+                for lay in layouts:
+                    dname = name + TILE_SUFFIX if layout == 'both' and lay == 'tile' else name
+                    chunks = get_chunk_shape(sdset.shape, sdset.dtype.itemsize, lay, chunk_bytes)
+                    ddset = dst.create_dataset(dname, sdset.shape, sdset.dtype, chunks=chunks,
+                                               **filters)
+                    copy_attrs(sdset, ddset)
+                    rechunk_dataset(sdset, ddset, pool, 4*nproc*chunk_bytes)
+                    attach_tds_scales(ddset, time, lat, lon)
+                    chunk_shapes[dname] = chunks
+                    logger.info("Rechunked {} to {} chunks {}".format(dname, lay, chunks))
+        os.rename(tmp_file, out_file or h5_file)
+    finally:
+        pool.close()
+        pool.join()
+        if os.path.exists(tmp_file): os.unlink(tmp_file)
+    return chunk_shapes
+
+
+def compress_h5(h5_file, out_file=None, layout='row', chunk_bytes=CHUNK_BYTES,
+                compression='gzip', level=4, shuffle=True, nproc=None):
+    """Rewrite all datasets of an HDF5 file (e.g. GIAnT's RAW-STACK.h5 and
+       PROC-STACK.h5) chunked and compressed per chunk so readers can read
+       them in place and partially instead of decompressing a whole file
+       compressed with gzip/pigz. 3D (e.g. interferogram, line, pixel)
+       datasets get the layout (see STACK_LAYOUTS) chunk shape and are
+       compressed by nproc threads; other datasets are chunked by h5py.
+       Groups and attributes are kept. Writes out_file or replaces h5_file."""
+
+    import h5py
+
+    if layout not in STACK_LAYOUTS:
+        raise RuntimeError("Unknown stack chunk layout: {}".format(layout))
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, nproc)
+    filters = get_filters(compression, level, shuffle)
+    tmp_file = "{}.rechunk".format(out_file or h5_file)
+    pool = ThreadPool(nproc)
+
+    def copy(sgroup, dgroup):
+        copy_attrs(sgroup, dgroup)
+        for name, obj in sgroup.items():
+            if isinstance(obj, h5py.Group):
+                copy(obj, dgroup.create_group(name))
+            elif obj.ndim == 3 and obj.dtype.kind in 'biuf' and obj.size > 0:
+                chunks = get_chunk_shape(obj.shape, obj.dtype.itemsize, layout, chunk_bytes)
+                dset = dgroup.create_dataset(name, obj.shape, obj.dtype, chunks=chunks, **filters)
+                copy_attrs(obj, dset)
+                rechunk_dataset(obj, dset, pool, 4*nproc*chunk_bytes)
+            elif obj.shape and obj.size > 0 and obj.dtype.kind in 'biuf':
+                dset = dgroup.create_dataset(name, data=obj[...], chunks=True, **filters)
+                copy_attrs(obj, dset)
+            else: sgroup.copy(obj, dgroup, name=name)
+
+    try:
+        with h5py.File(h5_file, 'r') as src, h5py.File(tmp_file, 'w') as dst:
+            copy(src, dst)
+        os.rename(tmp_file, out_file or h5_file)
+    finally:
+        pool.close()
+        pool.join()
+        if os.path.exists(tmp_file): os.unlink(tmp_file)
+
+
+def store_h5(h5_file, prod_dir, h5_format='gzip', **kwargs):
+    """Move an HDF5 file into prod_dir in h5_format (see H5_FORMATS); kwargs
+       are passed to compress_h5(). Returns the product file path."""
+
+    if h5_format not in H5_FORMATS:
+        raise RuntimeError("Unknown HDF5 format: {}".format(h5_format))
+    prod_file = os.path.join(prod_dir, os.path.basename(h5_file))
+    if h5_format == 'chunked':
+        compress_h5(h5_file, prod_file, **kwargs)
+        if os.path.abspath(h5_file) != os.path.abspath(prod_file): os.unlink(h5_file)
+        return prod_file
+    shutil.move(h5_file, prod_file)
+    check_call("pigz -f -9 {}".format(prod_file), shell=True)
+    return prod_file + ".gz"
@@ -0,0 +1,273 @@
+import os
+import time
+import logging
+import numpy as np
+from xml.etree import ElementTree
+
+from .screen import get_block_rows
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# inversion engines: GIAnT's SBASInvert.py/NSBASInvert.py (Python 2) or the
+# native Python 3 engines of this package
+ENGINES = ('giant', 'native')
+
+# bytes of ifgs read per block of rows
+BLOCK_BYTES = 64 * 1024 * 1024
+
+# upper bound on the bytes of cached pseudo-inverses; the cache is cleared
+# when it is exceeded
+CACHE_BYTES = 256 * 1024 * 1024
+
+# defaults of the sbas.xml parameters the inversion uses
+SBAS_DEFAULTS = {
+    'nvalid': 1,
+    'filt': 0.,
+}
+
+
+def read_sbas_xml(xml_file):
+    """Return the inversion parameters (nvalid, filt) of a GIAnT sbas.xml,
+       falling back to SBAS_DEFAULTS for missing ones."""
+
+    params = dict(SBAS_DEFAULTS)
+    root = ElementTree.parse(xml_file).getroot()
+    for name, default in SBAS_DEFAULTS.items():
+        for elem in root.iter(name):
+            value = elem.find('value')
+            text = (value if value is not None else elem).text
+            if text is not None and text.strip():
+                params[name] = type(default)(float(text.strip()))
+                break
+    return params
+
+
+def get_design_matrix(jmat, ref=0):
+    """Return the SBAS design matrix of a connectivity matrix (ifg = Jmat . ts):
+       Jmat without the column of the reference epoch (ts[ref] = 0)."""
+
+    jmat = np.asarray(jmat, dtype=np.float64)
+    return np.delete(jmat, ref, axis=1)
+
+
+def get_pinv(design):
+    """Return the pseudo-inverse of a design matrix (the minimum norm least
+       squares solution operator, with the singular value cutoff of
+       numpy.linalg.lstsq)."""
+
+    u, s, vt = np.linalg.svd(design, full_matrices=False)
+    if len(s) == 0: return np.zeros(design.T.shape)
+    cutoff = np.finfo(np.float64).eps * max(design.shape) * s[0]
+    s_inv = np.where(s > cutoff, 1. / np.where(s > 0., s, 1.), 0.)
+    return np.dot(vt.T * s_inv, u.T)
+
+
+def group_pixels(valid):
+    """Group pixels by their valid-ifg pattern. valid is a (ifg, pixel)
+       boolean array. Returns the distinct (pattern, ifg) patterns, the
+       pixel indices sorted by pattern and the number of pixels of each
+       pattern."""
+
+    packed = np.ascontiguousarray(np.packbits(valid.T, axis=1))
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True,
+                                          return_counts=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    return valid[:, first].T, order, counts
+
+
+def invert_pixels(design, data, nvalid=1, cache=None, stats=None):
+    """Invert (ifg, pixel) data for the (epoch - 1, pixel) time series
+       relative to the reference epoch. Pixels are grouped by their pattern
+       of valid (finite) ifgs and the pseudo-inverse of each distinct design
+       matrix is computed once (or taken from cache, a dict keyed by pattern)
+       and applied to every pixel of the group. Pixels with fewer than nvalid
+       valid ifgs are NaN. Returns the time series and the number of valid
+       ifgs per pixel."""
+
+    if cache is None: cache = {}
+    if stats is None: stats = {}
+    valid = np.isfinite(data)
+    ifgcnt = valid.sum(axis=0)
+    ts = np.full((design.shape[1], data.shape[1]), np.nan)
+    patterns, order, counts = group_pixels(valid)
+    start = 0
+    for pattern, count in zip(patterns, counts.tolist()):
+        pixels = order[start:start+count]
+        start += count
+        if pattern.sum() < max(1, nvalid): continue
+        key = np.packbits(pattern).tobytes()
+        pinv = cache.get(key)
+        if pinv is None:
+            pinv = get_pinv(design[pattern])
+            if stats.get('cache_bytes', 0) + pinv.nbytes > CACHE_BYTES:
+                cache.clear()
+                stats['cache_bytes'] = 0
+            cache[key] = pinv
+            stats['cache_bytes'] = stats.get('cache_bytes', 0) + pinv.nbytes
+            stats['factorizations'] = stats.get('factorizations', 0) + 1
+        else: stats['cache_hits'] = stats.get('cache_hits', 0) + 1
+        ts[:, pixels] = np.dot(pinv, data[np.ix_(pattern, pixels)])
+        stats['pixels'] = stats.get('pixels', 0) + count
+    return ts, ifgcnt
+
+
+def get_filter_weights(tims, filt):
+    """Return the (epoch, epoch) Gaussian temporal smoothing weights of
+       width filt (years); identity if filt is not positive."""
+
+    tims = np.asarray(tims, dtype=np.float64)
+    if filt is None or filt <= 0.: return np.eye(len(tims))
+    weights = np.exp(-.5 * ((tims[:, None] - tims[None, :]) / filt) ** 2)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def create_ts_datasets(h5f, names, shape):
+    """Create float32 time series datasets as GIAnT writes them."""
+
+    dsets = []
+    for name, help in names:
+        dset = h5f.create_dataset(name, shape, 'f4')
+        dset.attrs.create("help", np.bytes_(help))
+        dsets.append(dset)
+    return dsets
+
+
+def get_params(xml_file=None, **kwargs):
+    """Return the inversion parameters of xml_file (sbas.xml, or
+       SBAS_DEFAULTS) overridden by the keyword arguments that are not None."""
+
+    params = read_sbas_xml(xml_file) if xml_file else dict(SBAS_DEFAULTS)
+    params.update(dict([(k, v) for k, v in kwargs.items() if v is not None]))
+    return params
+
+
+def read_cmask(src):
+    """Return the common mask of an open processed stack."""
+
+    if 'cmask' in src: return src['cmask'][:]
+    return np.ones(src['figram'].shape[1:], dtype=np.float32)
+
+
+def read_block(src, cmask, r0, r1, c0, c1):
+    """Return the (ifg, pixel) float64 ifgs of the window [r0:r1, c0:c1] of
+       the figram of an open processed stack, with the pixels masked by the
+       common mask cmask (of the window) set to NaN."""
+
+    nifg = src['figram'].shape[0]
+    data = src['figram'][:, r0:r1, c0:c1].reshape(nifg, -1).astype(np.float64)
+    masked = ~(np.isfinite(cmask) & (cmask != 0)).ravel()
+    data[:, masked] = np.nan
+    return data
+
+
+def iter_stack_blocks(src, block_bytes=BLOCK_BYTES):
+    """Yield (first row, end row, (ifg, pixel) float64 ifgs) of blocks of
+       rows of about block_bytes (aligned to chunks) of the figram of an open
+       processed stack, with the pixels masked by cmask set to NaN."""
+
+    figram = src['figram']
+    nifg, length, width = figram.shape
+    cmask = read_cmask(src)
+    rows = get_block_rows(width * nifg, figram.dtype.itemsize, block_bytes)
+    if figram.chunks: rows = max(figram.chunks[1], rows // figram.chunks[1] * figram.chunks[1])
+    for r0 in range(0, length, rows):
+        r1 = min(length, r0 + rows)
+        yield r0, r1, read_block(src, cmask[r0:r1], r0, r1, 0, width)
+
+
+def create_params_file(src, dst):
+    """Copy dates, tims and cmask of an open processed stack into an open
+       time series file and create its ifgcnt dataset."""
+
+    length, width = src['figram'].shape[1:]
+    for name in ('dates', 'tims'): dst.create_dataset(name, data=src[name][:])
+    dst.create_dataset('cmask', data=read_cmask(src))
+    return dst.create_dataset('ifgcnt', (length, width), 'i4')
+
+
+def write_block(dsets, outputs, r0, r1, c0, c1):
+    """Write (..., pixel) outputs of the window [r0:r1, c0:c1] into the
+       (..., line, pixel) datasets of the same names."""
+
+    for name, data in outputs.items():
+        dsets[name][..., r0:r1, c0:c1] = data.reshape(data.shape[:-1] + (r1 - r0, c1 - c0))
+
+
+class SBASInverter(object):
+    """SBAS inversion of blocks of pixels of a processed stack, caching the
+       pseudo-inverse per valid-ifg pattern across blocks."""
+
+    def __init__(self, jmat, tims, ref=0, nvalid=1, filt=0.):
+        self.nsar = jmat.shape[1]
+        self.ref = ref
+        self.nvalid = nvalid
+        self.design = get_design_matrix(jmat, ref)
+        self.weights = get_filter_weights(tims, filt)
+        self.cache = {}
+        self.stats = {'factorizations': 0, 'cache_hits': 0, 'pixels': 0}
+
+    @classmethod
+    def from_stack(cls, src, nvalid=1, filt=0.):
+        """Return inverter of an open processed stack."""
+
+        ref = int(src['masterind'][()]) if 'masterind' in src else 0
+        return cls(src['Jmat'][:], src['tims'][:], ref, nvalid, filt)
+
+    def create(self, src, dst):
+        """Create the LS-PARAMS.h5 datasets in an open file and return the
+           ones written per block."""
+
+        length, width = src['figram'].shape[1:]
+        dsets = {'ifgcnt': create_params_file(src, dst)}
+        dsets['rawts'], dsets['recons'] = create_ts_datasets(
+            dst, (("rawts", "Raw time-series"), ("recons", "Filtered time-series")),
+            (self.nsar, length, width))
+        return dsets
+
+    def invert(self, data):
+        """Return rawts, recons and ifgcnt of (ifg, pixel) data."""
+
+        ts, cnt = invert_pixels(self.design, data, self.nvalid, self.cache, self.stats)
+        ts = np.insert(ts, self.ref, np.where(np.isnan(ts[0]), np.nan, 0.), axis=0)
+        return {'rawts': ts, 'recons': np.dot(self.weights, ts), 'ifgcnt': cnt}
+
+    def pop_stats(self):
+        """Return stats since the last call and reset them."""
+
+        stats = self.stats
+        stats.pop('cache_bytes', None)
+        self.stats = {'factorizations': 0, 'cache_hits': 0, 'pixels': 0,
+                      'cache_bytes': stats.get('cache_bytes', 0)}
+        return stats
+
+
+def invert_sbas(stack_file, out_file, nvalid=None, filt=None, xml_file=None,
+                block_bytes=BLOCK_BYTES):
+    """Invert a GIAnT processed stack (PROC-STACK.h5) for the SBAS time
+       series and write it in the LS-PARAMS.h5 layout of GIAnT's
+       SBASInvert.py: dates, tims, cmask, ifgcnt and float32 (epoch, line,
+       pixel) rawts (least squares) and recons (rawts smoothed in time with
+       a Gaussian of width filt years). nvalid and filt default to the ones
+       of xml_file (sbas.xml). The stack is read in blocks of rows of about
+       block_bytes. Returns stats."""
+
+    import h5py
+
+    params = get_params(xml_file, nvalid=nvalid, filt=filt)
+    t0 = time.time()
+    with h5py.File(stack_file, 'r') as src, h5py.File(out_file, 'w') as dst:
+        width = src['figram'].shape[2]
+        inverter = SBASInverter.from_stack(src, params['nvalid'], params['filt'])
+        dsets = inverter.create(src, dst)
+        for r0, r1, data in iter_stack_blocks(src, block_bytes):
+            write_block(dsets, inverter.invert(data), r0, r1, 0, width)
+    stats = inverter.pop_stats()
+    stats.update({'nvalid': params['nvalid'], 'filt': params['filt'],
+                  'elapsed': time.time() - t0})
+    logger.info("Inverted {} into {}: {}".format(stack_file, out_file, stats))
+    return stats
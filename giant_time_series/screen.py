@@ -0,0 +1,71 @@
+import os
+import logging
+import numpy as np
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# target size in bytes of a single block of raster rows read while screening
+BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def get_block_rows(width, itemsize=4, block_bytes=BLOCK_BYTES):
+    """Return number of raster rows to read per block."""
+
+    return max(1, int(block_bytes // max(1, width * itemsize)))
+
+
+def slice_window(start, stop, size):
+    """Return (offset, count) of the pixels that numpy slicing [start:stop]
+       selects along an axis of the given size."""
+
+    start, stop, _ = slice(start, stop).indices(size)
+    return start, max(0, stop - start)
+
+
+def read_window(band, xlim, ylim):
+    """Read the window band[ylim[0]:ylim[1], xlim[0]:xlim[1]] of a GDAL
+       raster band without reading the rest of the raster. Window limits
+       follow numpy slicing semantics."""
+
+    xoff, xsize = slice_window(xlim[0], xlim[1], band.XSize)
+    yoff, ysize = slice_window(ylim[0], ylim[1], band.YSize)
+    if xsize == 0 or ysize == 0: return np.empty((ysize, xsize))
+    return band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+
+def get_ref_mean(cor_ref, phs_ref, cohth, no_data):
+    """Return mean phase of the reference window pixels that pass the
+       coherence threshold and have data. NaN if there are none."""
+
+    valid = (cor_ref >= cohth) & (phs_ref != no_data)
+    return np.nanmean(phs_ref[valid].astype(np.float64))
+
+
+def get_column_counts(cor_band, phs_band, cohth, no_data, block_rows=None, out=None):
+    """Return the number of valid pixels (coherence above threshold and
+       phase not no data) per raster column, streaming blocks of rows.
+       If cohth is a sequence of thresholds, a (len(cohth), width) array
+       of counts is returned from the same single pass. If out is a pair
+       of (length, width) arrays (e.g. memmaps), the coherence and phase
+       read are also kept in them."""
+
+    width = cor_band.XSize
+    length = cor_band.YSize
+    levels = np.atleast_1d(cohth)
+    if block_rows is None: block_rows = get_block_rows(width)
+    counts = np.zeros((len(levels), width), dtype=np.int64)
+    for yoff in range(0, length, block_rows):
+        rows = min(block_rows, length - yoff)
+        cor = cor_band.ReadAsArray(0, yoff, width, rows)
+        phs = phs_band.ReadAsArray(0, yoff, width, rows)
+        if out is not None:
+            out[0][yoff:yoff+rows] = cor
+            out[1][yoff:yoff+rows] = phs
+        has_data = phs != no_data
+        for i, level in enumerate(levels):
+            counts[i] += ((cor >= level) & has_data).sum(axis=0)
+    return counts if np.ndim(cohth) else counts[0]
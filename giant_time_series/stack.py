@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import multiprocessing
+import numpy as np
+from datetime import datetime
+
+from .utils import GeoGrid, get_gdal, get_cpu_count
+from .screen import BLOCK_BYTES, get_block_rows, read_window, get_ref_mean
+from .network import get_epochs
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# target size in bytes of a (1, line, pixel) chunk of the raw stack
+CHUNK_BYTES = 1024 * 1024
+
+# rasters kept per product in the pixel cache
+PIXEL_KINDS = ('cor', 'unw')
+
+# rasters of the product last opened by this process (see open_ifg())
+_OPENED = {}
+
+
+def get_pixel_files(pixel_dir, product):
+    """Return paths of the cached aligned coherence and unwrapped phase of
+       a product in pixel_dir."""
+
+    base = os.path.basename(os.path.normpath(product))
+    return dict([(k, os.path.join(pixel_dir, "{}.{}.npy".format(base, k))) for k in PIXEL_KINDS])
+
+
+def open_pixel_files(files, shape):
+    """Create the (length, width) float32 memmaps of the pixel cache files of
+       a product and return them in PIXEL_KINDS order."""
+
+    from numpy.lib.format import open_memmap
+
+    return [open_memmap(files[k], mode='w+', dtype=np.float32, shape=tuple(shape))
+            for k in PIXEL_KINDS]
+
+
+def get_phase_scale(wavelength):
+    """Return factor converting unwrapped phase (radians) to range change
+       (mm)."""
+
+    return 1000. * wavelength / (4. * np.pi)
+
+
+def get_connectivity(pairs):
+    """Return the acquisition dates (datetimes) of (first, second) YYYYMMDD
+       date pairs and the (ifg, epoch) connectivity matrix Jmat (+1 at the
+       later, -1 at the earlier epoch of each pair)."""
+
+    epochs, edges = get_epochs(pairs)
+    jmat = np.zeros((len(pairs), len(epochs)), dtype=np.float32)
+    jmat[np.arange(len(pairs)), edges[:, 1]] = 1.
+    jmat[np.arange(len(pairs)), edges[:, 0]] = -1.
+    return [datetime.strptime(i, "%Y%m%d") for i in epochs], jmat
+
+
+def get_chunk_shape(shape, itemsize=4, chunk_bytes=CHUNK_BYTES):
+    """Return (1, rows, width) chunk shape of whole rows of one ifg of a
+       (line, pixel) raster holding about chunk_bytes."""
+
+    length, width = shape
+    return 1, min(length, get_block_rows(width, itemsize, chunk_bytes)), width
+
+
+def open_ifg(info):
+    """Return the (coherence, unwrapped phase) of the aligned ROI of a
+       product, as memmaps of the pixel cache or GDAL datasets of its
+       aligned VRTs, and whether they came from the pixel cache. The last
+       product opened stays open in this process since blocks of the same
+       product are read in sequence."""
+
+    if _OPENED.get('product') != info['product']:
+        _OPENED.clear()
+        files = info.get('pixels')
+        if files and all([os.path.exists(i) for i in files.values()]):
+            rasters = [np.load(files[k], mmap_mode='r') for k in PIXEL_KINDS]
+            cached = True
+        else:
+            gdal = get_gdal()
+            rasters = [gdal.Open(info['cor_vrt_out']), gdal.Open(info['unw_vrt_out'])]
+            cached = False
+        _OPENED.update({'product': info['product'], 'rasters': rasters, 'cached': cached})
+    return _OPENED['rasters'], _OPENED['cached']
+
+
+def read_ifg_window(info, r0, r1):
+    """Return the (coherence, unwrapped phase) rows r0:r1 of the aligned ROI
+       of a product and whether they came from the pixel cache."""
+
+    rasters, cached = open_ifg(info)
+    if cached: return np.array(rasters[0][r0:r1]), np.array(rasters[1][r0:r1]), True
+    return tuple([ds.GetRasterBand(1).ReadAsArray(0, r0, ds.RasterXSize, r1 - r0)
+                  for ds in rasters]) + (False,)
+
+
+def get_ifg_ref_mean(info):
+    """Return the mean phase of the reference window of a product:
+       filter_ifgs() records it in the ifg info, otherwise the window is
+       read."""
+
+    if info.get('phs_ref_mean') is not None: return info['phs_ref_mean']
+    rxlim, rylim = info['rxlim'], info['rylim']
+    rasters, cached = open_ifg(info)
+    if cached: ref = [i[rylim[0]:rylim[1], rxlim[0]:rxlim[1]] for i in rasters]
+    else: ref = [read_window(ds.GetRasterBand(1), rxlim, rylim) for ds in rasters]
+    return get_ref_mean(ref[0], ref[1], info['cohth'], info['no_data'])
+
+
+def mask_ifg(cor, phs, cohth, no_data, ref_mean, scale):
+    """Return float32 phase referenced to ref_mean and scaled by scale with
+       pixels below the coherence threshold or without data set to NaN."""
+
+    valid = (cor >= cohth) & (phs != no_data)
+    data = (phs.astype(np.float64) - ref_mean) * scale
+    data[~valid] = np.nan
+    return data.astype(np.float32)
+
+
+def _read_block(args):
+    """Read and mask rows r0:r1 of the ifg of index."""
+
+    index, info, ref_mean, r0, r1 = args
+    cor, phs, cached = read_ifg_window(info, r0, r1)
+    block = mask_ifg(cor, phs, info['cohth'], info['no_data'], ref_mean,
+                     get_phase_scale(info['wavelength']))
+    return index, r0, r1, block, cached
+
+
+def build_raw_stack(ifg_info, out_file, nproc=None, block_bytes=BLOCK_BYTES,
+                    chunk_bytes=CHUNK_BYTES):
+    """Write the GIAnT raw stack (RAW-STACK.h5 layout of PrepIgramStack.py)
+       of the products selected by filter_ifgs(): float32 (ifg, line, pixel)
+       igram in mm, referenced to the mean of the reference window and NaN
+       where coherence is below the threshold or there is no data, Jmat,
+       per-ifg bperp, dates (ordinals), tims (years since the first date)
+       and cmask (NaN where no ifg has data). Ifgs are in ifg.list order.
+
+       The reference window mean of each ifg is taken from its ifg info
+       (or read once) here. Blocks of rows of about block_bytes are read by
+       nproc worker processes and written by this one into chunks of whole
+       rows of one ifg. Blocks of products whose aligned rasters filter_ifgs() cached
+       (its pixel_dir) are read from the cache instead of the rasters.
+       Returns stats."""
+
+    import h5py
+
+    t0 = time.time()
+    ifg_list = sorted(ifg_info)
+    if len(ifg_list) == 0: raise RuntimeError("No ifgs to stack.")
+    infos = [ifg_info[i] for i in ifg_list]
+    grid = GeoGrid.from_dict(infos[0]['grid'])
+    for info in infos:
+        if GeoGrid.from_dict(info['grid']) != grid:
+            raise RuntimeError("{} is not aligned to {}".format(info['product'], grid))
+    length, width = grid.length, grid.width
+    dates, jmat = get_connectivity([(i['start_dt'], i['stop_dt']) for i in infos])
+    ordinals = np.array([d.toordinal() for d in dates], dtype=np.float64)
+
+    # read blocks of whole chunks of rows
+    chunks = get_chunk_shape((length, width), 4, chunk_bytes)
+    rows = max(chunks[1], get_block_rows(width, 4, block_bytes) // chunks[1] * chunks[1])
+    ref_means = [get_ifg_ref_mean(info) for info in infos]
+    _OPENED.clear() # don't share open rasters with forked workers
+    tasks = [(i, info, ref_means[i], r0, min(length, r0 + rows)) for i, info in enumerate(infos)
+             for r0 in range(0, length, rows)]
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, min(nproc, len(tasks)))
+    logger.info("Stacking {} ifgs of {}x{} pixels in {} blocks using {} worker(s)".format(
+                len(infos), length, width, len(tasks), nproc))
+
+    stats = {'ifgs': len(infos), 'blocks': len(tasks), 'cached_blocks': 0, 'bytes_read': 0}
+    counts = np.zeros((length, width), dtype=np.int32)
+    pool = multiprocessing.Pool(nproc) if nproc > 1 else None
+    try:
+        with h5py.File(out_file, 'w') as h5f:
+            h5f.attrs['help'] = np.bytes_("All the raw data read from individual interferograms "
+                                          "into a single location for fast access.")
+            igram = h5f.create_dataset('igram', (len(infos), length, width), 'f4', chunks=chunks)
+            igram.attrs['help'] = np.bytes_("Unwrapped IFGs (mm) relative to the reference region.")
+            results = pool.imap_unordered(_read_block, tasks) if pool else map(_read_block, tasks)
+            for index, r0, r1, block, cached in results:
+                igram[index, r0:r1, :] = block
+                counts[r0:r1] += np.isfinite(block)
+                if cached: stats['cached_blocks'] += 1
+                else: stats['bytes_read'] += 2 * block.nbytes
+            for name, data, help in (
+                    ('Jmat', jmat, "Connectivity matrix [-1,1,0]"),
+                    ('bperp', np.array([i['bperp'] for i in infos], dtype=np.float64),
+                     "Array of baseline values."),
+                    ('tims', (ordinals - ordinals[0]) / 365.25, "Array of SAR acquisition times."),
+                    ('dates', ordinals, "Ordinal values for SAR acquisition dates."),
+                    ('cmask', np.where(counts > 0, 1., np.nan).astype(np.float32),
+                     "Common mask for pixels.")):
+                dset = h5f.create_dataset(name, data=data)
+                dset.attrs['help'] = np.bytes_(help)
+    finally:
+        _OPENED.clear()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    stats['elapsed'] = time.time() - t0
+    logger.info("Stacked {} ifgs into {}: {} of {} blocks from the pixel cache, {:.1f} MiB read from rasters in {:.2f}s".format(
+                len(infos), out_file, stats['cached_blocks'], stats['blocks'],
+                stats['bytes_read'] / 1024.**2, stats['elapsed']))
+    return stats
@@ -0,0 +1,332 @@
+import os
+import json
+import pickle
+import logging
+import numpy as np
+from datetime import datetime, timedelta
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+VRT_TMPL = """<VRTDataset rasterXSize="{width}" rasterYSize="{length}">
+    <SRS>EPSG:4326</SRS>
+    <GeoTransform>{gt[0]!r}, {gt[1]!r}, {gt[2]!r}, {gt[3]!r}, {gt[4]!r}, {gt[5]!r}</GeoTransform>
+{bands}</VRTDataset>
+"""
+
+
+BAND_TMPL = """    <VRTRasterBand band="{band}" dataType="Float32" subClass="VRTRawRasterBand">
+        <SourceFilename relativeToVRT="1">{filename}</SourceFilename>
+        <ByteOrder>LSB</ByteOrder>
+        <ImageOffset>{image_offset}</ImageOffset>
+        <PixelOffset>4</PixelOffset>
+        <LineOffset>{line_offset}</LineOffset>
+    </VRTRasterBand>
+"""
+
+
+def write_raster(path, bands, gt):
+    """Write float32 bands as an ISCE-style band interleaved by line (BIL)
+       raw raster at path with a GDAL VRT at path + '.vrt'."""
+
+    length, width = bands[0].shape
+    data = np.stack([np.asarray(b, dtype='<f4') for b in bands], axis=1)
+    data.tofile(path)
+    band_xml = "".join([BAND_TMPL.format(band=i+1, filename=os.path.basename(path),
+                                         image_offset=i*width*4,
+                                         line_offset=len(bands)*width*4)
+                        for i in range(len(bands))])
+    with open(path + ".vrt", 'w') as f:
+        f.write(VRT_TMPL.format(width=width, length=length, gt=gt, bands=band_xml))
+
+
+XML_TMPL = """<productmanager_name>
+    <component name="instance">
+        <factorymodule>isceobj.Sensor.TOPS</factorymodule>
+        <factoryname>createTOPSSwathSLCProduct</factoryname>
+        <property name="numberofbursts">
+            <value>{count}</value>
+        </property>
+        <component name="bursts">
+            <factorymodule>iscesys.Component</factorymodule>
+            <factoryname>createTraitSeq</factoryname>
+{bursts}        </component>
+    </component>
+</productmanager_name>
+"""
+
+
+BURST_TMPL = """            <component name="burst{num}">
+                <factorymodule>isceobj.Sensor.TOPS</factorymodule>
+                <factoryname>createBurstSLC</factoryname>
+                <property name="radarwavelength">
+                    <value>{wavelength!r}</value>
+                </property>
+                <property name="sensingmid">
+                    <value>{sensing_mid}</value>
+                </property>
+                <component name="orbit">
+                    <factorymodule>isceobj.Orbit.Orbit</factorymodule>
+                    <factoryname>createOrbit</factoryname>
+                    <component name="state_vectors">
+{state_vectors}                    </component>
+                </component>
+            </component>
+"""
+
+
+SV_TMPL = """                        <component name="statevector{num}">
+                            <property name="position">
+                                <value>[{pos[0]!r}, {pos[1]!r}, {pos[2]!r}]</value>
+                            </property>
+                            <property name="time">
+                                <value>{time}</value>
+                            </property>
+                            <property name="velocity">
+                                <value>[{vel[0]!r}, {vel[1]!r}, {vel[2]!r}]</value>
+                            </property>
+                        </component>
+"""
+
+
+def get_orbit(sensing_mid, lat, lon, direction="ascending", count=11,
+              interval=10., radius=7071000., inclination=98.18):
+    """Return state vectors (time, position, velocity) of a circular orbit
+       passing over lat/lon (degrees) at sensing_mid."""
+
+    gm = 3.986004418e14
+    w = np.sqrt(gm / radius**3)
+    inc = np.radians(inclination)
+    u0 = np.arcsin(np.clip(np.sin(np.radians(lat)) / np.sin(inc), -1., 1.))
+    if direction != "ascending": u0 = np.pi - u0
+    node = np.radians(lon) - np.arctan2(np.sin(u0) * np.cos(inc), np.cos(u0))
+    rot = np.array([[np.cos(node), -np.sin(node), 0.],
+                    [np.sin(node), np.cos(node), 0.],
+                    [0., 0., 1.]])
+    svs = []
+    for i in range(count):
+        dt = (i - count // 2) * interval
+        u = u0 + w * dt
+        pos = radius * np.array([np.cos(u), np.sin(u) * np.cos(inc), np.sin(u) * np.sin(inc)])
+        vel = radius * w * np.array([-np.sin(u), np.cos(u) * np.cos(inc), np.cos(u) * np.sin(inc)])
+        svs.append((sensing_mid + timedelta(seconds=dt),
+                    [float(j) for j in rot.dot(pos)], [float(j) for j in rot.dot(vel)]))
+    return svs
+
+
+def write_ifg_xml(path, wavelength, sensing_mid, state_vectors, burst_count=3):
+    """Write an ISCE-style fine_interferogram.xml with burst_count bursts."""
+
+    sv_xml = "".join([SV_TMPL.format(num=i+1, time=t, pos=pos, vel=vel)
+                      for i, (t, pos, vel) in enumerate(state_vectors)])
+    burst_xml = "".join([BURST_TMPL.format(num=i+1, wavelength=wavelength,
+                                           sensing_mid=sensing_mid + timedelta(seconds=2.75*i),
+                                           state_vectors=sv_xml)
+                         for i in range(burst_count)])
+    with open(path, 'w') as f:
+        f.write(XML_TMPL.format(count=burst_count, bursts=burst_xml))
+
+
+def write_baselines_pickle(path, bperp, mission="S1A", imagingmode="TOPS"):
+    """Write a PICKLE/computeBaselines catalog."""
+
+    catalog = {
+        'baseline': {
+            'IW-2 Bperp at midrange for first common burst': bperp,
+            'IW-2 Bpar at midrange for first common burst': bperp / 3.,
+        },
+        'master': {'sensor': {'mission': mission, 'imagingmode': imagingmode}},
+        'slave': {'sensor': {'mission': mission, 'imagingmode': imagingmode}},
+    }
+    cb_dir = os.path.dirname(path)
+    if not os.path.isdir(cb_dir): os.makedirs(cb_dir)
+    with open(path, 'wb') as f:
+        pickle.dump(catalog, f, protocol=2)
+
+
+def get_scene_id(platform, dt):
+    """Return a Sentinel-1 SLC scene ID sensed at datetime dt."""
+
+    start = dt.strftime("%Y%m%dT%H%M%S")
+    stop = (dt + timedelta(seconds=25)).strftime("%Y%m%dT%H%M%S")
+    return "{}_IW_SLC__1SDV_{}_{}_000000_000000_0000".format(platform, start, stop)
+
+
+def write_product(prod_dir, reference_dt, secondary_dt, track, gt, shape,
+                  merged=True, coherence=.6, noise=.5, nodata_frac=.1,
+                  isce_meta=False, seed=None):
+    """Write a synthetic S1 GUNW/IFG product in prod_dir.
+
+       The reference (later) and secondary (earlier) sensing datetimes set the
+       product dates. gt is the GDAL GeoTransform and shape the (length, width)
+       of the geocoded unwrapped phase and coherence rasters. coherence is
+       the mean coherence, noise the phase noise standard deviation (radians)
+       and nodata_frac the fraction of no data pixels. If isce_meta,
+       fine_interferogram.xml and PICKLE/computeBaselines are also written.
+       Returns prod_dir."""
+
+    rng = np.random.RandomState(seed)
+    length, width = shape
+    data_dir = os.path.join(prod_dir, "merged") if merged else prod_dir
+    if not os.path.isdir(data_dir): os.makedirs(data_dir)
+
+    # coherence and unwrapped phase with a ramp, noise and no data holes
+    cor = np.clip(rng.normal(coherence, .2, shape), 0., 1.).astype(np.float32)
+    yy, xx = np.mgrid[0:length, 0:width]
+    phs = (2. * np.pi * (xx / width + yy / length) +
+           rng.normal(0., noise, shape)).astype(np.float32)
+    nodata = rng.uniform(size=shape) < nodata_frac
+    phs[nodata] = 0.
+    cor[nodata] = 0.
+    amp = np.abs(rng.normal(1., .3, shape)).astype(np.float32)
+    write_raster(os.path.join(data_dir, "filt_topophase.unw.geo"), [amp, phs], gt)
+    write_raster(os.path.join(data_dir, "phsig.cor.geo"), [cor], gt)
+
+    # met.json
+    min_lon, max_lat = gt[0], gt[3]
+    max_lon, min_lat = gt[0] + width * gt[1], gt[3] + length * gt[5]
+    start_dt, stop_dt = sorted([reference_dt, secondary_dt])
+    met = {
+        "reference_scenes": [get_scene_id("S1A", reference_dt)],
+        "secondary_scenes": [get_scene_id("S1B", secondary_dt)],
+        "track_number": track,
+        "orbit_direction": "ascending",
+        "platform": ["Sentinel-1A", "Sentinel-1B"],
+        "sensing_start": start_dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "sensing_stop": (stop_dt + timedelta(seconds=25)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "location": {
+            "type": "Polygon",
+            "coordinates": [[
+                [min_lon, max_lat],
+                [min_lon, min_lat],
+                [max_lon, min_lat],
+                [max_lon, max_lat],
+                [min_lon, max_lat],
+            ]],
+        },
+    }
+    met_file = os.path.join(prod_dir, "{}.met.json".format(os.path.basename(prod_dir)))
+    with open(met_file, 'w') as f:
+        json.dump(met, f, indent=2)
+
+    # ISCE metadata
+    if isce_meta:
+        sensing_mid = reference_dt + timedelta(seconds=12.5)
+        svs = get_orbit(sensing_mid, (min_lat + max_lat) / 2., (min_lon + max_lon) / 2.)
+        write_ifg_xml(os.path.join(prod_dir, "fine_interferogram.xml"), 0.05546576,
+                      sensing_mid, svs)
+        write_baselines_pickle(os.path.join(prod_dir, "PICKLE", "computeBaselines"),
+                               rng.uniform(-150., 150.))
+    return prod_dir
+
+
+def write_stack(stack_dir, count, shape=(500, 500), track=64,
+                gt=(-118.5, .001, 0., 34.5, 0., -.001), overlap=1., dup_rate=0.,
+                coherence=.6, noise=.5, nodata_frac=.1, isce_meta=False, seed=0):
+    """Write count synthetic products pairing consecutive 12-day acquisitions
+       in stack_dir. Returns the list of product directory names.
+
+       Each product footprint is shifted randomly by up to (1 - overlap) of
+       its size from gt in both directions, so overlap=1. stacks identical
+       footprints. A fraction dup_rate of the products are duplicates, i.e.
+       cover the same dates as the previous product. The other arguments
+       are passed to write_product()."""
+
+    rng = np.random.RandomState(seed)
+    layout = np.random.RandomState(seed + 1)
+    length, width = shape
+    t0 = datetime(2017, 1, 1, 1, 50, 30)
+    prods = []
+    epoch = 0
+    for i in range(count):
+        if i == 0 or layout.uniform() >= dup_rate: epoch += 1
+        secondary_dt = t0 + timedelta(days=12*(epoch-1))
+        reference_dt = secondary_dt + timedelta(days=12)
+        prod = "S1-GUNW-MERGED-RM-M1S1-TN{:03d}-{}-{}-synth{:05d}".format(
+               track, reference_dt.strftime("%Y%m%dT%H%M%S"),
+               secondary_dt.strftime("%Y%m%dT%H%M%S"), i)
+        prod_gt = list(gt)
+        if overlap < 1.:
+            shift = (1. - overlap) * layout.uniform(-1., 1., 2)
+            prod_gt[0] += float(shift[0] * width * gt[1])
+            prod_gt[3] += float(shift[1] * length * gt[5])
+        write_product(os.path.join(stack_dir, prod), reference_dt, secondary_dt,
+                      track, tuple(prod_gt), shape, coherence=coherence,
+                      noise=noise, nodata_frac=nodata_frac, isce_meta=isce_meta,
+                      seed=rng.randint(2**31))
+        prods.append(prod)
+    return prods
+
+
+def write_ts_file(path, count, shape=(500, 500), chunks=None, nodata_frac=.1,
+                  seed=0):
+    """Write a synthetic GIAnT time series file (LS-PARAMS.h5/NSBAS-PARAMS.h5
+       layout) at path with count epochs 12 days apart: dates ordinals and
+       float32 (epoch, line, pixel) rawts, recons and error datasets. A
+       fraction nodata_frac of the pixels are NaN. chunks is passed to h5py
+       (default contiguous, as GIAnT writes them). Returns the dates."""
+
+    import h5py
+
+    rng = np.random.RandomState(seed)
+    length, width = shape
+    dates = [datetime(2017, 1, 1) + timedelta(days=12*i) for i in range(count)]
+    t = np.arange(count, dtype=np.float32)[:, None, None] / 30.
+    rate = np.linspace(-10., 10., width, dtype=np.float32)[None, None, :]
+    nodata = rng.uniform(size=shape) < nodata_frac
+    with h5py.File(path, 'w') as h5f:
+        h5f.create_dataset("dates", data=np.array([d.toordinal() for d in dates],
+                                                  dtype=np.float64))
+        for name in ("rawts", "recons", "error"):
+            dset = h5f.create_dataset(name, (count, length, width), 'f4', chunks=chunks)
+            for i in range(count):
+                if name == "error": frame = np.abs(rng.normal(1., .2, shape))
+                else: frame = (t[i] * rate)[0] + rng.normal(0., 1., shape)
+                frame = frame.astype(np.float32)
+                frame[nodata] = np.nan
+                dset[i] = frame
+    return dates
+
+
+def write_stack_file(path, count, shape=(100, 100), span=4, chunks=None, nan_frac=.05,
+                     noise=0., seed=0):
+    """Write a synthetic GIAnT processed stack (PROC-STACK.h5 layout) at path
+       with count epochs 12 days apart and a network pairing each epoch with
+       the next span epochs: dates ordinals, tims (years), Jmat (+1 at the
+       later, -1 at the earlier epoch of each pair), bperp, masterind, cmask
+       and float32 (ifg, line, pixel) figram = Jmat . ts + noise. A fraction
+       nan_frac of the figram values are NaN and the first column is masked.
+       Returns the dates and the (epoch, line, pixel) true time series."""
+
+    import h5py
+
+    rng = np.random.RandomState(seed)
+    length, width = shape
+    dates = [datetime(2017, 1, 1) + timedelta(days=12*i) for i in range(count)]
+    pairs = [(i, j) for i in range(count) for j in range(i + 1, min(count, i + span + 1))]
+    jmat = np.zeros((len(pairs), count), dtype=np.float32)
+    for k, (i, j) in enumerate(pairs):
+        jmat[k, j], jmat[k, i] = 1., -1.
+    rate = rng.uniform(-20., 20., shape).astype(np.float32)
+    ts = np.arange(count, dtype=np.float32)[:, None, None] / 30. * rate[None]
+    ts += rng.normal(0., 2., ts.shape).astype(np.float32)
+    ts -= ts[0]
+    cmask = np.ones(shape, dtype=np.float32)
+    cmask[:, 0] = np.nan
+    with h5py.File(path, 'w') as h5f:
+        ordinals = np.array([d.toordinal() for d in dates], dtype=np.float64)
+        h5f.create_dataset("dates", data=ordinals)
+        h5f.create_dataset("tims", data=(ordinals - ordinals[0]) / 365.25)
+        h5f.create_dataset("Jmat", data=jmat)
+        h5f.create_dataset("bperp", data=rng.normal(0., 50., len(pairs)))
+        h5f.create_dataset("masterind", data=0)
+        h5f.create_dataset("cmask", data=cmask)
+        dset = h5f.create_dataset("figram", (len(pairs), length, width), 'f4', chunks=chunks)
+        for k in range(len(pairs)):
+            frame = np.tensordot(jmat[k], ts, axes=1) + rng.normal(0., noise, shape)
+            frame[rng.uniform(size=shape) < nan_frac] = np.nan
+            dset[k] = frame.astype(np.float32)
+    return dates, ts
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from .cache import get_file_key
+from .sbas import SBASInverter, get_params, read_block, write_block
+from .nsbas import GAMMA, CACHE_ENTRIES, NSBASInverter, init_worker
+from .utils import get_cpu_count
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# inversion methods
+METHODS = ('sbas', 'nsbas')
+
+# upper bound on the bytes of ifgs of a tile; a worker holds about 4 times
+# as much (float64 copy, outputs)
+TILE_BYTES = 64 * 1024 * 1024
+
+# tiles queued per worker
+TILES_PER_WORKER = 2
+
+# times the worker pool is restarted after a worker died
+MAX_RETRIES = 3
+
+# suffix of the restart journal of an output file
+JOURNAL_SUFFIX = ".tiles"
+
+# state of the worker processes, set by init_tile_worker()
+_state = {}
+
+
+def get_tile_shape(shape, nifg, itemsize=4, chunks=None, tile_bytes=TILE_BYTES):
+    """Return (rows, cols) of tiles of a (line, pixel) raster of nifg ifgs
+       holding about tile_bytes: about square, multiples of the (ifg, line,
+       pixel) chunks of the stack if chunked, and at most the raster."""
+
+    length, width = shape
+    chunk_rows, chunk_cols = chunks[1:] if chunks else (1, 1)
+    pixels = max(1, tile_bytes // max(1, nifg * itemsize))
+    cols = min(width, max(chunk_cols, int(np.sqrt(pixels)) // chunk_cols * chunk_cols))
+    rows = min(length, max(chunk_rows, pixels // cols // chunk_rows * chunk_rows))
+    return rows, cols
+
+
+def get_tiles(shape, tile_shape):
+    """Return (first row, end row, first col, end col) of the tiles of a
+       raster."""
+
+    length, width = shape
+    rows, cols = tile_shape
+    return [(r0, min(length, r0 + rows), c0, min(width, c0 + cols))
+            for r0 in range(0, length, rows) for c0 in range(0, width, cols)]
+
+
+def get_inverter(method, src, params):
+    """Return inverter of method for an open processed stack."""
+
+    if method == 'sbas': return SBASInverter.from_stack(src, params['nvalid'], params['filt'])
+    if method == 'nsbas':
+        return NSBASInverter.from_stack(src, params['nvalid'], params['filt'], params['gamma'],
+                                        params['cache_entries'])
+    raise RuntimeError("Unknown inversion method: {}".format(method))
+
+
+def init_tile_worker(stack_file, method, params):
+    """Open the processed stack and set the inversion state of a worker
+       process."""
+
+    import h5py
+
+    src = h5py.File(stack_file, 'r')
+    inverter = get_inverter(method, src, params)
+    if method == 'nsbas': init_worker(*inverter.initargs)
+    _state.update({'src': src, 'inverter': inverter})
+
+
+def invert_tile(tile):
+    """Read the ifgs of a tile from the processed stack and invert them.
+       Returns the tile, its (..., pixel) outputs and the inversion stats."""
+
+    src, inverter = _state['src'], _state['inverter']
+    r0, r1, c0, c1 = tile
+    if 'cmask' in src: cmask = src['cmask'][r0:r1, c0:c1]
+    else: cmask = np.ones((r1 - r0, c1 - c0), dtype=np.float32)
+    outputs = inverter.invert(read_block(src, cmask, r0, r1, c0, c1))
+    outputs = dict([(k, v.astype(np.int32 if k == 'ifgcnt' else np.float32))
+                    for k, v in outputs.items()])
+    return tile, outputs, inverter.pop_stats()
+
+
+def read_journal(journal_file, header):
+    """Return the tiles recorded as done in a restart journal, or None if it
+       does not exist or was written for another stack or parameters."""
+
+    if not os.path.exists(journal_file): return None
+    with open(journal_file) as f:
+        lines = f.readlines()
+    try: recorded = json.loads(lines[0])
+    except (IndexError, ValueError): return None
+    if recorded != json.loads(json.dumps(header)): return None
+    done = set()
+    for line in lines[1:]:
+        # skip a line truncated by a crash while it was written
+        try: done.add(tuple(json.loads(line)['tile']))
+        except (ValueError, KeyError): continue
+    return done
+
+
+def invert_tiled(stack_file, out_file, method='sbas', nproc=None, tile_bytes=TILE_BYTES,
+                 xml_file=None, nvalid=None, filt=None, gamma=GAMMA,
+                 cache_entries=CACHE_ENTRIES, max_retries=MAX_RETRIES, restart=True):
+    """Invert a GIAnT processed stack (PROC-STACK.h5) out of core with the
+       SBAS or NSBAS method into out_file (LS-PARAMS.h5 or NSBAS-PARAMS.h5
+       layout, see invert_sbas() and invert_nsbas()).
+
+       The raster is split into tiles aligned to the HDF5 chunks of figram
+       holding about tile_bytes of ifgs each. nproc worker processes stream
+       and invert the tiles; this process writes the results into the
+       preallocated out_file, so peak memory is bounded by the tile size
+       times the workers. Done tiles are recorded in a journal next to
+       out_file: an interrupted inversion rerun with restart resumes from it,
+       and the pool is restarted (up to max_retries times) if a worker dies.
+       Returns stats."""
+
+    import h5py
+
+    params = get_params(xml_file, nvalid=nvalid, filt=filt)
+    params.update({'gamma': gamma, 'cache_entries': cache_entries})
+    if method not in METHODS:
+        raise RuntimeError("Unknown inversion method: {}".format(method))
+    if nproc is None: nproc = get_cpu_count()
+    nproc = max(1, nproc)
+    t0 = time.time()
+
+    # preallocate the output file unless resuming
+    with h5py.File(stack_file, 'r') as src:
+        figram = src['figram']
+        tile_shape = get_tile_shape(figram.shape[1:], figram.shape[0], figram.dtype.itemsize,
+                                    figram.chunks, tile_bytes)
+        tiles = get_tiles(figram.shape[1:], tile_shape)
+        header = {'stack': get_file_key(stack_file), 'method': method, 'params': params,
+                  'tile_shape': tile_shape}
+        journal_file = out_file + JOURNAL_SUFFIX
+        done = read_journal(journal_file, header) if restart and os.path.exists(out_file) else None
+        if done is None:
+            done = set()
+            with h5py.File(out_file, 'w') as dst: get_inverter(method, src, params).create(src, dst)
+            with open(journal_file, 'w') as f: f.write(json.dumps(header) + "\n")
+    skipped = len(done)
+    logger.info("Inverting {} tiles of {} pixels with {} workers ({} done)".format(
+                len(tiles), tile_shape, nproc, skipped))
+
+    stats = {'tiles': len(tiles), 'tiles_skipped': skipped, 'retries': 0, 'pixels': 0}
+    initargs = (stack_file, method, params)
+    with h5py.File(out_file, 'r+') as dst, open(journal_file, 'a') as journal:
+        def save(tile, outputs, tile_stats):
+            write_block(dst, outputs, *tile)
+            dst.flush()
+            journal.write(json.dumps({'tile': tile}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            done.add(tuple(tile))
+            for k, v in tile_stats.items(): stats[k] = stats.get(k, 0) + v
+
+        if nproc == 1:
+            init_tile_worker(*initargs)
+            try:
+                for tile in tiles:
+                    if tile not in done: save(*invert_tile(tile))
+            finally: _state.pop('src').close()
+        pending = [t for t in tiles if t not in done]
+        while pending:
+            try:
+                with ProcessPoolExecutor(nproc, initializer=init_tile_worker,
+                                         initargs=initargs) as pool:
+                    queued = set()
+                    while pending or queued:
+                        while pending and len(queued) < nproc * TILES_PER_WORKER:
+                            queued.add(pool.submit(invert_tile, pending.pop(0)))
+                        finished, queued = wait(queued, return_when=FIRST_COMPLETED)
+                        for future in finished: save(*future.result())
+            except BrokenProcessPool as e:
+                stats['retries'] += 1
+                if stats['retries'] > max_retries:
+                    raise RuntimeError("Worker pool of {} broke {} times: {}".format(
+                                       stack_file, stats['retries'], str(e)))
+                logger.warning("A worker died; restarting pool ({}/{}): {}".format(
+                               stats['retries'], max_retries, str(e)))
+            pending = [t for t in tiles if t not in done]
+    os.unlink(journal_file)
+
+    stats.update({'method': method, 'nproc': nproc, 'tile_shape': tile_shape,
+                  'elapsed': time.time() - t0})
+    stats['pixels_per_s'] = stats['pixels'] / stats['elapsed'] if stats['elapsed'] > 0. else None
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    if lookups: stats['hit_rate'] = float(stats['hits']) / lookups
+    logger.info("Inverted {} into {}: {}".format(stack_file, out_file, stats))
+    return stats
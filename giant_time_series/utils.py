@@ -1,118 +1,194 @@
 import os
+import math
 import traceback
+import multiprocessing
 import logging
-import h5py
 import json
 import re
-import requests
 import numpy as np
-import scipy.spatial
-from osgeo import gdal, ogr
 from subprocess import check_call
 from datetime import datetime
 
 
-gdal.UseExceptions() # make GDAL raise python exceptions
-
-
 log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
 logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 
+# heavy dependencies (GDAL, h5py, SciPy, requests) are imported on first use
+# to keep the import time of the package and its scripts low
+_GDAL = None
+
+
+def get_gdal():
+    """Return the GDAL module, importing it on first use."""
+
+    global _GDAL
+    if _GDAL is None:
+        from osgeo import gdal
+        gdal.UseExceptions() # make GDAL raise python exceptions
+        _GDAL = gdal
+    return _GDAL
+
+
+class GeoGrid(object):
+    """North-up lat/lon raster grid defined by a GDAL GeoTransform, width
+       and length. Built once per raster (or stack of aligned rasters) and
+       shared instead of reopening datasets; to_dict() gives a cheap
+       serializable form."""
+
+    def __init__(self, gt, width, length):
+        self.gt = tuple([float(i) for i in gt])
+        self.width = int(width)
+        self.length = int(length)
+
+    def __eq__(self, other):
+        return isinstance(other, GeoGrid) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "GeoGrid({!r}, {}, {})".format(self.gt, self.width, self.length)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['gt'], d['width'], d['length'])
+
+    def to_dict(self):
+        return {'gt': self.gt, 'width': self.width, 'length': self.length}
+
+    @classmethod
+    def from_dataset(cls, ds):
+        return cls(ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize)
+
+    @classmethod
+    def from_vrt(cls, vrt_file):
+        """Return grid of a GDAL VRT by parsing its XML. Falls back to opening
+           it with GDAL if the GeoTransform or size are not found."""
+
+        import xml.etree.ElementTree as ET
+        try:
+            root = ET.parse(vrt_file).getroot()
+            gt = [float(i) for i in root.find('GeoTransform').text.split(',')]
+            if len(gt) != 6: raise ValueError("Invalid GeoTransform: {}".format(gt))
+            return cls(gt, int(root.get('rasterXSize')), int(root.get('rasterYSize')))
+        except (ET.ParseError, AttributeError, TypeError, ValueError) as e:
+            logger.info("Opening {} with GDAL: {}".format(vrt_file, str(e)))
+        return cls.from_dataset(get_gdal().Open(vrt_file))
+
+    @property
+    def lats(self):
+        """Latitude of each line."""
+
+        return self.gt[3] + (np.arange(self.length) * self.gt[5])
+
+    @property
+    def lons(self):
+        """Longitude of each pixel."""
+
+        return self.gt[0] + (np.arange(self.width) * self.gt[1])
+
+    def to_geo(self, line, pixel):
+        """Return (lat, lon) of line/pixel coordinates (scalars or arrays)."""
+
+        return (self.gt[3] + (np.asarray(line) * self.gt[5]),
+                self.gt[0] + (np.asarray(pixel) * self.gt[1]))
+
+    def to_pixel(self, lat, lon):
+        """Return (line, pixel) of lat/lon coordinates (scalars or arrays),
+           truncated toward zero like int()."""
+
+        line = np.trunc((np.asarray(lat, dtype=np.float64) - self.gt[3]) / self.gt[5])
+        pixel = np.trunc((np.asarray(lon, dtype=np.float64) - self.gt[0]) / self.gt[1])
+        if line.ndim == 0: return int(line), int(pixel)
+        return line.astype(np.int64), pixel.astype(np.int64)
+
+    def footprint(self, corners=False):
+        """Return (min_lon, max_lon, min_lat, max_lat) of the raster extent.
+           If corners, the footprint spans the upper left corners of the first
+           and last pixels instead (as get_geom())."""
+
+        cols, rows = (self.width - 1, self.length - 1) if corners else (self.width, self.length)
+        lats, lons = self.to_geo([0, rows], [0, cols])
+        return float(lons.min()), float(lons.max()), float(lats.min()), float(lats.max())
+
+    def window(self, min_lat, max_lat, min_lon, max_lon):
+        """Return pixel limits (xlim, ylim) of the intersection of the grid
+           with a lat/lon bbox, clipped to the grid (empty if disjoint)."""
+
+        ys = sorted((np.asarray([max_lat, min_lat]) - self.gt[3]) / self.gt[5])
+        xs = sorted((np.asarray([min_lon, max_lon]) - self.gt[0]) / self.gt[1])
+        # tolerate rounding of bbox edges on pixel edges
+        y0, y1 = int(max(0, np.floor(ys[0] + 1e-6))), int(min(self.length, np.ceil(ys[1] - 1e-6)))
+        x0, x1 = int(max(0, np.floor(xs[0] + 1e-6))), int(min(self.width, np.ceil(xs[1] - 1e-6)))
+        return [x0, max(x0, x1)], [y0, max(y0, y1)]
+
+
 def get_geocoded_coords(vrt_file):
     """Return geocoded coordinates of radar pixels."""
 
-    # extract geo-coded corner coordinates
-    ds = gdal.Open(vrt_file)
-    gt = ds.GetGeoTransform()
-    cols = ds.RasterXSize
-    rows = ds.RasterYSize
-    lon_arr = list(range(0, cols))
-    lat_arr = list(range(0, rows))
-    lons = np.empty((cols,))
-    lats = np.empty((rows,))
-    #logger.info("lon_arr: %s" % lon_arr)
-    #logger.info("lat_arr: %s" % lat_arr)
-    for py in lat_arr:
-        lats[py] = gt[3] + (py * gt[5])
-    for px in lon_arr:
-        lons[px] = gt[0] + (px * gt[1])
-    return lats, lons
+    grid = GeoGrid.from_vrt(vrt_file)
+    return grid.lats, grid.lons
 
 
 def get_geom(vrt_file):
     """Return geocoded coordinates of radar pixels as a GDAL geom."""
 
     # extract geo-coded corner coordinates
-    ds = gdal.Open(vrt_file)
-    gt = ds.GetGeoTransform()
-    cols = ds.RasterXSize
-    rows = ds.RasterYSize
-    lon_arr = [0, cols-1]
-    lat_arr = [0, rows-1]
-    lons = []
-    lats = []
-    #logger.info("lon_arr: %s" % lon_arr)
-    #logger.info("lat_arr: %s" % lat_arr)
-    for py in lat_arr:
-        lats.append(gt[3] + (py * gt[5]))
-    for px in lon_arr:
-        lons.append(gt[0] + (px * gt[1]))
+    min_lon, max_lon, min_lat, max_lat = GeoGrid.from_vrt(vrt_file).footprint(corners=True)
+    from osgeo import ogr
     return ogr.CreateGeometryFromJson(json.dumps({
         'type': 'Polygon',
         'coordinates': [[
-            [ lons[0], lats[0] ],
-            [ lons[0], lats[1] ],
-            [ lons[1], lats[1] ],
-            [ lons[1], lats[0] ],
-            [ lons[0], lats[0] ],
+            [ min_lon, max_lat ],
+            [ min_lon, min_lat ],
+            [ max_lon, min_lat ],
+            [ max_lon, max_lat ],
+            [ min_lon, max_lat ],
         ]]
     }))
 
 
-def get_envelope(product_dirs):
+def get_envelope(product_dirs, nproc=1):
     """Return overlap bbox of all interferograms."""
 
-    # Create a geometry collection
-    geom_col =  ogr.Geometry(ogr.wkbGeometryCollection)
-    for prod in product_dirs:
-        unw_vrt = os.path.join(prod, "merged", "filt_topophase.unw.geo.vrt")
-        geom = get_geom(unw_vrt)
-        geom_col.AddGeometry(geom)
-        #logger.info("-" * 80)
-        #logger.info("{}: {}".format(prod, geom.GetEnvelope()))
-        #logger.info("envelope: {}".format(geom_col.GetEnvelope()))
-    return geom_col.GetEnvelope()
+    from .footprint import FootprintIndex, get_footprints
 
+    # footprints span the corner coordinates of get_geom() but are parsed
+    # from the VRTs without opening them with GDAL
+    unw_vrts = [os.path.join(prod, "merged", "filt_topophase.unw.geo.vrt")
+                for prod in product_dirs]
+    return FootprintIndex(get_footprints(unw_vrts, corners=True, nproc=nproc)).envelope()
 
-def get_bounding_polygon(path):
+
+def get_bounding_polygon(path, mode='hull', max_vertices=None, chunk_rows=None):
     '''
     Get the minimum bounding region
     @param path - path to h5 file from which to read TS data
+    @param mode - 'hull' (convex), 'outline' (concave) or 'multi' (one
+                  outline per contiguous piece of gappy coverage)
+    @param max_vertices - simplify polygons to at most this many vertices
+    @param chunk_rows - number of rows of the first data frame read at a time
+    @return closed ring of [lon, lat] or a list of rings if mode is 'multi'
     '''
-    fle = h5py.File(path, "r")
-    #Read out the first data frame, lats vector and lons vector.
-    data = fle["rawts"][0]
-    lons = fle["lon"]
-    lats = fle["lat"]
-    #Create a grid of lon, lat pairs
-    coords = np.dstack(np.meshgrid(lons,lats))
-    #Calculate any point in the data that is not NaN, and grab the coordinates 
-    inx = ~np.isnan(data)
-    points = coords[inx]
-    #Calculate the convex-hull of the data points.  This will be a mimimum
-    #bounding convex-polygon.
-    hull = scipy.spatial.ConvexHull(points)
-    #Harvest the points and make it a loop
-    pts = [list(pt) for pt in hull.points[hull.vertices]]
-    pts.append(pts[0])
-    return pts
+    import h5py
+    from .footprint import get_row_extents, get_valid_polygons
+
+    with h5py.File(path, "r") as fle:
+        lons = fle["lon"][:]
+        lats = fle["lat"][:]
+        #Stream the first data frame and only keep the leftmost and rightmost
+        #valid pixel of each row. The convex-hull of all valid pixels is the
+        #convex-hull of these O(rows) points.
+        rows, left, right = get_row_extents(fle["rawts"], 0, chunk_rows)
+    if len(rows) == 0:
+        raise RuntimeError("No valid data found in {}".format(path))
+    polygons = get_valid_polygons(lats, lons, rows, left, right, mode, max_vertices)
+    return polygons if mode == 'multi' else polygons[0]
 
 
 def get_timesteps(path):
     """Return timestep dates."""
 
+    import h5py
     h5f = h5py.File(path, 'r')
     times = h5f.get('time')[:]
     h5f.close()
@@ -130,22 +206,26 @@ def get_bperp(catalog):
     raise RuntimeError("Failed to find perpendicular baseline.")
 
 
-def write_dataset_json(prod_dir, id, region, starttime, endtime, version):
+def write_dataset_json(prod_dir, id, region, starttime, endtime, version,
+                       location_type="Polygon"):
     '''
     Write a dataset JSON file for TS
     @param prod_dir: product directory
     @param id: id of product
-    @param region: region to GEO-JSONize
+    @param region: region to GEO-JSONize (a ring or, for MultiPolygon, a list of rings)
     @param starttime: starttime of the data
     @param endtime: endtime of the data
+    @param location_type: GeoJSON type of region, Polygon or MultiPolygon
     '''
+    if location_type == "MultiPolygon": coordinates = [[ring] for ring in region]
+    else: coordinates = [region]
     met = {
         'creation_timestamp': "%sZ" % datetime.utcnow().isoformat(),
         'version': version,
         'label': id,
         'location': {
-            "type": "Polygon",
-            "coordinates": [region]
+            "type": location_type,
+            "coordinates": coordinates
         },
         "starttime":starttime,
         "endtime":endtime
@@ -172,6 +252,44 @@ def gdal_translate(vrt_in, vrt_out, min_lat, max_lat, min_lon, max_lon, no_data,
                                       min_lat, band, vrt_in, vrt_out), shell=True)
 
 
+def align_roi(vrt_in, vrt_out, min_lat, max_lat, min_lon, max_lon, no_data, band):
+    """Project image to a region of interest bbox in-process using the GDAL
+       bindings. Equivalent to gdal_translate() without spawning a process.
+       If vrt_out is None, no file is written and the aligned VRT dataset
+       is returned from memory for direct reads."""
+
+    ds = get_gdal().Translate(vrt_out or '', vrt_in, format='VRT', noData=no_data,
+                        projWin=[min_lon, max_lat, max_lon, min_lat],
+                        bandList=[band])
+    if vrt_out is not None: ds.FlushCache()
+    return ds
+
+
+def get_cpu_count():
+    """Return number of CPUs available to this process, honoring any cgroup
+       CPU quota (e.g. docker --cpus) which cpu_count() does not see."""
+
+    try: count = len(os.sched_getaffinity(0))
+    except AttributeError: count = multiprocessing.cpu_count()
+
+    # cgroup v2 ("<quota> <period>" or "max <period>") then cgroup v1
+    quota = period = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            fields = f.read().split()
+        if fields[0] != "max": quota, period = int(fields[0]), int(fields[1])
+    except (OSError, ValueError, IndexError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+        except (OSError, ValueError): quota = period = None
+    if quota is not None and quota > 0 and period:
+        count = min(count, int(math.ceil(quota/period)))
+    return max(1, count)
+
+
 def check_dataset(es_url, es_index, id):
     """Query for dataset with specified input ID."""
 
@@ -191,6 +309,7 @@ def check_dataset(es_url, es_index, id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
+    import requests
     r = requests.post(search_url, data=json.dumps(query))
     if r.status_code != 200:
         logger.info("Failed to query {}:\n{}".format(es_url, r.text))
@@ -213,11 +332,13 @@ def dataset_exists(es_url, es_index, id):
     return False
 
 
-def prep_tds(lats, lons, h5_file):
-    """Add lat, lon, and time info for TDS compatibility."""
+# time series datasets of LS-PARAMS.h5/NSBAS-PARAMS.h5 served through THREDDS
+TDS_DATASETS = ("rawts", "recons", "error")
 
-    #Open a file for append
-    h5f = h5py.File(h5_file, "r+")
+
+def create_tds_coords(h5f, lats, lons):
+    """Create time (from the dates ordinals), lat and lon coordinate
+       datasets with CF attributes in an open HDF5 file and return them."""
 
     #Calculate times from ordinals
     dates = h5f.get("dates")
@@ -232,27 +353,52 @@ def prep_tds(lats, lons, h5_file):
     lon[:] = lons
 
     #Create new dimension vars
-    dims = {}
-    time.attrs.create("axis", np.string_("T"))
-    time.attrs.create("units", np.string_("seconds since 1970-01-01 00:00:00 +0000"))
-    time.attrs.create("standard_name", np.string_("time"))
-    lat.attrs.create("help", np.string_("Latitude array"))
-    lon.attrs.create("help", np.string_("Longitude array"))
+    time.attrs.create("axis", np.bytes_("T"))
+    time.attrs.create("units", np.bytes_("seconds since 1970-01-01 00:00:00 +0000"))
+    time.attrs.create("standard_name", np.bytes_("time"))
+    time.attrs.create("calendar", np.bytes_("standard"))
+    lat.attrs.create("help", np.bytes_("Latitude array"))
+    lat.attrs.create("axis", np.bytes_("Y"))
+    lat.attrs.create("units", np.bytes_("degrees_north"))
+    lat.attrs.create("standard_name", np.bytes_("latitude"))
+    lon.attrs.create("help", np.bytes_("Longitude array"))
+    lon.attrs.create("axis", np.bytes_("X"))
+    lon.attrs.create("units", np.bytes_("degrees_east"))
+    lon.attrs.create("standard_name", np.bytes_("longitude"))
+
+    #Make them dimension scales
+    for dset, name in ((time, "time"), (lat, "lat"), (lon, "lon")):
+        if hasattr(dset, "make_scale"): dset.make_scale(name)
+    return time, lat, lon
+
+
+def attach_tds_scales(dset, time, lat, lon):
+    """Attach time, lat and lon as dimension scales of a (time, lat, lon)
+       dataset and set its units."""
+
+    for i, (scale, name) in enumerate(((time, "time"), (lat, "lat"), (lon, "lon"))):
+        if not hasattr(scale, "make_scale"): dset.dims.create_scale(scale, name)
+        dset.dims[i].attach_scale(scale)
+
+    # add units attribute
+    dset.attrs.create("units", np.bytes_("mm"))
+
+
+def prep_tds(lats, lons, h5_file):
+    """Add lat, lon, and time info for TDS compatibility."""
+
+    import h5py
+
+    #Open a file for append
+    h5f = h5py.File(h5_file, "r+")
+    time, lat, lon = create_tds_coords(h5f, lats, lons)
 
     #Attach the new time dimension to the rawts and recons as scales
     #In addition, attach lat and lon as scales
-    for dset_name in ["rawts", "recons", "error"]:
+    for dset_name in TDS_DATASETS:
         dset = h5f.get(dset_name)
         if dset is None: continue
-        dset.dims.create_scale(time, "time")
-        dset.dims[0].attach_scale(time)
-        dset.dims.create_scale(lat, "lat")
-        dset.dims[1].attach_scale(lat)
-        dset.dims.create_scale(lon, "lon")
-        dset.dims[2].attach_scale(lon)
-
-        # add units attribute
-        dset.attrs.create("units", np.string_("mm"))
+        attach_tds_scales(dset, time, lat, lon)
 
     #Close file
     h5f.close()
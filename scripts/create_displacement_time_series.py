@@ -15,8 +15,14 @@ import pickle
 import multiprocessing
 from subprocess import check_call
 
-from giant_time_series.utils import (dataset_exists, prep_tds, call_noerr,
+from giant_time_series.utils import (GeoGrid, dataset_exists, get_cpu_count,
 get_bounding_polygon, write_dataset_json)
+from giant_time_series.rechunk import LAYOUTS, H5_FORMATS, rechunk_ts
+from giant_time_series.localize import StackLocalizer
+from giant_time_series.plot import render_ts_browse
+from giant_time_series.sbas import ENGINES
+from giant_time_series.tiling import invert_tiled
+from giant_time_series.partition import crop_stack, set_partition_attrs
 
 import celeryconfig as conf
 
@@ -57,13 +63,49 @@ def main(input_json_file):
         raise RuntimeError("Invalid method:{}".format(method))
     logger.info("Using method {}-inversion to generate displacement time series.".format(method))
 
+    # get inversion engine
+    engine = input_json.get('engine', 'giant')
+    if engine not in ENGINES:
+        raise RuntimeError("Invalid engine:{}".format(engine))
+    logger.info("Using {} inversion engine.".format(engine))
+
+    # get footprint mode and vertex budget of the bounding polygon
+    footprint_mode = input_json.get('footprint_mode', 'hull')
+    if footprint_mode not in ('hull', 'outline', 'multi'):
+        raise RuntimeError("Invalid footprint_mode:{}".format(footprint_mode))
+    footprint_max_vertices = input_json.get('footprint_max_vertices', None)
+    if footprint_max_vertices is not None: footprint_max_vertices = int(footprint_max_vertices)
+
+    # get chunk layout of the time series datasets
+    chunk_layout = input_json.get('chunk_layout', 'pixel')
+    if chunk_layout not in LAYOUTS:
+        raise RuntimeError("Invalid chunk_layout:{}".format(chunk_layout))
+
+    # get optional browse images of the last epoch and velocity
+    browse_last_epoch = input_json.get('browse_last_epoch', False)
+    browse_velocity = input_json.get('browse_velocity', False)
+
+    # get HDF5 product format
+    h5_format = input_json.get('h5_format', 'gzip')
+    if h5_format not in H5_FORMATS:
+        raise RuntimeError("Invalid h5_format:{}".format(h5_format))
+
+    # get spatial partition of a partitioned job (see plan_displacement_partitions.py)
+    partition = input_json.get('partition', None)
+    if partition is not None:
+        logger.info("Inverting partition {index} of {count}: window {window}".format(**partition))
+
     # set method-dependent vars
 
     # get time series prod
     match = ID_RE.search(ifg_stack_dir)
     if not match:
         raise RuntimeError("Failed to recognize filtered ifg stack: {}".format(ifg_stack_dir))
-    id = "displacement-time-series-{}_{}-{}".format(method, match.group(1), DATASET_VERSION)
+    if partition is None:
+        id = "displacement-time-series-{}_{}-{}".format(method, match.group(1), DATASET_VERSION)
+    else:
+        id = "displacement-time-series-{}_{}-part{:03d}of{:03d}-{}".format(
+             method, match.group(1), partition['index'], partition['count'], DATASET_VERSION)
     logger.info("Product ID for version {}: {}".format(DATASET_VERSION, id))
 
     # get endpoint configurations
@@ -72,23 +114,58 @@ def main(input_json_file):
     logger.info("GRQ url: {}".format(es_url))
     logger.info("GRQ index: {}".format(es_index))
 
+    # localize (move or stream-decompress) only the stacks the inversion method
+    # needs in the background while checking for duplicates and loading metadata
+    localizer = StackLocalizer(os.path.abspath(ifg_stack_dir),
+                               os.path.abspath(os.path.join(ifg_stack_dir, 'Stack')),
+                               method).start()
+
     # check if dataset already exists
     if dataset_exists(es_url, es_index, id):
         logger.info("{} was previously generated and exists in GRQ database.".format(id))
+        localizer.cancel()
         sys.exit(0)
 
     # change dir to ifg stack
     os.chdir(ifg_stack_dir)
-    os.makedirs('Stack', 0o755)
 
-    # unzip and move
-    check_call("pigz -d {}".format('RAW-STACK.h5.gz'), shell=True)
-    shutil.move('RAW-STACK.h5', 'Stack')
-    check_call("pigz -d {}".format('PROC-STACK.h5.gz'), shell=True)
-    shutil.move('PROC-STACK.h5', 'Stack')
+    # read in ifg stack metadata
+    with open("{}.met.json".format(ifg_stack_dir)) as f:
+        met = json.load(f)
+
+    # unpickle filter info and extract geocode info
+    with open('filt_info.pkl', 'rb') as f:
+        filt_info = pickle.load(f)
+    if filt_info.get('grid') is not None:
+        grid = GeoGrid.from_dict(filt_info['grid'])
+        lats, lons = grid.lats, grid.lons
+    else:
+        # stacks filtered before the grid was recorded
+        lats, lons = filt_info['lats'], filt_info['lons']
+
+    # wait for stacks
+    localize_stats = localizer.wait()
+    logger.info("localize stats: {}".format(json.dumps(localize_stats, indent=2)))
+
+    # crop the processed stack and geocode info to the partition window
+    if partition is not None:
+        r0, r1, c0, c1 = partition['window']
+        stack_file = os.path.join("Stack", "PROC-STACK.h5")
+        full_stack_file = os.path.join("Stack", "PROC-STACK-full.h5")
+        shutil.move(stack_file, full_stack_file)
+        crop_stack(full_stack_file, stack_file, partition['window'])
+        os.unlink(full_stack_file)
+        lats, lons = lats[r0:r1], lons[c0:c1]
 
     # run inversion method
-    if method == "sbas":
+    if engine == "native":
+        # invert out of core in tiles aligned to the stack chunks, spread
+        # over worker processes (and resumed if a previous attempt died)
+        ts_file = "LS-PARAMS.h5" if method == "sbas" else "NSBAS-PARAMS.h5"
+        logger.info("Running native {} inversion".format(method.upper()))
+        invert_tiled(os.path.join("Stack", "PROC-STACK.h5"), os.path.join("Stack", ts_file),
+                     method, nproc=get_cpu_count(), xml_file="sbas.xml")
+    elif method == "sbas":
         # SBASInvert.py to create time-series using short baseline approach (least-squares)
         logger.info("Running SBASInvert.py")
         check_call("{}/SBASInvertWrapper.py".format(BASE_PATH), shell=True)
@@ -100,18 +177,10 @@ def main(input_json_file):
         check_call("{}/NSBASInvertWrapper.py -nproc {}".format(BASE_PATH, cpu_count), shell=True)
         ts_file = "NSBAS-PARAMS.h5"
 
-    # read in ifg stack metadata
-    with open("{}.met.json".format(ifg_stack_dir)) as f:
-        met = json.load(f)
-
-    # unpickle filter info and extract geocode info
-    with open('filt_info.pkl', 'rb') as f:
-        filt_info = pickle.load(f)
-    lats = filt_info['lats']
-    lons = filt_info['lons']
-
-    # add lat, lon, and time datasets to time series product for THREDDS
-    prep_tds(lats, lons, os.path.join("Stack", ts_file))
+    # add lat, lon, and time datasets to time series product for THREDDS and
+    # rechunk/compress the time series datasets for point and map queries
+    rechunk_ts(os.path.join("Stack", ts_file), lats, lons, chunk_layout)
+    if partition is not None: set_partition_attrs(os.path.join("Stack", ts_file), partition)
 
     # move back up
     os.chdir(cwd)
@@ -128,11 +197,11 @@ def main(input_json_file):
     # go to prod dir
     os.chdir(prod_dir)
 
-    # create browse image
-    call_noerr('gdal_translate HDF5:"{}"://rawts browse.tif -of GTiff -outsize 50% 50% -b 2'.format(ts_file))
-    call_noerr("convert browse.tif browse.png")
-    call_noerr("convert -resize 250x250 browse.png browse_small.png")
-    call_noerr("rm -f browse.tif")
+    # create browse images from decimated reads of the time series
+    try: render_ts_browse(ts_file, last=browse_last_epoch, velocity=browse_velocity)
+    except Exception as e:
+        logger.warn("Failed to create browse images: {}".format(str(e)))
+        logger.warn("Traceback: {}".format(traceback.format_exc()))
 
     # move back up
     os.chdir(cwd)
@@ -141,22 +210,30 @@ def main(input_json_file):
     met['dataset_type'] = "time-series"
     met['product_type'] = "time-series"
     met['tags'] = method
+    met['h5_format'] = h5_format
+    met['engine'] = engine
+    if partition is not None: met['partition'] = partition
     met_file = os.path.join(prod_dir, "{}.met.json".format(id))
     with open(met_file, 'w') as f:
         json.dump(met, f, indent=2)
 
     # compute bounding polygon
-    try: geojson_bbox = get_bounding_polygon(prod_ts_file)
+    location_type = "MultiPolygon" if footprint_mode == 'multi' else "Polygon"
+    try: geojson_bbox = get_bounding_polygon(prod_ts_file, footprint_mode,
+                                             footprint_max_vertices)
     except Exception as e:
         logger.warn("Using less precise bbox due to error. {0}.{1}".format(type(e), e))
         geojson_bbox = [[i[1], i[0]] for i in met['bbox']]
+        location_type = "Polygon"
 
     # create dataset json
     write_dataset_json(prod_dir, id, geojson_bbox, met['timesteps'][0], 
-                       met['timesteps'][-1], DATASET_VERSION)
+                       met['timesteps'][-1], DATASET_VERSION, location_type)
 
-    # compress
-    check_call("pigz -f -9 {}".format(prod_ts_file), shell=True)
+    # compress time series file as a whole in the legacy gzip format (it is
+    # already compressed per chunk by rechunk_ts())
+    if h5_format == 'gzip':
+        check_call("pigz -f -9 {}".format(prod_ts_file), shell=True)
 
     # clean out filtered ifg stack
     try: shutil.rmtree(ifg_stack_dir)
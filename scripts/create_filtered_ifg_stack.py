@@ -13,16 +13,18 @@ import logging
 import hashlib
 import shutil
 import pickle
-import h5py
 from subprocess import check_call
 from datetime import datetime
 from glob import glob
-import pandas as pd
 
 from giant_time_series.filt import filter_ifgs
 from giant_time_series.utils import (get_envelope, dataset_exists, call_noerr,
-write_dataset_json, merge_intervals)
-from giant_time_series.plot import plot_stack
+write_dataset_json)
+from giant_time_series.plot import plot_stack, plot_network
+from giant_time_series.network import analyze_network, write_gaps, log_network
+from giant_time_series.rechunk import H5_FORMATS, store_h5
+from giant_time_series.quicklook import MAX_FRAMES, write_browse_animation
+from giant_time_series.stack import build_raw_stack
 
 import celeryconfig as conf
 
@@ -116,11 +118,31 @@ def main(input_json_file):
     track = int(input_json['track'])
     logger.info("Track: {}".format(track))
 
+    # get number of filter workers (defaults to cgroup CPU quota)
+    nproc = input_json.get('filter_nproc', None)
+
+    # get HDF5 product format
+    h5_format = input_json.get('h5_format', 'gzip')
+    if h5_format not in H5_FORMATS:
+        raise RuntimeError("Invalid h5_format:{}".format(h5_format))
+
+    # get raw stack builder: GIAnT's PrepIgramStack.py or the native one,
+    # optionally reusing the pixels read while filtering
+    stack_builder = input_json.get('stack_builder', 'giant')
+    if stack_builder not in ('giant', 'native'):
+        raise RuntimeError("Invalid stack_builder:{}".format(stack_builder))
+    reuse_pixels = stack_builder == 'native' and input_json.get('reuse_pixels', False)
+    pixel_dir = "pixels" if reuse_pixels else None
+
+    # get optional persistent screening cache shared across runs
+    cache = input_json.get('screen_cache', os.environ.get('GIANT_SCREEN_CACHE', None))
+
     # filter interferogram stack
     filt_info = filter_ifgs(products, min_lat, max_lat, min_lon, max_lon,
                             ref_lat, ref_lon, ref_width, ref_height, covth,
                             cohth, range_pixel_size, azimuth_pixel_size,
-                            inc, filt, netramp, gpsramp, subswath, track)
+                            inc, filt, netramp, gpsramp, subswath, track,
+                            nproc=nproc, cache=cache, pixel_dir=pixel_dir)
 
     # dump filter info
     with open('filt_info.pkl', 'wb') as f:
@@ -223,8 +245,15 @@ def main(input_json_file):
     check_call("python2 prepdataxml.py", shell=True)
 
     # prepare interferogram stack
-    logger.info("Running step 2: PrepIgramStack.py")
-    check_call("{}/PrepIgramStackWrapper.py".format(BASE_PATH), shell=True)
+    if stack_builder == 'native':
+        logger.info("Running step 2: build_raw_stack")
+        if not os.path.isdir("Stack"): os.makedirs("Stack")
+        stack_stats = build_raw_stack(ifg_info, os.path.join("Stack", "RAW-STACK.h5"), nproc=nproc)
+        logger.info("stack stats: {}".format(json.dumps(stack_stats, indent=2)))
+        if pixel_dir is not None: shutil.rmtree(pixel_dir)
+    else:
+        logger.info("Running step 2: PrepIgramStack.py")
+        check_call("{}/PrepIgramStackWrapper.py".format(BASE_PATH), shell=True)
 
     # create sbas.xml
     logger.info("Running step 3: prepsbasxml.py")
@@ -236,6 +265,7 @@ def main(input_json_file):
 
     # extract timestep dates
     proc_stack = os.path.join(cwd, 'Stack', 'PROC-STACK.h5')
+    import h5py
     h5f = h5py.File(proc_stack, 'r')
     times = h5f.get('dates')[:]
     h5f.close()
@@ -248,52 +278,43 @@ def main(input_json_file):
     # move and compress HDF5 products
     prod_files = glob("Stack/*")
     for i in prod_files:
-        shutil.move(i, prod_dir)
-        check_call("pigz -f -9 {}".format(os.path.join(prod_dir, os.path.basename(i))), shell=True)
+        if i.endswith(".h5"): store_h5(i, prod_dir, h5_format)
+        else: shutil.move(i, prod_dir)
 
     # plot temporal connectivity
     stack_png = "browse.png"
     stack_png_small = "browse_small.png"
-    plot_stack([(ifg_info[i]['master_date'], ifg_info[i]['slave_date']) for i in sorted(ifg_info)], stack_png)
+    pairs = [(ifg_info[i]['master_date'], ifg_info[i]['slave_date']) for i in sorted(ifg_info)]
+    plot_stack(pairs, stack_png)
     call_noerr("convert -resize 250x250 {} {}".format(stack_png, stack_png_small))
     shutil.move(stack_png, os.path.join(prod_dir, stack_png))
     shutil.move(stack_png_small, os.path.join(prod_dir, stack_png_small))
 
-    # get holes
-    start_dates = []
-    stop_dates = []
-    for i in sorted(ifg_info):
-        start_dates.append(ifg_info[i]['start_dt']) 
-        stop_dates.append(ifg_info[i]['stop_dt']) 
-    df = pd.DataFrame({
-        'start_date': start_dates,
-        'stop_date': stop_dates,
-    })
-    df.start_date = pd.to_datetime(df.start_date, dayfirst= True)
-    df.stop_date = pd.to_datetime(df.stop_date, dayfirst= True)
-    intervals = merge_intervals([[df['start_date'][i], df['stop_date'][i]] for i in range(len(df))])
-    connected = True if len(intervals) == 1 else False
-    logger.info("intervals: {}".format("\n".join(map(str, intervals))))
+    # plot perpendicular baseline vs. time
+    network_png = "network.png"
+    plot_network(pairs, [ifg_info[i]['bperp'] for i in sorted(ifg_info)], network_png)
+    shutil.move(network_png, os.path.join(prod_dir, network_png))
+
+    # analyze temporal connectivity of the ifg network
+    network = analyze_network(pairs)
+    log_network(network, pairs)
+    connected = network['connected']
     gap_file = "gaps.txt"
-    with open(gap_file, "w") as f:
-        if not connected:
-            f.write("Temporal gaps:\n")
-            it1, it2 = 0, 1
-            while it2 < len(intervals):
-                f.write("{} - {}\n".format(intervals[it1][1], intervals[it2][0]))
-                it1 += 1
-                it2 += 1
-        else:
-            f.write("No temporal gaps")
+    write_gaps(network, gap_file)
     shutil.move(gap_file, os.path.join(prod_dir, gap_file))
     
     # get list of igram pngs
     png_files = glob("Figs/Igrams/*.png")
 
-    # create animated gif
+    # create animated gif from quicklooks of the aligned ifgs
     gif_file = "browse.gif"
-    call_noerr("convert -loop -0 -delay 100 Figs/Igrams/*.png {}".format(gif_file))
-    shutil.move(gif_file, prod_dir)
+    try:
+        write_browse_animation(ifg_info, gif_file, input_json.get('browse_max_frames', MAX_FRAMES),
+                               nproc=nproc)
+        shutil.move(gif_file, prod_dir)
+    except Exception as e:
+        logger.warn("Failed to create {}: {}".format(gif_file, str(e)))
+        logger.warn("Traceback: {}".format(traceback.format_exc()))
 
     # copy pngs
     for i in png_files: shutil.move(i, prod_dir)
@@ -332,6 +353,8 @@ def main(input_json_file):
         "ifgs": [ifg_info[i]['product'] for i in sorted(ifg_info)],
         "timestep_count": len(timesteps),
         "timesteps": timesteps,
+        "h5_format": h5_format,
+        "stack_builder": stack_builder,
     }
     if connected: met['tags'] = 'temporally_connected'
     met_file = os.path.join(prod_dir, "{}.met.json".format(id))
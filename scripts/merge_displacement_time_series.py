@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Merge the partitions of a partitioned displacement time series.
+"""
+
+import os
+import sys
+import re
+import traceback
+import argparse
+import json
+import logging
+import gzip
+import shutil
+from subprocess import check_call
+
+from giant_time_series.utils import (dataset_exists, get_bounding_polygon,
+write_dataset_json)
+from giant_time_series.rechunk import LAYOUTS, H5_FORMATS, rechunk_ts
+from giant_time_series.partition import merge_partitions
+from giant_time_series.plot import render_ts_browse
+
+import celeryconfig as conf
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+PART_RE = re.compile(r'^(displacement-time-series-.+)-part\d{3}of(\d{3})(-v.+)$')
+TS_FILES = ("LS-PARAMS.h5", "NSBAS-PARAMS.h5")
+
+
+def get_partition_file(prod_dir):
+    """Return the time series file of a partition product, decompressing
+       the legacy gzip format."""
+
+    for ts_file in TS_FILES:
+        path = os.path.join(prod_dir, ts_file)
+        if os.path.exists(path): return path
+        if os.path.exists(path + ".gz"):
+            with gzip.open(path + ".gz", 'rb') as f, open(path, 'wb') as g:
+                shutil.copyfileobj(f, g)
+            os.unlink(path + ".gz")
+            return path
+    raise RuntimeError("Failed to find time series file in {}.".format(prod_dir))
+
+
+def main(input_json_file):
+    """Main partition merger."""
+
+    # get merge input
+    input_json_file = os.path.abspath(input_json_file)
+    if not os.path.exists(input_json_file):
+        raise RuntimeError("Failed to find %s." % input_json_file)
+    with open(input_json_file) as f:
+        input_json = json.load(f)
+    logger.info("input_json: {}".format(json.dumps(input_json, indent=2)))
+
+    # get partition products
+    products = [i.rstrip('/') for i in input_json['products']]
+    matches = [PART_RE.search(os.path.basename(i)) for i in products]
+    if not all(matches):
+        raise RuntimeError("Failed to recognize partition products: {}".format(products))
+    ids = set([m.group(1) + m.group(3) for m in matches])
+    if len(ids) != 1:
+        raise RuntimeError("Partitions of different time series: {}".format(sorted(ids)))
+    id = ids.pop()
+    count = int(matches[0].group(2))
+    version = matches[0].group(3)[1:]
+    if len(products) != count:
+        raise RuntimeError("Got {} of {} partitions of {}.".format(len(products), count, id))
+    logger.info("Product ID: {}".format(id))
+
+    # get footprint, chunk layout and browse options
+    footprint_mode = input_json.get('footprint_mode', 'hull')
+    if footprint_mode not in ('hull', 'outline', 'multi'):
+        raise RuntimeError("Invalid footprint_mode:{}".format(footprint_mode))
+    footprint_max_vertices = input_json.get('footprint_max_vertices', None)
+    if footprint_max_vertices is not None: footprint_max_vertices = int(footprint_max_vertices)
+    chunk_layout = input_json.get('chunk_layout', 'pixel')
+    if chunk_layout not in LAYOUTS:
+        raise RuntimeError("Invalid chunk_layout:{}".format(chunk_layout))
+    browse_last_epoch = input_json.get('browse_last_epoch', False)
+    browse_velocity = input_json.get('browse_velocity', False)
+
+    # check if dataset already exists
+    es_url = conf.GRQ_ES_URL
+    es_index = conf.DATASET_ALIAS
+    if dataset_exists(es_url, es_index, id):
+        logger.info("{} was previously generated and exists in GRQ database.".format(id))
+        sys.exit(0)
+
+    # read metadata of the first partition
+    with open(os.path.join(products[0], "{}.met.json".format(os.path.basename(products[0])))) as f:
+        met = json.load(f)
+    met.pop('partition', None)
+    h5_format = input_json.get('h5_format', met.get('h5_format', 'gzip'))
+    if h5_format not in H5_FORMATS:
+        raise RuntimeError("Invalid h5_format:{}".format(h5_format))
+
+    # stitch the partition cores and add the lat, lon, and time datasets
+    ts_files = [get_partition_file(i) for i in products]
+    ts_file = os.path.basename(ts_files[0])
+    prod_dir = id
+    os.makedirs(prod_dir, 0o755)
+    prod_ts_file = os.path.join(prod_dir, ts_file)
+    lats, lons = merge_partitions(ts_files, prod_ts_file)
+    rechunk_ts(prod_ts_file, lats, lons, chunk_layout)
+
+    # create browse images from decimated reads of the time series
+    try: render_ts_browse(prod_ts_file, out_dir=prod_dir, last=browse_last_epoch,
+                          velocity=browse_velocity)
+    except Exception as e:
+        logger.warn("Failed to create browse images: {}".format(str(e)))
+        logger.warn("Traceback: {}".format(traceback.format_exc()))
+
+    # create met json
+    met['h5_format'] = h5_format
+    met['partitions'] = count
+    met_file = os.path.join(prod_dir, "{}.met.json".format(id))
+    with open(met_file, 'w') as f:
+        json.dump(met, f, indent=2)
+
+    # compute bounding polygon
+    location_type = "MultiPolygon" if footprint_mode == 'multi' else "Polygon"
+    try: geojson_bbox = get_bounding_polygon(prod_ts_file, footprint_mode,
+                                             footprint_max_vertices)
+    except Exception as e:
+        logger.warn("Using less precise bbox due to error. {0}.{1}".format(type(e), e))
+        geojson_bbox = [[i[1], i[0]] for i in met['bbox']]
+        location_type = "Polygon"
+
+    # create dataset json
+    write_dataset_json(prod_dir, id, geojson_bbox, met['timesteps'][0],
+                       met['timesteps'][-1], version, location_type)
+
+    # compress time series file as a whole in the legacy gzip format
+    if h5_format == 'gzip':
+        check_call("pigz -f -9 {}".format(prod_ts_file), shell=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input_json_file", help="input JSON file")
+    args = parser.parse_args()
+    work_dir = os.getcwd()
+    try: main(args.input_json_file)
+    except Exception as e:
+        with open(os.path.join(work_dir, '_alt_error.txt'), 'w') as f:
+            f.write("%s\n" % str(e))
+        with open(os.path.join(work_dir, '_alt_traceback.txt'), 'w') as f:
+            f.write("%s\n" % traceback.format_exc())
+        raise
+    sys.exit(0)
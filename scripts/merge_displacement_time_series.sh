@@ -0,0 +1,44 @@
+#!/bin/bash
+BASE_PATH=$(dirname "${BASH_SOURCE}")
+echo $BASE_PATH
+BASE_PATH=$(cd "${BASE_PATH}"; pwd)
+echo $BASE_PATH
+
+# set PGE path
+PGE_PATH=$(cd "${BASE_PATH}/.."; pwd)
+BIN_PATH=$PGE_PATH/scripts
+
+# move symlinked products
+INPUT_DIR=orig_symlinked_inputs
+if [ ! -d "$INPUT_DIR" ]; then
+   mkdir $INPUT_DIR
+   mv displacement-time-series-* $INPUT_DIR/
+   cd $INPUT_DIR
+   cp -aL displacement-time-series-* ..
+   cd ..
+fi 
+
+# source ISCE env
+export GMT_HOME=/usr/local/gmt
+source $BIN_PATH/isce.sh
+source $BIN_PATH/giant.sh
+export GIANT_HOME=/usr/local/giant/GIAnT
+export PYTHONPATH=$ISCE_HOME/applications:$ISCE_HOME/components:$PGE_PATH:$GIANT_HOME:$PYTHONPATH
+export PATH=$BIN_PATH:$GMT_HOME/bin:$PATH
+
+# source environment
+source $PGE_PATH/env/bin/activate
+
+echo "##########################################" 1>&2
+echo -n "Running partitioned displacement time series merge: " 1>&2
+date 1>&2
+python $BIN_PATH/merge_displacement_time_series.py _context.json > merge_displacement_time_series.log 2>&1
+STATUS=$?
+echo -n "Finished running partitioned displacement time series merge: " 1>&2
+date 1>&2
+if [ $STATUS -ne 0 ]; then
+  echo "Failed to run partitioned displacement time series merge." 1>&2
+  cat merge_displacement_time_series.log 1>&2
+  echo "{}"
+  exit $STATUS
+fi
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Plan the spatial partition jobs of a displacement time series.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import pickle
+
+from giant_time_series.utils import GeoGrid
+from giant_time_series.partition import OVERLAP, write_plan
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+def get_stack_shape(ifg_stack_dir):
+    """Return (length, width) of the ROI of a filtered ifg stack from its
+       filter info."""
+
+    with open(os.path.join(ifg_stack_dir, 'filt_info.pkl'), 'rb') as f:
+        filt_info = pickle.load(f)
+    if filt_info.get('grid') is not None:
+        grid = GeoGrid.from_dict(filt_info['grid'])
+        return grid.length, grid.width
+    return len(filt_info['lats']), len(filt_info['lons'])
+
+
+def main(input_json_file, count, overlap, out_dir):
+    """Main partition planner."""
+
+    with open(input_json_file) as f:
+        input_json = json.load(f)
+    shape = get_stack_shape(input_json['products'][0])
+    logger.info("Splitting {}x{} ROI into {} partitions".format(shape[0], shape[1], count))
+    for path in write_plan(input_json_file, shape, count, overlap, out_dir): print(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input_json_file", help="input JSON file of the displacement time series job")
+    parser.add_argument("-n", "--partitions", type=int, required=True, help="number of partitions")
+    parser.add_argument("--overlap", type=int, default=OVERLAP,
+                        help="overlap (pixels) of neighboring partitions")
+    parser.add_argument("--out_dir", default=".", help="directory of the partition job inputs")
+    args = parser.parse_args()
+    main(args.input_json_file, args.partitions, args.overlap, args.out_dir)
+    sys.exit(0)
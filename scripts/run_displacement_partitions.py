@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Invert a processed stack locally in spatial partitions, each in its own
+process, and merge them as the partition and merge jobs would.
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+from giant_time_series.partition import OVERLAP, run_partitions
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("stack_file", help="processed stack (PROC-STACK.h5)")
+    parser.add_argument("out_file", help="merged time series file")
+    parser.add_argument("-n", "--partitions", type=int, required=True, help="number of partitions")
+    parser.add_argument("--overlap", type=int, default=OVERLAP,
+                        help="overlap (pixels) of neighboring partitions")
+    parser.add_argument("--method", default="sbas", choices=("sbas", "nsbas"))
+    parser.add_argument("--sbas_xml", default=None, help="GIAnT sbas.xml of the inversion parameters")
+    parser.add_argument("--nproc", type=int, default=None,
+                        help="partitions run at a time (default: all)")
+    parser.add_argument("--keep", action="store_true", help="keep the partition time series files")
+    args = parser.parse_args()
+    ts_files = run_partitions(args.stack_file, args.out_file, args.partitions, args.overlap,
+                              args.method, args.sbas_xml, args.nproc)
+    if not args.keep:
+        for ts_file in ts_files: os.unlink(ts_file)
+    sys.exit(0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Sweep filter coherence/coverage thresholds over an interferogram stack.
+"""
+
+import os
+import sys
+import traceback
+import argparse
+import json
+import logging
+
+from giant_time_series.filt import sweep_ifgs, write_sweep
+from giant_time_series.utils import get_envelope
+from giant_time_series.plot import plot_sweep
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+# default threshold grids
+COHERENCE_THRESHOLDS = [0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5, 0.6, 0.7]
+COVERAGE_THRESHOLDS = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
+
+
+def main(input_json_file):
+    """Main threshold sweep."""
+
+    # get sweep input
+    input_json_file = os.path.abspath(input_json_file)
+    if not os.path.exists(input_json_file):
+        raise RuntimeError("Failed to find %s." % input_json_file)
+    with open(input_json_file) as f:
+        input_json = json.load(f)
+    logger.info("input_json: {}".format(json.dumps(input_json, indent=2)))
+
+    # get ifg products
+    products = input_json['products']
+
+    # get region of interest
+    if input_json['region_of_interest']:
+        logger.info("Running sweep with Region of Interest")
+        min_lat, max_lat, min_lon, max_lon = input_json['region_of_interest']
+    else:
+        logger.info("Running sweep on full data")
+        min_lon, max_lon, min_lat, max_lat = get_envelope(input_json['products'])
+        logger.info("env: {} {} {} {}".format(min_lon, max_lon, min_lat, max_lat))
+
+    # get reference point in radar coordinates and length/width for box
+    ref_lat, ref_lon = input_json['ref_point']
+    ref_width = int((input_json['ref_box_num_pixels'][0]-1)/2)
+    ref_height = int((input_json['ref_box_num_pixels'][1]-1)/2)
+
+    # get threshold grids
+    cohths = input_json.get('coherence_thresholds', None) or COHERENCE_THRESHOLDS
+    covths = input_json.get('coverage_thresholds', None) or COVERAGE_THRESHOLDS
+    logger.info("Coherence thresholds: {}".format(cohths))
+    logger.info("Coverage thresholds: {}".format(covths))
+
+    # get track
+    track = int(input_json['track'])
+    logger.info("Track: {}".format(track))
+
+    # sweep thresholds
+    nproc = input_json.get('filter_nproc', None)
+    cache = input_json.get('screen_cache', os.environ.get('GIANT_SCREEN_CACHE', None))
+    sweep = sweep_ifgs(products, min_lat, max_lat, min_lon, max_lon,
+                       ref_lat, ref_lon, ref_width, ref_height, covths,
+                       cohths, track, nproc=nproc, cache=cache)
+    for row in sweep:
+        logger.info("cohth={cohth} covth={covth}: {ifg_count} ifgs, connected={connected}, gaps={gaps}, {start_dt}-{stop_dt}".format(**row))
+
+    # write table and heatmap
+    write_sweep(sweep, "sweep.csv")
+    plot_sweep(sweep, "sweep.png")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input_json_file", help="input JSON file")
+    args = parser.parse_args()
+    work_dir = os.getcwd()
+    try: main(args.input_json_file)
+    except Exception as e:
+        with open(os.path.join(work_dir, '_alt_error.txt'), 'w') as f:
+            f.write("%s\n" % str(e))
+        with open(os.path.join(work_dir, '_alt_traceback.txt'), 'w') as f:
+            f.write("%s\n" % traceback.format_exc())
+        raise
+    sys.exit(0)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from giant_time_series.cache import ScreenCache
+
+
+def test_get_put(tmpdir):
+    cache = ScreenCache(str(tmpdir.join("cache.db")))
+    key = ("prod", (("a.vrt", 10, 1),), (34., 35., -118., -117.), 0.)
+    assert cache.get('columns', key) is None
+    counts = np.arange(20).reshape(2, 10)
+    cache.put('columns', key, {'levels': (.1, .2), 'counts': counts})
+    value = cache.get('columns', key)
+    assert value['levels'] == (.1, .2)
+    assert np.array_equal(value['counts'], counts)
+    assert cache.pop_stats()['columns'] == {'hits': 1, 'misses': 1}
+    assert cache.stats['columns'] == {'hits': 0, 'misses': 0}
+
+
+def test_lru_eviction(tmpdir):
+    path = str(tmpdir.join("cache.db"))
+    rng = np.random.RandomState(0)
+    cache = ScreenCache(path, max_bytes=3000)
+    for i in range(3):
+        cache.put('ref', i, rng.uniform(size=100))
+    cache.get('ref', 0)
+    cache.put('ref', 3, rng.uniform(size=100))
+
+    # entry 1 was least recently used
+    cache = ScreenCache(path, max_bytes=3000)
+    assert cache.get('ref', 1) is None
+    assert cache.get('ref', 0) is not None
+    assert cache.get('ref', 3) is not None
+
+
+def test_lru_cache():
+    from giant_time_series.cache import LRUCache
+
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+    assert cache.pop_stats() == {'hits': 3, 'misses': 1, 'evictions': 1}
+    assert cache.stats == {'hits': 0, 'misses': 0, 'evictions': 0}
@@ -0,0 +1,207 @@
+import os
+import pytest
+
+
+# ROI reaching past the top of the synthetic rasters so the coverage of
+# duplicates with identical footprints ties
+ROI = (34.45, 34.52, -118.49, -118.43)
+REF = (34.47, -118.46, 5, 5)
+
+
+def run_filter(prods, roi=ROI, covth=.3, cohth=.2, **kwargs):
+    from giant_time_series.filt import filter_ifgs
+
+    return filter_ifgs(prods, *(roi + REF + (covth, cohth, 100., 100., 39., .05,
+                                             False, False, 64)), **kwargs)
+
+
+@pytest.fixture
+def stack(tmpdir, monkeypatch):
+    pytest.importorskip("osgeo")
+    from giant_time_series.synthetic import write_stack
+
+    monkeypatch.chdir(str(tmpdir))
+    return write_stack(str(tmpdir), 8, shape=(60, 80), dup_rate=.5, nodata_frac=.05)
+
+
+def get_date_groups(prods):
+    """Return products grouped by date ID in input order."""
+
+    groups = {}
+    for prod in prods:
+        fields = prod.split('-')
+        groups.setdefault("{}_{}".format(fields[7][:8], fields[6][:8]), []).append(prod)
+    return groups
+
+
+def test_nproc_matches_serial(stack):
+    serial = run_filter(stack, nproc=1)
+    pooled = run_filter(stack, nproc=2)
+    for key in ('ifg_info', 'ifg_coverage', 'center_lines_utc', 'io_stats', 'grid'):
+        assert pooled[key] == serial[key]
+
+    # duplicates tie on coverage and the first in input order is kept
+    groups = get_date_groups(stack)
+    assert any([len(i) > 1 for i in groups.values()])
+    assert sorted(serial['ifg_info']) == sorted(groups)
+    for dt_id, info in serial['ifg_info'].items():
+        assert info['product'] == groups[dt_id][0]
+        assert os.path.realpath(dt_id) == os.path.realpath(groups[dt_id][0])
+
+
+def screen_all(args):
+    """_screen_group() without the early stop."""
+
+    from giant_time_series.filt import _screen_ifg
+
+    group, prod_count, params = args
+    return [_screen_ifg(meta, prod_count, params) for meta in group], [], {}
+
+
+def test_early_stop_matches_full_screening(tmpdir, monkeypatch):
+    pytest.importorskip("osgeo")
+    from giant_time_series import filt
+    from giant_time_series.synthetic import write_stack
+
+    monkeypatch.chdir(str(tmpdir))
+    prods = write_stack(str(tmpdir), 8, shape=(60, 80), dup_rate=.5, nodata_frac=0.)
+    # ROI inside the rasters so products without no data fully cover it
+    kwargs = {'roi': (34.45, 34.49, -118.49, -118.43), 'cohth': 0., 'nproc': 1}
+    early = run_filter(prods, **kwargs)
+    monkeypatch.setattr(filt, "_screen_group", screen_all)
+    full = run_filter(prods, **kwargs)
+
+    assert early['io_stats']['skipped'] > 0 and full['io_stats']['skipped'] == 0
+    for key in ('products', 'prefiltered', 'planned'):
+        assert early['io_stats'][key] == full['io_stats'][key]
+    assert early['io_stats']['screened'] + early['io_stats']['skipped'] == full['io_stats']['screened']
+    assert early['io_stats']['bytes_avoided'] > full['io_stats']['bytes_avoided']
+    assert early['ifg_info'] == full['ifg_info']
+    assert early['ifg_coverage'] == full['ifg_coverage']
+
+    # skipped duplicates share a sensing mid with a product that passed
+    assert sorted(set(early['center_lines_utc'])) == sorted(set(full['center_lines_utc']))
+
+
+def test_early_stop_keeps_distinct_sensing_mids(tmpdir, monkeypatch):
+    pytest.importorskip("osgeo")
+    from datetime import timedelta
+    from giant_time_series import filt
+    from giant_time_series.synthetic import write_stack
+
+    # duplicates sensed at other times than the product before them
+    get_sensing_info = filt._get_sensing_info
+    def shifted(meta):
+        info = list(get_sensing_info(meta))
+        info[2] += timedelta(seconds=meta['prod_num'])
+        return tuple(info)
+    monkeypatch.setattr(filt, "_get_sensing_info", shifted)
+
+    monkeypatch.chdir(str(tmpdir))
+    prods = write_stack(str(tmpdir), 8, shape=(60, 80), dup_rate=.5, nodata_frac=0.)
+    kwargs = {'roi': (34.45, 34.49, -118.49, -118.43), 'cohth': 0., 'nproc': 1}
+    early = run_filter(prods, **kwargs)
+    monkeypatch.setattr(filt, "_screen_group", screen_all)
+    full = run_filter(prods, **kwargs)
+    assert early['io_stats']['skipped'] == 0
+    assert early['ifg_info'] == full['ifg_info']
+    assert sorted(early['center_lines_utc']) == sorted(full['center_lines_utc'])
+
+
+@pytest.mark.parametrize("cohths,covths", [
+    ([], [.3]),
+    ([.2], []),
+    ([.2, "a"], [.3]),
+    (.2, [.3]),
+    ([.2], [float('nan')]),
+])
+def test_sweep_rejects_invalid_thresholds(cohths, covths):
+    from giant_time_series.filt import sweep_ifgs
+
+    with pytest.raises(RuntimeError):
+        sweep_ifgs([], *(ROI + REF + (covths, cohths, 64)))
+
+
+def test_sweep_matches_filter(stack):
+    from giant_time_series.filt import sweep_ifgs
+    from giant_time_series.network import is_connected
+
+    cohths, covths = (.2, .5, .7), (.3, .7, .75)
+    sweep = sweep_ifgs(stack, *(ROI + REF + (covths, cohths, 64)), nproc=2)
+    assert [(i['cohth'], i['covth']) for i in sweep] == [(a, b) for a in cohths for b in covths]
+    counts = set()
+    for row in sweep:
+        ifg_info = run_filter(stack, covth=row['covth'], cohth=row['cohth'], link_dir=None)['ifg_info']
+        infos = list(ifg_info.values())
+        counts.add(len(infos))
+        assert row['ifg_count'] == len(infos)
+        assert row['connected'] == is_connected([(i['master_date'], i['slave_date']) for i in infos])
+        if infos:
+            assert row['start_dt'] == min([i['start_dt'] for i in infos])
+            assert row['stop_dt'] == max([i['stop_dt'] for i in infos])
+        else:
+            assert row['start_dt'] is None and row['stop_dt'] is None
+    assert len(counts) > 1
+
+
+def test_write_sweep(tmpdir):
+    from giant_time_series.filt import write_sweep
+
+    sweep = [
+        {'cohth': .2, 'covth': .3, 'ifg_count': 3, 'connected': True, 'gaps': 0,
+         'start_dt': '20170101', 'stop_dt': '20170206'},
+        {'cohth': .2, 'covth': .9, 'ifg_count': 0, 'connected': False, 'gaps': 0,
+         'start_dt': None, 'stop_dt': None},
+    ]
+    sweep_file = str(tmpdir.join("sweep.csv"))
+    write_sweep(sweep, sweep_file)
+    with open(sweep_file) as f:
+        assert f.read().splitlines() == [
+            "cohth,covth,ifg_count,connected,gaps,start_dt,stop_dt",
+            "0.2,0.3,3,True,0,20170101,20170206",
+            "0.2,0.9,0,False,0,,",
+        ]
+
+
+def test_link_ifgs_rerun(tmpdir):
+    from giant_time_series.filt import link_ifgs
+
+    link_dir = tmpdir.mkdir("links")
+    for prod in ("old", "new", "dup"): tmpdir.mkdir(prod)
+    ifg_info = {
+        "20170113_20170101": {'product': str(tmpdir.join("new"))},
+        "20170125_20170113": {'product': str(tmpdir.join("dup"))},
+    }
+
+    # stale link of a selected date ID, link of a date ID no longer selected,
+    # temporary link of an interrupted run and unrelated entries
+    link_dir.join("20170113_20170101").mksymlinkto(tmpdir.join("old"))
+    link_dir.join("20170206_20170125").mksymlinkto(tmpdir.join("old"))
+    link_dir.join("20170125_20170113.123.tmp").mksymlinkto(tmpdir.join("old"))
+    link_dir.join("notes").mksymlinkto(tmpdir.join("old"))
+    link_dir.join("20170218_20170206").write("")
+    link_ifgs(ifg_info, str(link_dir))
+    assert sorted(os.listdir(str(link_dir))) == [
+        "20170113_20170101", "20170125_20170113", "20170218_20170206", "notes"]
+    for dt_id, info in ifg_info.items():
+        link = str(link_dir.join(dt_id))
+        assert os.path.islink(link) and not os.path.isabs(os.readlink(link))
+        assert os.path.realpath(link) == os.path.realpath(info['product'])
+
+
+def test_rerun_hits_meta_cache(stack, monkeypatch):
+    from giant_time_series import filt
+
+    runs = []
+    monkeypatch.setattr(filt, "log_stats", lambda stats, path: runs.append(stats))
+    first = run_filter(stack, nproc=1, cache="screen.db")
+    second = run_filter(stack, nproc=1, cache="screen.db")
+    assert runs[0]['meta'] == {'hits': 0, 'misses': len(stack)}
+    assert runs[1]['meta'] == {'hits': len(stack), 'misses': 0}
+    assert second['ifg_info'] == first['ifg_info']
+
+    # a changed raster VRT invalidates the cached grid
+    vrt = os.path.join(stack[0], "merged", "filt_topophase.unw.geo.vrt")
+    with open(vrt, 'a') as f: f.write("\n")
+    run_filter(stack, nproc=1, cache="screen.db")
+    assert runs[2]['meta'] == {'hits': len(stack) - 1, 'misses': 1}
@@ -0,0 +1,172 @@
+import os
+import pytest
+import numpy as np
+
+from giant_time_series.footprint import (FootprintIndex, get_vrt_footprint,
+                                         get_met_footprint, get_footprints,
+                                         get_row_extents, convex_hull, simplify_ring,
+                                         simplify_hull, get_valid_polygons, get_signed_area)
+from giant_time_series.utils import GeoGrid
+from giant_time_series.synthetic import write_stack
+
+
+def brute_force(footprints, bbox):
+    fp = np.array(footprints)
+    lon = np.minimum(fp[:, 1], bbox[1]) - np.maximum(fp[:, 0], bbox[0])
+    lat = np.minimum(fp[:, 3], bbox[3]) - np.maximum(fp[:, 2], bbox[2])
+    return (lon >= 0) & (lat >= 0), np.clip(lon, 0, None) * np.clip(lat, 0, None)
+
+
+def test_index_queries():
+    rng = np.random.RandomState(0)
+    lo = rng.uniform(0., 10., (500, 2))
+    footprints = np.column_stack([lo[:, 0], lo[:, 0] + rng.uniform(.1, 2., 500),
+                                  lo[:, 1], lo[:, 1] + rng.uniform(.1, 2., 500)])
+    index = FootprintIndex(footprints)
+    assert index.envelope() == (footprints[:, 0].min(), footprints[:, 1].max(),
+                                footprints[:, 2].min(), footprints[:, 3].max())
+    for i in range(50):
+        x, y = rng.uniform(0., 10., 2)
+        bbox = (x, x + rng.uniform(0., 3.), y, y + rng.uniform(0., 3.))
+        mask, area = brute_force(footprints, bbox)
+        assert np.array_equal(index.intersects(bbox), mask)
+        bbox_area = (bbox[1] - bbox[0]) * (bbox[3] - bbox[2])
+        assert np.allclose(index.overlap_fraction(bbox), area / bbox_area)
+    assert FootprintIndex([]).envelope() == (0., 0., 0., 0.)
+
+
+def test_product_footprints(tmpdir):
+    stack_dir = str(tmpdir)
+    gt = (-118.5, .001, 0., 34.5, 0., -.001)
+    prods = write_stack(stack_dir, 5, shape=(8, 10), gt=gt, overlap=.5)
+    vrts = [os.path.join(stack_dir, p, "merged", "filt_topophase.unw.geo.vrt") for p in prods]
+    for prod, vrt in zip(prods, vrts):
+        grid = GeoGrid.from_vrt(vrt)
+        assert (grid.width, grid.length) == (10, 8)
+        g = grid.gt
+        assert get_vrt_footprint(vrt, corners=True) == (g[0], g[0] + 9 * g[1], g[3] + 7 * g[5], g[3])
+        assert np.allclose(get_met_footprint(os.path.join(stack_dir, prod)),
+                           get_vrt_footprint(vrt))
+    assert get_footprints(vrts, nproc=2) == get_footprints(vrts)
+
+
+def test_row_extent_hull():
+    scipy_spatial = pytest.importorskip("scipy.spatial")
+    rng = np.random.RandomState(1)
+    data = np.full((2, 60, 40), np.nan, dtype=np.float32)
+    yy, xx = np.mgrid[:60, :40]
+    data[0][((yy - 30)**2 / 900. + (xx - 20)**2 / 300. < 1.) & (rng.rand(60, 40) > .3)] = 1.
+    extents = [get_row_extents(data, 0, chunk_rows) for chunk_rows in (1, 7, 60, None)]
+    for rows, left, right in extents[1:]:
+        assert np.array_equal(rows, extents[0][0])
+        assert np.array_equal(left, extents[0][1])
+        assert np.array_equal(right, extents[0][2])
+
+    # hull of the row extents is the hull of all valid pixels
+    lines, pixels = np.nonzero(~np.isnan(data[0]))
+    points = np.column_stack([pixels, lines]).astype(np.float64)
+    expected = scipy_spatial.ConvexHull(points)
+    assert sorted(convex_hull(points)) == sorted(map(tuple, points[expected.vertices]))
+    rows, left, right = extents[0]
+    lons, lats = np.arange(40) * .1 - 118., 34. - np.arange(60) * .1
+    ring = get_valid_polygons(lats, lons, rows, left, right)[0]
+    assert ring[0] == ring[-1] and get_signed_area(ring[:-1]) > 0.
+    assert sorted(map(tuple, ring[:-1])) == sorted((lons[int(c)], lats[int(r)])
+                                                   for c, r in points[expected.vertices])
+
+
+def test_simplify_and_multi():
+    theta = np.linspace(0., 2 * np.pi, 200, endpoint=False)
+    ring = list(zip(np.cos(theta), np.sin(theta)))
+    simple = simplify_ring(ring, 12)
+    assert len(simple) == 12 and all(pt in ring for pt in simple)
+    assert simplify_ring(ring, None) == ring
+
+    # two blocks of rows separated by a gap
+    data = np.full((30, 20), np.nan)
+    data[2:10, 3:8] = 1.
+    data[15:25, 10:18] = 1.
+    rows, left, right = get_row_extents(data, chunk_rows=4)
+    lons, lats = np.arange(20.), -np.arange(30.)
+    polygons = get_valid_polygons(lats, lons, rows, left, right, 'multi', max_vertices=4)
+    assert len(polygons) == 2
+    assert sorted(polygons[0][:-1]) == [[3., -9.], [3., -2.], [7., -9.], [7., -2.]]
+    assert sorted(polygons[1][:-1]) == [[10., -24.], [10., -15.], [17., -24.], [17., -15.]]
+    with pytest.raises(RuntimeError):
+        get_valid_polygons(lats, lons, rows, left, right, 'bogus')
+
+
+@pytest.mark.parametrize("mode", ["hull", "outline", "multi"])
+def test_degenerate_polygons(mode):
+    lons, lats = np.arange(20.), -np.arange(30.)
+
+    # single row, single pixel and single column of valid data
+    for valid in ((slice(3, 4), slice(2, 9)), (slice(5, 6), slice(7, 8)),
+                  (slice(4, 12), slice(6, 7))):
+        data = np.full((30, 20), np.nan)
+        data[valid] = 1.
+        rows, left, right = get_row_extents(data)
+        with pytest.raises(RuntimeError):
+            get_valid_polygons(lats, lons, rows, left, right, mode)
+
+    # collinear extents (diagonal line)
+    data = np.full((30, 20), np.nan)
+    data[np.arange(4, 12), np.arange(4, 12)] = 1.
+    rows, left, right = get_row_extents(data)
+    with pytest.raises(RuntimeError):
+        get_valid_polygons(lats, lons, rows, left, right, mode)
+
+    # degenerate pieces of gappy coverage are dropped
+    data = np.full((30, 20), np.nan)
+    data[2:10, 3:8] = 1.
+    data[15, 10:18] = 1.
+    data[20, 4] = 1.
+    rows, left, right = get_row_extents(data)
+    polygons = get_valid_polygons(lats, lons, rows, left, right, mode)
+    assert len(polygons) == 1
+    for ring in polygons:
+        assert ring[0] == ring[-1] and len(set(map(tuple, ring))) >= 3
+        assert get_signed_area(ring[:-1]) > 0.
+
+
+def contains(ring, points, eps=1e-9):
+    """Return whether an open counter-clockwise convex ring contains points."""
+
+    ring, points = np.array(ring, dtype=np.float64), np.array(points, dtype=np.float64)
+    for a, b in zip(ring, np.roll(ring, -1, axis=0)):
+        cross = (b[0] - a[0]) * (points[:, 1] - a[1]) - (b[1] - a[1]) * (points[:, 0] - a[0])
+        if (cross < -eps).any(): return False
+    return True
+
+
+def test_simplify_hull():
+    theta = np.linspace(0., 2 * np.pi, 200, endpoint=False)
+    ring = list(zip(np.cos(theta), np.sin(theta)))
+    simple = simplify_hull(ring, 8)
+    assert len(simple) == 8 and contains(simple, ring)
+    assert get_signed_area(simple) > get_signed_area(ring)
+    assert simplify_hull(ring, None) == ring
+
+    # a rectangle cannot be enclosed by a triangle sharing its edges
+    square = [(0., 0.), (9., 0.), (9., 9.), (0., 9.)]
+    assert simplify_hull(square, 3) == square
+
+    # simplified hull of valid pixels still contains all of them
+    rng = np.random.RandomState(2)
+    data = np.full((60, 40), np.nan)
+    yy, xx = np.mgrid[:60, :40]
+    data[((yy - 30)**2 / 900. + (xx - 20)**2 / 300. < 1.) & (rng.rand(60, 40) > .3)] = 1.
+    rows, left, right = get_row_extents(data)
+    lons, lats = np.arange(40) * .1 - 118., 34. - np.arange(60) * .1
+    lines, pixels = np.nonzero(~np.isnan(data))
+    points = np.column_stack([lons[pixels], lats[lines]])
+    for max_vertices in (3, 5, 8):
+        ring = get_valid_polygons(lats, lons, rows, left, right, max_vertices=max_vertices)[0]
+        assert len(ring) - 1 <= max_vertices and contains(ring[:-1], points)
+
+    # full raster keeps its rectangle rather than cutting away data
+    data = np.ones((10, 10))
+    rows, left, right = get_row_extents(data)
+    ring = get_valid_polygons(lats[:10], lons[:10], rows, left, right, max_vertices=3)[0]
+    assert len(ring) == 5
+    assert contains(ring[:-1], np.column_stack([np.repeat(lons[:10], 10), np.tile(lats[:10], 10)]))
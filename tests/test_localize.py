@@ -0,0 +1,41 @@
+import os
+import gzip
+import pytest
+
+from giant_time_series.localize import StackLocalizer, get_stack_files
+
+
+def write_stack_files(stack_dir, gz):
+    sizes = {}
+    for name in ("RAW-STACK.h5", "PROC-STACK.h5"):
+        data = os.urandom(1000) * 300
+        path = os.path.join(stack_dir, name)
+        if gz:
+            with gzip.open(path + ".gz", 'wb') as f: f.write(data)
+        else:
+            with open(path, 'wb') as f: f.write(data)
+        sizes[name] = len(data)
+    return sizes
+
+
+@pytest.mark.parametrize("gz", [True, False])
+def test_localize_needed_stacks(tmpdir, gz):
+    stack_dir = str(tmpdir)
+    dest_dir = str(tmpdir.join("Stack"))
+    sizes = write_stack_files(stack_dir, gz)
+    stats = StackLocalizer(stack_dir, dest_dir, 'sbas').start().wait()
+    assert os.listdir(dest_dir) == ["PROC-STACK.h5"]
+    assert os.path.getsize(os.path.join(dest_dir, "PROC-STACK.h5")) == sizes["PROC-STACK.h5"]
+    assert list(stats['files']) == ["PROC-STACK.h5"]
+    skipped = "RAW-STACK.h5.gz" if gz else "RAW-STACK.h5"
+    assert list(stats['skipped']) == [skipped] and os.path.exists(os.path.join(stack_dir, skipped))
+    assert stats['bytes_decompressed'] == (sizes["PROC-STACK.h5"] if gz else 0)
+    assert (stats['time_saved_skipped'] is not None) == gz
+    assert not os.path.exists(os.path.join(stack_dir, "PROC-STACK.h5.gz"))
+
+
+def test_localize_errors(tmpdir):
+    with pytest.raises(RuntimeError):
+        get_stack_files('bogus')
+    with pytest.raises(RuntimeError):
+        StackLocalizer(str(tmpdir), str(tmpdir.join("Stack")), 'nsbas').start().wait()
@@ -0,0 +1,84 @@
+import sys
+import types
+import pickle
+import pytest
+import numpy as np
+from datetime import datetime
+
+from giant_time_series import meta
+from giant_time_series.synthetic import (get_orbit, write_ifg_xml,
+                                         write_baselines_pickle)
+
+
+class Catalog(dict):
+    """Stand-in for a catalog class of a module that is not importable."""
+    pass
+
+
+class Sensor(object):
+    def __init__(self, mission):
+        self.mission = mission
+
+
+def test_sensing_info(tmpdir):
+    sensing_mid = datetime(2017, 1, 13, 1, 50, 42, 500000)
+    svs = get_orbit(sensing_mid, 34., -118.)
+    ifg_xml = str(tmpdir.join("fine_interferogram.xml"))
+    write_ifg_xml(ifg_xml, 0.05546576, sensing_mid, svs)
+    wavelength, mid, heading_deg = meta.get_sensing_info(ifg_xml)
+    assert wavelength == 0.05546576
+    assert mid == sensing_mid
+    assert -15. < heading_deg < -5.
+
+
+def test_enu_heading_direction():
+    sensing_mid = datetime(2017, 1, 1)
+    for direction, lo, hi in (("ascending", -15., -5.), ("descending", -175., -165.)):
+        svs = get_orbit(sensing_mid, 34., -118., direction)
+        assert lo < meta.get_enu_heading(svs, sensing_mid) < hi
+
+    # state vector velocity due north over the equator
+    r = meta.WGS84_A + 700000.
+    svs = [(datetime(2017, 1, 1, 0, 0, i*10), np.array([r, 0., 7500.*i*10]),
+            np.array([0., 0., 7500.])) for i in range(3)]
+    assert meta.get_enu_heading(svs, datetime(2017, 1, 1, 0, 0, 5)) == pytest.approx(0., abs=1e-6)
+
+
+def test_missing_fields(tmpdir):
+    ifg_xml = str(tmpdir.join("fine_interferogram.xml"))
+    with open(ifg_xml, 'w') as f:
+        f.write("<productmanager_name><component name='instance'/></productmanager_name>")
+    assert meta.get_sensing_info(ifg_xml) is None
+
+
+def test_baseline_info(tmpdir):
+    cb_pkl = str(tmpdir.join("PICKLE", "computeBaselines"))
+    write_baselines_pickle(cb_pkl, 42.5, mission="S1B")
+    info = meta.get_baseline_info(cb_pkl)
+    assert info == {'bperp': 42.5, 'master_mission': 'S1B',
+                    'slave_mission': 'S1B', 'imagingmode': 'TOPS'}
+
+
+def test_catalog_stubs(tmpdir):
+    # pickle objects of a module that is removed before loading
+    mod = types.ModuleType("isceobj_fake")
+    Catalog.__module__ = Sensor.__module__ = mod.__name__
+    mod.Catalog, mod.Sensor = Catalog, Sensor
+    sys.modules[mod.__name__] = mod
+    catalog = Catalog(baseline={'Bperp at midrange for first common burst': 1.5},
+                      master={'sensor': {'mission': None, 'imagingmode': 'TOPS'}},
+                      slave={'sensor': {'mission': 'S1A', 'imagingmode': 'TOPS'}},
+                      obj=Sensor('S1A'))
+    cb_pkl = str(tmpdir.join("computeBaselines"))
+    try:
+        with open(cb_pkl, 'wb') as f:
+            pickle.dump(catalog, f, protocol=2)
+    finally:
+        del sys.modules[mod.__name__]
+    loaded = meta.load_catalog(cb_pkl)
+    assert loaded['obj'].mission == 'S1A'
+    assert loaded['master']['sensor']['imagingmode'] == 'TOPS'
+    info = meta.get_baseline_info(cb_pkl)
+    assert info['bperp'] == 1.5
+    assert info['master_mission'] is None
+    assert info['slave_mission'] == 'S1A'
@@ -0,0 +1,57 @@
+import numpy as np
+from datetime import datetime, timedelta
+
+from giant_time_series.network import get_epochs, get_components, get_epoch_baselines
+
+
+DATES = [datetime(2017, 1, 1) + timedelta(days=12*i) for i in range(6)]
+
+
+def test_components():
+    pairs = [(DATES[1], DATES[0]), (DATES[2], DATES[1]), (DATES[5], DATES[4]),
+             (DATES[4], DATES[3])]
+    epochs, edges = get_epochs(pairs)
+    assert epochs == DATES
+    assert edges.tolist() == [[1, 0], [2, 1], [5, 4], [4, 3]]
+    epochs, epoch_labels, pair_labels = get_components(pairs)
+    assert epoch_labels.tolist() == [0, 0, 0, 1, 1, 1]
+    assert pair_labels.tolist() == [0, 0, 1, 1]
+
+
+def test_epoch_baselines():
+    # consistent bperps are reproduced relative to the first epoch of each
+    # component
+    truth = np.array([0., 40., -25., 0., 10., 70.])
+    pairs = [(DATES[1], DATES[0]), (DATES[2], DATES[0]), (DATES[2], DATES[1]),
+             (DATES[4], DATES[3]), (DATES[5], DATES[4]), (DATES[5], DATES[3])]
+    bperps = [truth[DATES.index(s)] - truth[DATES.index(m)] for m, s in pairs]
+    assert np.allclose(get_epoch_baselines(pairs, bperps), truth - truth[[0, 0, 0, 3, 3, 3]])
+
+
+def test_analyze_network(tmpdir):
+    from giant_time_series.network import get_bridges, analyze_network, write_gaps
+
+    # repeated pair (0, 1) and the 3-4-5 loop are not bridges, (1, 2) is; no pair
+    # spans 2-3
+    pairs = [(DATES[1], DATES[0]), (DATES[1], DATES[0]), (DATES[2], DATES[1]),
+             (DATES[4], DATES[3]), (DATES[5], DATES[4]), (DATES[5], DATES[3])]
+    assert get_bridges(pairs) == [2]
+    network = analyze_network(pairs)
+    assert not network['connected']
+    assert network['redundancy'] == [2, 3, 1, 2, 2, 2]
+    assert network['gaps'] == [(DATES[2], DATES[3])]
+    assert [len(i) for i in network['components']] == [3, 3]
+    gap_file = str(tmpdir.join("gaps.txt"))
+    write_gaps(network, gap_file)
+    assert open(gap_file).read().startswith("Temporal gaps:\n{} - {}\n".format(DATES[2], DATES[3]))
+
+    # interleaved components cover time but are not connected
+    pairs = [(DATES[2], DATES[0]), (DATES[3], DATES[1])]
+    network = analyze_network(pairs)
+    assert network['gaps'] == [] and not network['connected']
+    assert get_bridges(pairs) == [0, 1]
+
+    # closing the gap connects the network
+    pairs = pairs + [(DATES[1], DATES[0])]
+    assert analyze_network(pairs)['connected']
+    assert get_bridges(pairs) == [0, 1, 2]
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+pytest.importorskip("scipy")
+
+from giant_time_series.sbas import get_design_matrix
+from giant_time_series.nsbas import get_model_matrix, get_tasks, invert_nsbas
+from giant_time_series.synthetic import write_stack_file
+
+
+def lstsq_reference(jmat, tims, data, gamma, nvalid):
+    """Per pixel least squares solution of the regularized system."""
+
+    design, model = get_design_matrix(jmat), get_model_matrix(tims)
+    nepoch, nparm = model.shape
+    reg = gamma * np.hstack([np.insert(np.eye(nepoch - 1), 0, 0., axis=0), -model])
+    ts = np.full((nepoch, data.shape[1]), np.nan)
+    parms = np.full((nparm, data.shape[1]), np.nan)
+    for p in range(data.shape[1]):
+        valid = np.isfinite(data[:, p])
+        if valid.sum() < nvalid: continue
+        a = np.vstack([np.hstack([design[valid], np.zeros((valid.sum(), nparm))]), reg])
+        b = np.concatenate([data[valid, p], np.zeros(nepoch)])
+        x = np.linalg.lstsq(a, b, rcond=None)[0]
+        ts[:, p] = np.insert(x[:nepoch-1], 0, 0.)
+        parms[:, p] = x[nepoch-1:]
+    return ts, parms
+
+
+def test_get_tasks():
+    data = np.ones((3, 10))
+    data[0, :4] = np.nan
+    data[:, 9] = np.nan
+    tasks = get_tasks(data, 1, 3)
+    pixels = sorted([p for task in tasks for group in task for p in group[2]])
+    assert pixels == list(range(9))
+    for task in tasks:
+        for key, pattern, piece, values in task:
+            assert values.shape == (pattern.sum(), len(piece))
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_invert_nsbas_parity(tmpdir, nproc):
+    stack_file = str(tmpdir.join("PROC-STACK.h5"))
+    ts_file = str(tmpdir.join("NSBAS-PARAMS.h5"))
+    write_stack_file(stack_file, 8, shape=(12, 10), span=2, nan_frac=.3, noise=1.)
+    stats = invert_nsbas(stack_file, ts_file, nvalid=3, gamma=.1, nproc=nproc,
+                         cache_entries=4, block_bytes=1024)
+    assert stats['pixels'] > 0 and stats['misses'] > 0 and stats['evictions'] > 0
+    assert 0. <= stats['hit_rate'] <= 1. and stats['pixels_per_s'] > 0.
+
+    with h5py.File(stack_file, 'r') as h5f:
+        jmat, tims = h5f['Jmat'][:], h5f['tims'][:]
+        data = h5f['figram'][:].astype(np.float64).reshape(len(jmat), -1)
+    data[:, np.arange(data.shape[1]) % 10 == 0] = np.nan
+    ref_ts, ref_parms = lstsq_reference(jmat, tims, data, .1, 3)
+    with h5py.File(ts_file, 'r') as h5f:
+        for name in ('rawts', 'recons', 'error'):
+            assert h5f[name].shape == (8, 12, 10) and h5f[name].dtype == np.float32
+        rawts, error = h5f['rawts'][:], h5f['error'][:]
+        parms = h5f['parms'][:]
+    assert np.allclose(rawts.reshape(8, -1), ref_ts, atol=1e-3, equal_nan=True)
+    assert np.allclose(parms.reshape(2, -1), ref_parms, atol=1e-3, equal_nan=True)
+    assert np.array_equal(np.isnan(error), np.isnan(rawts))
+    assert np.all(error[0][~np.isnan(error[0])] == 0.)
+    assert np.all(error[1:][~np.isnan(error[1:])] > 0.)
+
+
+def test_invert_nsbas_bridges_gaps(tmpdir):
+    # without ifgs spanning the middle epochs the regularization still
+    # recovers a linear deformation
+    stack_file = str(tmpdir.join("PROC-STACK.h5"))
+    ts_file = str(tmpdir.join("NSBAS-PARAMS.h5"))
+    write_stack_file(stack_file, 6, shape=(4, 4), span=1, nan_frac=0.)
+    with h5py.File(stack_file, 'r+') as h5f:
+        tims = h5f['tims'][:]
+        truth = 10. * tims[:, None, None] * np.ones((1, 4, 4))
+        figram = np.tensordot(h5f['Jmat'][:], truth, axes=1)
+        figram[2] = np.nan
+        h5f['figram'][:] = figram
+    invert_nsbas(stack_file, ts_file, gamma=1e-3, nproc=1)
+    with h5py.File(ts_file, 'r') as h5f:
+        assert np.allclose(h5f['rawts'][:, :, 1:], truth[:, :, 1:], atol=1e-3)
+        assert np.allclose(h5f['parms'][1, :, 1:], 10., atol=1e-3)
@@ -0,0 +1,103 @@
+import json
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+pytest.importorskip("scipy")
+
+from giant_time_series.partition import (get_partition_grid, get_partitions, write_plan,
+                                         crop_stack, set_partition_attrs, merge_partitions,
+                                         run_partitions)
+from giant_time_series.rechunk import rechunk_ts
+from giant_time_series.sbas import invert_sbas
+from giant_time_series.synthetic import write_stack_file
+
+
+def test_partitions():
+    assert get_partition_grid((100, 100), 4) == (2, 2)
+    assert get_partition_grid((100, 400), 4) == (1, 4)
+    partitions = get_partitions((50, 41), 6, overlap=3)
+    coverage = np.zeros((50, 41), dtype=int)
+    for p in partitions:
+        r0, r1, c0, c1 = p['core']
+        w0, w1, v0, v1 = p['window']
+        assert w0 == max(0, r0 - 3) and w1 == min(50, r1 + 3)
+        assert v0 == max(0, c0 - 3) and v1 == min(41, c1 + 3)
+        coverage[r0:r1, c0:c1] += 1
+    assert np.all(coverage == 1) and [p['index'] for p in partitions] == list(range(6))
+    with pytest.raises(RuntimeError):
+        get_partitions((2, 2), 9)
+
+
+def test_write_plan(tmpdir):
+    input_json_file = str(tmpdir.join("input.json"))
+    with open(input_json_file, "w") as f:
+        json.dump({'method': 'sbas', 'products': ['stack']}, f)
+    paths = write_plan(input_json_file, (100, 80), 4, out_dir=str(tmpdir))
+    assert len(paths) == 4 and paths[0].endswith("input.part000.json")
+    with open(paths[3]) as f:
+        job = json.load(f)
+    assert job['method'] == 'sbas' and job['partition']['index'] == 3
+    assert job['partition']['core'] == [50, 100, 40, 80]
+
+
+def test_crop_stack(tmpdir):
+    stack_file = str(tmpdir.join("PROC-STACK.h5"))
+    crop_file = str(tmpdir.join("crop.h5"))
+    write_stack_file(stack_file, 6, shape=(30, 20), chunks=(3, 8, 8))
+    crop_stack(stack_file, crop_file, [5, 17, 3, 20], block_bytes=100)
+    with h5py.File(stack_file, 'r') as src, h5py.File(crop_file, 'r') as dst:
+        assert np.array_equal(dst['figram'][:], src['figram'][:, 5:17, 3:20], equal_nan=True)
+        assert np.array_equal(dst['cmask'][:], src['cmask'][5:17, 3:20], equal_nan=True)
+        assert np.array_equal(dst['Jmat'][:], src['Jmat'][:])
+        assert dst['figram'].chunks == (3, 8, 8)
+
+
+def test_merge_partitions(tmpdir):
+    stack_file = str(tmpdir.join("PROC-STACK.h5"))
+    ref_file = str(tmpdir.join("LS-PARAMS.h5"))
+    write_stack_file(stack_file, 6, shape=(30, 20), nan_frac=.1, noise=1.)
+    invert_sbas(stack_file, ref_file, nvalid=3, filt=.05)
+    lats, lons = np.linspace(35., 34., 30), np.linspace(-118., -117., 20)
+
+    # partition files as the partition jobs write them (rechunked, with
+    # their window's coordinates)
+    ts_files = []
+    for p in get_partitions((30, 20), 4, overlap=2):
+        w0, w1, v0, v1 = p['window']
+        crop_file = str(tmpdir.join("crop{}.h5".format(p['index'])))
+        ts_file = str(tmpdir.join("part{}.h5".format(p['index'])))
+        crop_stack(stack_file, crop_file, p['window'])
+        invert_sbas(crop_file, ts_file, nvalid=3, filt=.05)
+        rechunk_ts(ts_file, lats[w0:w1], lons[v0:v1], 'both', nproc=1)
+        set_partition_attrs(ts_file, p)
+        ts_files.append(ts_file)
+
+    out_file = str(tmpdir.join("merged.h5"))
+    merged_lats, merged_lons = merge_partitions(ts_files, out_file)
+    assert np.allclose(merged_lats, lats) and np.allclose(merged_lons, lons)
+    rechunk_ts(out_file, merged_lats, merged_lons, nproc=1)
+    with h5py.File(out_file, 'r') as h5f, h5py.File(ref_file, 'r') as ref:
+        for name in ('rawts', 'recons', 'ifgcnt', 'cmask', 'dates'):
+            assert np.array_equal(h5f[name][:], ref[name][:], equal_nan=True), name
+        assert 'rawts_tiles' not in h5f and 'partition_core' not in h5f.attrs
+        assert h5f['rawts'].dims[1][0].name == "/lat"
+
+    # missing partitions are detected
+    with pytest.raises(RuntimeError):
+        merge_partitions(ts_files[:3], out_file)
+
+
+def test_run_partitions(tmpdir):
+    stack_file = str(tmpdir.join("PROC-STACK.h5"))
+    ref_file = str(tmpdir.join("ref.h5"))
+    out_file = str(tmpdir.join("NSBAS-PARAMS.h5"))
+    write_stack_file(stack_file, 6, shape=(24, 18), nan_frac=.1, noise=1.)
+    from giant_time_series.nsbas import invert_nsbas
+    invert_nsbas(stack_file, ref_file, nvalid=2, nproc=1)
+    ts_files = run_partitions(stack_file, out_file, 3, overlap=2, method='nsbas', nproc=2,
+                              nvalid=2)
+    assert len(ts_files) == 3
+    with h5py.File(out_file, 'r') as h5f, h5py.File(ref_file, 'r') as ref:
+        for name in ('rawts', 'error', 'parms'):
+            assert np.allclose(h5f[name][:], ref[name][:], atol=1e-5, equal_nan=True), name
@@ -0,0 +1,63 @@
+import os
+import pytest
+import numpy as np
+
+h5py = pytest.importorskip("h5py")
+pytest.importorskip("matplotlib")
+
+from giant_time_series.plot import get_stride, get_velocity, render_ts_browse
+from giant_time_series.synthetic import write_ts_file
+
+
+def test_stride():
+    assert get_stride((400, 300)) == 2
+    assert get_stride((400, 300), scale=1.) == 1
+    assert get_stride((10000, 300), max_size=2048) == 5
+
+
+def test_render_ts_browse(tmpdir):
+    from PIL import Image
+
+    h5_file = str(tmpdir.join("LS-PARAMS.h5"))
+    write_ts_file(h5_file, 6, shape=(60, 41), chunks=(6, 16, 16))
+    files = render_ts_browse(h5_file, str(tmpdir), last=True, velocity=True, small_size=10)
+    assert [os.path.basename(i) for i in files] == [
+        "browse.png", "browse_small.png", "browse_last.png", "browse_last_small.png",
+        "browse_velocity.png", "browse_velocity_small.png"]
+    assert Image.open(files[0]).size == (21, 30)
+    assert max(Image.open(files[1]).size) <= 10
+
+    # blockwise velocity matches a per pixel fit
+    with h5py.File(h5_file, 'r') as h5f:
+        ts, dates = h5f["rawts"][:], h5f["dates"][:]
+        velocity = get_velocity(h5f["rawts"], dates, 2, block_bytes=1)
+    years = (dates - dates[0]) / 365.25
+    for line, pixel in np.argwhere(~np.isnan(ts[0, ::2, ::2]))[:20]:
+        fit = np.polyfit(years, ts[:, line*2, pixel*2], 1)[0]
+        assert np.isclose(velocity[line, pixel], fit, rtol=1e-4)
+    assert np.isnan(velocity[np.isnan(ts[0, ::2, ::2])]).all()
+
+
+def test_plot_network(tmpdir):
+    from datetime import datetime, timedelta
+    from giant_time_series.plot import plot_stack, plot_network
+
+    # two disconnected components
+    dates = [datetime(2017, 1, 1) + timedelta(days=12*i) for i in range(6)]
+    pairs = [(dates[1], dates[0]), (dates[2], dates[0]), (dates[2], dates[1]),
+             (dates[4], dates[3]), (dates[5], dates[4])]
+    for name in ("browse.png", "network.png"):
+        png = str(tmpdir.join(name))
+        if name == "browse.png": plot_stack(pairs, png)
+        else: plot_network(pairs, [10., 30., 20., -5., 15.], png)
+        assert os.path.getsize(png) > 0
+
+
+def test_plot_sweep(tmpdir):
+    from giant_time_series.plot import plot_sweep
+
+    sweep = [{'cohth': a, 'covth': b, 'ifg_count': int(10 * (1. - a) * (1. - b)),
+              'connected': b < .6} for a in (.2, .4) for b in (.3, .6, .9)]
+    png = str(tmpdir.join("sweep.png"))
+    plot_sweep(sweep, png)
+    assert os.path.getsize(png) > 0
@@ -0,0 +1,45 @@
+import os
+import pytest
+import numpy as np
+
+from giant_time_series.quicklook import (select_frames, render_phase, write_animation,
+                                         write_browse_animation)
+from giant_time_series.synthetic import write_stack
+
+
+def test_select_frames():
+    assert select_frames(5, 10) == [0, 1, 2, 3, 4]
+    frames = select_frames(1000, 100)
+    assert len(frames) == 100 and frames[0] == 0 and frames[-1] == 999
+
+
+def test_write_animation(tmpdir):
+    from PIL import Image
+
+    pytest.importorskip("matplotlib")
+    phase = np.linspace(0., 20., 600).reshape(20, 30)
+    phase[:5, :5] = np.nan
+    rgb = render_phase(phase)
+    assert rgb.shape == (20, 30, 3) and rgb.dtype == np.uint8 and (rgb[:5, :5] == 0).all()
+    for ext in ("gif", "png"):
+        out_file = str(tmpdir.join("browse.{}".format(ext)))
+        write_animation([rgb, rgb[::-1], rgb[:10]], out_file)
+        img = Image.open(out_file)
+        assert img.size == (30, 20) and img.n_frames == 3
+
+
+def test_write_browse_animation(tmpdir):
+    from PIL import Image
+
+    pytest.importorskip("osgeo")
+    pytest.importorskip("matplotlib")
+    stack_dir = str(tmpdir)
+    prods = write_stack(stack_dir, 12, shape=(60, 80))
+    ifg_info = {}
+    for i, prod in enumerate(prods):
+        vrt = os.path.join(stack_dir, prod, "merged", "filt_topophase.unw.geo.vrt")
+        ifg_info["{:02d}".format(i)] = {'unw_vrt_out': vrt}
+    out_file = str(tmpdir.join("browse.gif"))
+    assert write_browse_animation(ifg_info, out_file, max_frames=5, max_size=40, nproc=2) == 5
+    img = Image.open(out_file)
+    assert img.size == (40, 30) and img.n_frames == 5
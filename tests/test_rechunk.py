@@ -0,0 +1,84 @@
+import os
+import pytest
+import numpy as np
+
+h5py = pytest.importorskip("h5py")
+
+from giant_time_series.rechunk import (LAYOUTS, TILE_SUFFIX, get_chunk_shape, rechunk_ts,
+                                       compress_h5, store_h5)
+from giant_time_series.synthetic import write_ts_file
+from giant_time_series.utils import prep_tds
+
+
+def test_chunk_shape():
+    assert get_chunk_shape((100, 2000, 3000), 4, 'pixel') == (100, 51, 51)
+    assert get_chunk_shape((100, 2000, 3000), 4, 'tile') == (1, 512, 512)
+    assert get_chunk_shape((5, 10, 20), 4, 'tile') == (1, 10, 20)
+    assert get_chunk_shape((100, 2000, 3000), 4, 'row') == (1, 87, 3000)
+    assert get_chunk_shape((5, 10, 20), 4, 'row') == (1, 10, 20)
+    with pytest.raises(RuntimeError):
+        get_chunk_shape((5, 10, 20), 4, 'bogus')
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_rechunk_ts(tmpdir, layout):
+    src = str(tmpdir.join("LS-PARAMS.h5"))
+    dst = str(tmpdir.join("out.h5"))
+    write_ts_file(src, 7, shape=(45, 38))
+    lats, lons = 34. - np.arange(45) * .001, -118. + np.arange(38) * .001
+    prep_tds(lats, lons, src)
+    with h5py.File(src, 'r') as h5f:
+        expected = dict([(k, h5f[k][:]) for k in ("dates", "rawts", "recons", "error", "time")])
+    chunks = rechunk_ts(src, layout=layout, out_file=dst, chunk_bytes=4096, nproc=2)
+    assert not os.path.exists(dst + ".rechunk")
+    with h5py.File(dst, 'r') as h5f:
+        assert np.array_equal(h5f["dates"][:], expected["dates"])
+        assert np.array_equal(h5f["time"][:], expected["time"])
+        assert np.array_equal(h5f["lat"][:], lats)
+        names = [(n, n) for n in ("rawts", "recons", "error")]
+        if layout == 'both': names += [(n + TILE_SUFFIX, n) for n in ("rawts", "recons", "error")]
+        assert sorted(chunks) == sorted([n for n, _ in names])
+        for name, orig in names:
+            dset = h5f[name]
+            assert dset.chunks == chunks[name] and dset.compression == "gzip" and dset.shuffle
+            assert np.array_equal(dset[:], expected[orig], equal_nan=True)
+            assert [d[0].name for d in dset.dims] == ["/time", "/lat", "/lon"]
+            assert dset.attrs["units"] == b"mm"
+        assert h5f["rawts"].chunks[0] == (7 if layout != 'tile' else 1)
+        assert h5f["lon"].attrs["units"] == b"degrees_east"
+
+
+@pytest.mark.parametrize("compression", ["gzip", "lzf"])
+def test_compress_h5(tmpdir, compression):
+    src = str(tmpdir.join("Stack", "PROC-STACK.h5"))
+    os.makedirs(os.path.dirname(src))
+    rng = np.random.RandomState(0)
+    igram = rng.normal(size=(9, 40, 33)).astype(np.float32)
+    with h5py.File(src, 'w') as h5f:
+        h5f.attrs["help"] = np.bytes_("stack")
+        dset = h5f.create_dataset("figram", data=igram)
+        dset.attrs["help"] = np.bytes_("filtered igrams")
+        h5f.create_dataset("dates", data=np.arange(5.))
+        h5f.create_dataset("Jmat", data=np.eye(9, 5, dtype=np.int8))
+        h5f.create_dataset("scalar", data=3.)
+        h5f.create_group("sub").create_dataset("ids", data=np.array([b"a", b"bc"]))
+    compress_h5(src, str(tmpdir.join("copy.h5")), chunk_bytes=2048,
+                compression=compression, nproc=2)
+    prod_file = store_h5(src, str(tmpdir), 'chunked', chunk_bytes=2048,
+                         compression=compression, nproc=2)
+    assert prod_file == str(tmpdir.join("PROC-STACK.h5")) and not os.path.exists(src)
+    for path in (prod_file, str(tmpdir.join("copy.h5"))):
+        with h5py.File(path, 'r') as h5f:
+            assert h5f.attrs["help"] == b"stack"
+            assert h5f["figram"].compression == compression
+            assert h5f["figram"].chunks == (1, 2048 // (33 * 4), 33)
+            assert np.array_equal(h5f["figram"][:], igram)
+            assert h5f["figram"].attrs["help"] == b"filtered igrams"
+            assert np.array_equal(h5f["dates"][:], np.arange(5.))
+            assert np.array_equal(h5f["Jmat"][:], np.eye(9, 5))
+            assert h5f["scalar"][()] == 3.
+            assert list(h5f["sub/ids"][:]) == [b"a", b"bc"]
+    with pytest.raises(RuntimeError):
+        store_h5(prod_file, str(tmpdir), 'bogus')
+    with pytest.raises(RuntimeError):
+        compress_h5(prod_file, str(tmpdir.join("both.h5")), layout='both')
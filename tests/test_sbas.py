@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+from giant_time_series.sbas import (get_design_matrix, get_pinv, group_pixels, invert_pixels,
+                                    read_sbas_xml, invert_sbas)
+from giant_time_series.synthetic import write_stack_file
+from giant_time_series.utils import prep_tds
+
+
+def lstsq_reference(jmat, data, nvalid):
+    """Per pixel least squares reference solution."""
+
+    design = get_design_matrix(jmat)
+    ts = np.full((design.shape[1], data.shape[1]), np.nan)
+    for p in range(data.shape[1]):
+        valid = np.isfinite(data[:, p])
+        if valid.sum() < nvalid: continue
+        ts[:, p] = np.linalg.lstsq(design[valid], data[valid, p], rcond=None)[0]
+    return ts
+
+
+def test_group_pixels():
+    valid = np.array([[1, 0, 1, 1], [1, 1, 1, 0], [0, 1, 0, 1]], dtype=bool)
+    patterns, order, counts = group_pixels(valid)
+    assert len(patterns) == 3 and sorted(counts.tolist()) == [1, 1, 2]
+    start = 0
+    for pattern, count in zip(patterns, counts):
+        for p in order[start:start+count]: assert np.array_equal(valid[:, p], pattern)
+        start += count
+
+
+@pytest.mark.parametrize("nvalid", [1, 8])
+def test_invert_pixels_parity(nvalid):
+    rng = np.random.RandomState(1)
+    jmat = np.zeros((12, 6))
+    for k, (i, j) in enumerate([(i, j) for i in range(6) for j in range(i + 1, 6)][:12]):
+        jmat[k, j], jmat[k, i] = 1., -1.
+    data = rng.normal(0., 10., (12, 500))
+    data[rng.uniform(size=data.shape) < .2] = np.nan
+    data[:, :3] = np.nan
+    cache, stats = {}, {}
+    ts, ifgcnt = invert_pixels(get_design_matrix(jmat), data, nvalid, cache, stats)
+    assert np.allclose(ts, lstsq_reference(jmat, data, nvalid), equal_nan=True)
+    assert np.array_equal(ifgcnt, np.isfinite(data).sum(axis=0))
+
+    # a second block reuses the cached factorizations
+    invert_pixels(get_design_matrix(jmat), data, nvalid, cache, stats)
+    assert stats['cache_hits'] >= stats['factorizations'] > 0
+
+
+def test_pinv_rank_deficient():
+    # disconnected network: minimum norm solution as lstsq
+    jmat = np.array([[-1., 1., 0., 0.], [0., 0., -1., 1.]])
+    design = get_design_matrix(jmat)
+    data = np.array([3., 5.])
+    assert np.allclose(np.dot(get_pinv(design), data),
+                       np.linalg.lstsq(design, data, rcond=None)[0])
+
+
+def test_read_sbas_xml(tmpdir):
+    xml_file = str(tmpdir.join("sbas.xml"))
+    with open(xml_file, "w") as f:
+        f.write("<params><proc><nvalid><value>5</value><type>INT</type></nvalid>"
+                "<filt><value>0.1</value></filt></proc></params>")
+    assert read_sbas_xml(xml_file) == {'nvalid': 5, 'filt': .1}
+
+
+def test_invert_sbas(tmpdir):
+    stack_file = str(tmpdir.join("PROC-STACK.h5"))
+    ts_file = str(tmpdir.join("LS-PARAMS.h5"))
+    dates, truth = write_stack_file(stack_file, 10, shape=(30, 20), chunks=(4, 8, 8))
+    stats = invert_sbas(stack_file, ts_file, nvalid=4, filt=.05, block_bytes=4096)
+    assert stats['factorizations'] > 0 and stats['cache_hits'] > 0
+
+    with h5py.File(stack_file, 'r') as h5f:
+        jmat, figram = h5f['Jmat'][:], h5f['figram'][:].astype(np.float64)
+    data = figram.reshape(len(jmat), -1)
+    data[:, np.arange(data.shape[1]) % 20 == 0] = np.nan
+    ref = lstsq_reference(jmat, data, 4)
+    with h5py.File(ts_file, 'r') as h5f:
+        rawts, recons = h5f['rawts'][:], h5f['recons'][:]
+        assert h5f['rawts'].dtype == np.float32 and rawts.shape == (10, 30, 20)
+        assert len(h5f['dates']) == 10 and h5f['ifgcnt'].shape == (30, 20)
+    assert np.allclose(rawts[1:].reshape(9, -1), ref, atol=1e-3, equal_nan=True)
+    assert np.all(np.isnan(rawts[:, :, 0]))
+
+    # noise free stack is recovered exactly where all ifgs are valid
+    full = np.isfinite(data).all(axis=0).reshape(30, 20)
+    assert np.allclose(rawts[:, full], truth[:, full], atol=1e-3)
+
+    # recons is smoothed in time, NaN where rawts is
+    assert np.array_equal(np.isnan(recons), np.isnan(rawts))
+    assert not np.allclose(recons[:, full], rawts[:, full])
+
+    # accepted by prep_tds
+    prep_tds(np.linspace(35., 34., 30), np.linspace(-118., -117., 20), ts_file)
+    with h5py.File(ts_file, 'r') as h5f:
+        assert h5f['rawts'].dims[0][0].name == "/time"
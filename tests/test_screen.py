@@ -0,0 +1,80 @@
+import pytest
+import numpy as np
+
+from giant_time_series.screen import read_window, get_ref_mean, get_column_counts
+
+
+class FakeBand(object):
+    """Minimal stand-in for a GDAL raster band backed by an array."""
+
+    def __init__(self, arr):
+        self.arr = arr
+        self.YSize, self.XSize = arr.shape
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        if xsize is None: xsize = self.XSize
+        if ysize is None: ysize = self.YSize
+        return self.arr[yoff:yoff+ysize, xoff:xoff+xsize].copy()
+
+
+def full_screen(cor, phs, rxlim, rylim, cohth, no_data):
+    """Original full-raster screening in filter_ifgs."""
+
+    mask = np.nan*np.ones(cor.shape)
+    mask[cor >= cohth] = 1.0
+    mask[phs == no_data] = np.nan
+    phs_ref = phs[rylim[0]:rylim[1], rxlim[0]:rxlim[1]]
+    mask_ref = mask[rylim[0]:rylim[1], rxlim[0]:rxlim[1]]
+    with np.errstate(all='ignore'):
+        phs_ref_mean = np.nanmean(phs_ref*mask_ref)
+    cov = np.sum(~np.isnan(mask), axis=0).max()/(mask.shape[0]*1.)
+    return phs_ref_mean, cov
+
+
+def make_ifg(seed, shape=(97, 61)):
+    rng = np.random.RandomState(seed)
+    cor = rng.uniform(0., 1., shape).astype(np.float32)
+    phs = rng.normal(0., 3., shape).astype(np.float32)
+    phs[rng.uniform(size=shape) < .3] = 0.
+    cor[rng.uniform(size=shape) < .05] = np.nan
+    return cor, phs
+
+
+@pytest.mark.parametrize("rxlim,rylim", [
+    ([20, 30], [40, 50]),
+    ([-5, 5], [40, 50]),
+    ([55, 70], [90, 110]),
+    ([-20, -10], [-30, -2]),
+])
+@pytest.mark.parametrize("block_rows", [1, 7, 1000])
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_screen_matches_full_read(rxlim, rylim, block_rows):
+    for seed in range(5):
+        cor, phs = make_ifg(seed)
+        for cohth in (0., .3, .9):
+            mean, cov = full_screen(cor, phs, rxlim, rylim, cohth, 0.)
+            cor_band, phs_band = FakeBand(cor), FakeBand(phs)
+            ref_mean = get_ref_mean(read_window(cor_band, rxlim, rylim),
+                                    read_window(phs_band, rxlim, rylim), cohth, 0.)
+            if np.isnan(mean):
+                assert np.isnan(ref_mean)
+            else:
+                assert ref_mean == pytest.approx(mean, rel=1e-12)
+                counts = get_column_counts(cor_band, phs_band, cohth, 0., block_rows)
+                assert counts.max()/(cor.shape[0]*1.) == cov
+
+
+def test_column_counts_blocking():
+    cor, phs = make_ifg(42)
+    expected = get_column_counts(FakeBand(cor), FakeBand(phs), .5, 0., 1000)
+    for block_rows in (1, 3, 50):
+        counts = get_column_counts(FakeBand(cor), FakeBand(phs), .5, 0., block_rows)
+        assert np.array_equal(counts, expected)
+
+
+def test_column_counts_out():
+    cor, phs = make_ifg(7)
+    out = (np.zeros(cor.shape, dtype=np.float32), np.zeros(phs.shape, dtype=np.float32))
+    counts = get_column_counts(FakeBand(cor), FakeBand(phs), (.3, .5), 0., 10, out=out)
+    assert np.array_equal(counts, get_column_counts(FakeBand(cor), FakeBand(phs), (.3, .5), 0.))
+    assert np.array_equal(out[0], cor, equal_nan=True) and np.array_equal(out[1], phs)
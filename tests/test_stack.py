@@ -0,0 +1,121 @@
+import os
+import pytest
+import numpy as np
+import h5py
+from datetime import datetime, timedelta
+
+from giant_time_series.utils import GeoGrid
+from giant_time_series.stack import (get_connectivity, get_pixel_files, open_pixel_files,
+                                     get_phase_scale, build_raw_stack)
+
+
+def test_connectivity():
+    pairs = [("20170101", "20170113"), ("20170113", "20170125"), ("20170101", "20170125")]
+    dates, jmat = get_connectivity(pairs)
+    assert [d.strftime("%Y%m%d") for d in dates] == ["20170101", "20170113", "20170125"]
+    assert np.array_equal(jmat, [[-1, 1, 0], [0, -1, 1], [-1, 0, 1]])
+
+
+def write_ifgs(pixel_dir, count, shape, seed=0):
+    """Write pixel cache files of count ifgs pairing consecutive 12-day
+       epochs and return their ifg info and (coherence, phase) rasters."""
+
+    rng = np.random.RandomState(seed)
+    grid = GeoGrid((-118.5, .001, 0., 34.5, 0., -.001), shape[1], shape[0]).to_dict()
+    dates = [(datetime(2017, 1, 1) + timedelta(days=12*i)).strftime("%Y%m%d")
+             for i in range(count + 1)]
+    ifg_info, rasters = {}, {}
+    for i in range(count):
+        cor = rng.uniform(0., 1., shape).astype(np.float32)
+        phs = rng.normal(0., 3., shape).astype(np.float32)
+        phs[rng.uniform(size=shape) < .2] = 0.
+        product = os.path.join(pixel_dir, "prod{}".format(i))
+        files = get_pixel_files(pixel_dir, product)
+        out = open_pixel_files(files, shape)
+        out[0][:], out[1][:] = cor, phs
+        out = None
+        dt_id = "{}_{}".format(dates[i], dates[i+1])
+        ifg_info[dt_id] = {
+            'product': product, 'start_dt': dates[i], 'stop_dt': dates[i+1],
+            'bperp': 10. * i, 'grid': grid, 'rxlim': [2, 7], 'rylim': [3, 9],
+            'cohth': .3, 'no_data': 0., 'wavelength': .05546576, 'pixels': files,
+        }
+        rasters[dt_id] = (cor, phs)
+    return ifg_info, rasters
+
+
+def test_build_raw_stack(tmpdir):
+    shape = (37, 23)
+    ifg_info, rasters = write_ifgs(str(tmpdir), 4, shape)
+
+    # reference mean recorded by filter_ifgs is used instead of reading it
+    ifg_info[sorted(ifg_info)[0]]['phs_ref_mean'] = 1.5
+    out_file = str(tmpdir.join("RAW-STACK.h5"))
+    stats = build_raw_stack(ifg_info, out_file, nproc=2, block_bytes=23 * 4 * 5,
+                            chunk_bytes=23 * 4 * 2)
+    # blocks of 5 rows are cut to whole 2 row chunks
+    assert stats['blocks'] == 4 * 10 and stats['cached_blocks'] == stats['blocks']
+    assert stats['bytes_read'] == 0
+    with h5py.File(out_file, 'r') as h5f:
+        igram = h5f['igram'][:]
+        assert igram.shape == (4,) + shape and h5f['igram'].chunks == (1, 2, 23)
+        for k, dt_id in enumerate(sorted(ifg_info)):
+            cor, phs = rasters[dt_id]
+            valid = (cor >= .3) & (phs != 0.)
+            ref_mean = ifg_info[dt_id].get('phs_ref_mean', None)
+            if ref_mean is None: ref_mean = phs[3:9, 2:7][valid[3:9, 2:7]].astype(np.float64).mean()
+            expected = np.where(valid, (phs - ref_mean) * get_phase_scale(.05546576), np.nan)
+            assert np.allclose(igram[k], expected, equal_nan=True, atol=1e-5)
+        assert np.array_equal(h5f['Jmat'][:], get_connectivity(
+            [(i['start_dt'], i['stop_dt']) for _, i in sorted(ifg_info.items())])[1])
+        assert np.array_equal(h5f['bperp'][:], [0., 10., 20., 30.])
+        assert len(h5f['dates']) == 5 and h5f['tims'][0] == 0.
+        assert np.allclose(h5f['tims'][1:], np.diff(h5f['dates'][:]).cumsum() / 365.25)
+        cmask = h5f['cmask'][:]
+        assert np.array_equal(np.isnan(cmask), ~np.isfinite(igram).any(axis=0))
+        assert h5f['igram'].attrs['help']
+
+
+def test_pixel_cache_matches_rasters(tmpdir, monkeypatch):
+    pytest.importorskip("osgeo")
+    from giant_time_series.filt import filter_ifgs
+    from giant_time_series.synthetic import write_stack
+
+    stack_dir = str(tmpdir)
+    monkeypatch.chdir(stack_dir)
+    prods = write_stack(stack_dir, 6, shape=(60, 80), dup_rate=.3)
+    filt_info = filter_ifgs(prods, 34.45, 34.49, -118.49, -118.43, 34.47, -118.46, 5, 5, .3, .2,
+                            100., 100., 39., .05, False, False, 64, nproc=2, pixel_dir="pixels")
+    ifg_info = filt_info['ifg_info']
+    assert all([i['pixels'] for i in ifg_info.values()])
+    assert len(os.listdir("pixels")) == 2 * len(ifg_info)
+    cached = build_raw_stack(ifg_info, "cached.h5", nproc=2)
+    for info in ifg_info.values(): info['pixels'] = None
+    read = build_raw_stack(ifg_info, "read.h5", nproc=2)
+    assert cached['cached_blocks'] == read['blocks'] and read['cached_blocks'] == 0
+    with h5py.File("cached.h5", 'r') as a, h5py.File("read.h5", 'r') as b:
+        assert np.array_equal(a['igram'][:], b['igram'][:], equal_nan=True)
+
+
+def test_pixel_cache_with_screen_cache(tmpdir, monkeypatch):
+    pytest.importorskip("osgeo")
+    from giant_time_series import filt
+    from giant_time_series.synthetic import write_stack
+
+    stack_dir = str(tmpdir)
+    monkeypatch.chdir(stack_dir)
+    prods = write_stack(stack_dir, 6, shape=(60, 80), dup_rate=.3)
+    runs = []
+    monkeypatch.setattr(filt, "log_stats", lambda stats, path: runs.append(stats))
+    for i in range(2):
+        filt_info = filt.filter_ifgs(prods, 34.45, 34.49, -118.49, -118.43, 34.47, -118.46, 5, 5,
+                                     .3, .2, 100., 100., 39., .05, False, False, 64, nproc=1,
+                                     cache="screen.db", pixel_dir="pixels")
+
+    # the rerun's column counts come from the screen cache but pixels are kept
+    assert runs[1]['columns']['misses'] == 0 and runs[1]['columns']['hits'] > 0
+    ifg_info = filt_info['ifg_info']
+    assert all([i['pixels'] for i in ifg_info.values()])
+    assert len(os.listdir("pixels")) == 2 * len(ifg_info)
+    stats = build_raw_stack(ifg_info, "RAW-STACK.h5", nproc=1)
+    assert stats['cached_blocks'] == stats['blocks'] and stats['bytes_read'] == 0
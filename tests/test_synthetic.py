@@ -0,0 +1,35 @@
+import os
+import json
+
+from giant_time_series.synthetic import write_stack
+
+
+def read_met(stack_dir, prod):
+    with open(os.path.join(stack_dir, prod, "{}.met.json".format(prod))) as f:
+        return json.load(f)
+
+
+def test_stack_layout(tmpdir):
+    stack_dir = str(tmpdir)
+    gt = (-118.5, .001, 0., 34.5, 0., -.001)
+    prods = write_stack(stack_dir, 20, shape=(8, 10), gt=gt, overlap=.5,
+                        dup_rate=.3, isce_meta=True)
+    assert len(prods) == 20
+    pairs = [tuple(p.split('-')[6:8]) for p in prods]
+    assert 1 < len(set(pairs)) < 20
+    for prod in prods:
+        met = read_met(stack_dir, prod)
+        lons = [i[0] for i in met['location']['coordinates'][0]]
+        lats = [i[1] for i in met['location']['coordinates'][0]]
+        assert abs(min(lons) - gt[0]) <= .5 * 10 * gt[1] + 1e-9
+        assert abs(max(lats) - gt[3]) <= .5 * 8 * -gt[5] + 1e-9
+        assert os.path.exists(os.path.join(stack_dir, prod, "PICKLE", "computeBaselines"))
+        assert os.path.getsize(os.path.join(stack_dir, prod, "merged", "phsig.cor.geo")) == 8 * 10 * 4
+
+
+def test_stack_defaults(tmpdir):
+    stack_dir = str(tmpdir)
+    prods = write_stack(stack_dir, 3, shape=(4, 4))
+    locs = [read_met(stack_dir, p)['location'] for p in prods]
+    assert locs[0] == locs[1] == locs[2]
+    assert len(set([tuple(p.split('-')[6:8]) for p in prods])) == 3
@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+pytest.importorskip("scipy")
+
+from giant_time_series import tiling
+from giant_time_series.tiling import get_tile_shape, get_tiles, invert_tiled
+from giant_time_series.sbas import invert_sbas
+from giant_time_series.nsbas import invert_nsbas
+from giant_time_series.synthetic import write_stack_file
+
+
+def test_tiles():
+    assert get_tile_shape((100, 90), 10, 4, (10, 8, 8), 10 * 4 * 400) == (24, 16)
+    assert get_tile_shape((100, 90), 10, 4, None, 10 * 4 * 400) == (20, 20)
+    assert get_tile_shape((5, 6), 10, 4, (10, 8, 8), 1) == (5, 6)
+    tiles = get_tiles((50, 30), (24, 16))
+    assert len(tiles) == 6 and tiles[-1] == (48, 50, 16, 30)
+    covered = np.zeros((50, 30), dtype=int)
+    for r0, r1, c0, c1 in tiles: covered[r0:r1, c0:c1] += 1
+    assert np.all(covered == 1)
+
+
+def assert_same(h5_file, ref_file, names):
+    with h5py.File(h5_file, 'r') as h5f, h5py.File(ref_file, 'r') as ref:
+        for name in names:
+            assert np.allclose(h5f[name][:], ref[name][:], atol=1e-4, equal_nan=True), name
+
+
+@pytest.fixture
+def stack_file(tmpdir):
+    path = str(tmpdir.join("PROC-STACK.h5"))
+    write_stack_file(path, 8, shape=(40, 30), span=2, chunks=(4, 8, 8), nan_frac=.1, noise=1.)
+    return path
+
+
+@pytest.mark.parametrize("method,nproc", [("sbas", 1), ("sbas", 2), ("nsbas", 1), ("nsbas", 2)])
+def test_invert_tiled(tmpdir, stack_file, method, nproc):
+    out_file = str(tmpdir.join("out.h5"))
+    ref_file = str(tmpdir.join("ref.h5"))
+    stats = invert_tiled(stack_file, out_file, method, nproc=nproc, tile_bytes=13 * 4 * 200,
+                         nvalid=3, filt=.05)
+    assert stats['tiles'] > 4 and stats['tiles_skipped'] == 0 and stats['retries'] == 0
+    assert not os.path.exists(out_file + tiling.JOURNAL_SUFFIX)
+    if method == 'sbas':
+        invert_sbas(stack_file, ref_file, nvalid=3, filt=.05)
+        assert_same(out_file, ref_file, ('rawts', 'recons', 'ifgcnt', 'dates', 'cmask'))
+    else:
+        invert_nsbas(stack_file, ref_file, nvalid=3, filt=.05, nproc=1)
+        assert_same(out_file, ref_file, ('rawts', 'recons', 'error', 'parms', 'ifgcnt'))
+
+
+_invert_tile = tiling.invert_tile
+
+
+def failing_tile(tile):
+    if tile[0] > 0: raise RuntimeError("failed")
+    return _invert_tile(tile)
+
+
+def dying_tile(tile):
+    marker = os.path.join(os.environ['TILING_TEST_DIR'], "died")
+    if tile[0] > 0 and not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return _invert_tile(tile)
+
+
+def test_restart(tmpdir, stack_file, monkeypatch):
+    out_file = str(tmpdir.join("out.h5"))
+    ref_file = str(tmpdir.join("ref.h5"))
+    invert_sbas(stack_file, ref_file, nvalid=3)
+
+    # an interrupted inversion resumes from its journal
+    monkeypatch.setattr(tiling, "invert_tile", failing_tile)
+    with pytest.raises(RuntimeError):
+        invert_tiled(stack_file, out_file, nproc=1, tile_bytes=13 * 4 * 200, nvalid=3)
+    assert os.path.exists(out_file + tiling.JOURNAL_SUFFIX)
+    monkeypatch.setattr(tiling, "invert_tile", _invert_tile)
+    stats = invert_tiled(stack_file, out_file, nproc=1, tile_bytes=13 * 4 * 200, nvalid=3)
+    assert 0 < stats['tiles_skipped'] < stats['tiles']
+    assert_same(out_file, ref_file, ('rawts', 'recons', 'ifgcnt'))
+
+    # other parameters do not resume
+    monkeypatch.setattr(tiling, "invert_tile", failing_tile)
+    with pytest.raises(RuntimeError):
+        invert_tiled(stack_file, out_file, nproc=1, tile_bytes=13 * 4 * 200, nvalid=3)
+    monkeypatch.setattr(tiling, "invert_tile", _invert_tile)
+    stats = invert_tiled(stack_file, out_file, nproc=1, tile_bytes=13 * 4 * 200, nvalid=4)
+    assert stats['tiles_skipped'] == 0
+
+
+def test_worker_death(tmpdir, stack_file, monkeypatch):
+    out_file = str(tmpdir.join("out.h5"))
+    ref_file = str(tmpdir.join("ref.h5"))
+    invert_sbas(stack_file, ref_file, nvalid=3)
+    monkeypatch.setenv("TILING_TEST_DIR", str(tmpdir))
+    monkeypatch.setattr(tiling, "invert_tile", dying_tile)
+    stats = invert_tiled(stack_file, out_file, nproc=2, tile_bytes=13 * 4 * 200, nvalid=3)
+    assert stats['retries'] == 1
+    assert_same(out_file, ref_file, ('rawts', 'recons', 'ifgcnt'))
@@ -1,6 +1,43 @@
-import pytest
+import numpy as np
 
+from giant_time_series.utils import GeoGrid
 
-def test_version():
-    import giant_time_series
-    assert giant_time_series.__version__ == "0.0.2"
+
+GT = (-118.5123, .000833333, 0., 34.6789, 0., -.000833333)
+
+
+def test_axes_match_loops():
+    grid = GeoGrid(GT, 37, 23)
+    lats = np.empty((23,))
+    lons = np.empty((37,))
+    for py in range(23):
+        lats[py] = GT[3] + (py * GT[5])
+    for px in range(37):
+        lons[px] = GT[0] + (px * GT[1])
+    assert np.array_equal(grid.lats, lats)
+    assert np.array_equal(grid.lons, lons)
+    assert grid.footprint(corners=True) == (lons[0], lons[-1], lats[-1], lats[0])
+
+
+def test_pixel_transforms():
+    grid = GeoGrid(GT, 37, 23)
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(34.6, 34.7, 100)
+    lons = rng.uniform(-118.52, -118.48, 100)
+    lines, pixels = grid.to_pixel(lats, lons)
+    for lat, lon, line, pixel in zip(lats, lons, lines, pixels):
+        assert line == int((lat - GT[3]) / GT[5])
+        assert pixel == int((lon - GT[0]) / GT[1])
+        assert grid.to_pixel(lat, lon) == (line, pixel)
+    back_lats, back_lons = grid.to_geo(lines, pixels)
+    assert np.array_equal(back_lats, grid.lats[0] + lines * GT[5])
+
+
+def test_window_and_dict():
+    grid = GeoGrid(GT, 37, 23)
+    lats, lons = grid.lats, grid.lons
+    assert grid.window(lats[10], lats[5], lons[3], lons[8]) == ([3, 8], [5, 10])
+    assert grid.window(0., 90., -180., 180.) == ([0, 37], [0, 23])
+    xlim, ylim = grid.window(0., 1., 0., 1.)
+    assert xlim[0] == xlim[1] or ylim[0] == ylim[1]
+    assert GeoGrid.from_dict(grid.to_dict()) == grid